@@ -0,0 +1,282 @@
+"""
+Long-lived local agent sharing one warm Service API client between certbot runs.
+
+The agent listens on a Unix socket and performs the DNS operations of the
+Authenticators configured with `--dns-noris-agent-socket`. Every API token gets
+one pooled session, zone index and rate limiter, which are shared by all
+certbot processes using that token.
+
+The protocol is one JSON object per line: a request with an `operation`, the
+`token` and the arguments of the operation, answered by `{"result": ...}` or
+`{"error": "..."}`.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple, cast
+
+from certbot import errors
+
+from certbot_dns_norisnetwork.agent_client import (
+    MAX_MESSAGE_SIZE,
+    decode_rr_ids,
+    encode_rr_ids,
+)
+from certbot_dns_norisnetwork.defaults import DEFAULT_CONCURRENCY, DEFAULT_POOL_SIZE
+from certbot_dns_norisnetwork.models import ZoneIndex
+from certbot_dns_norisnetwork.serviceapi import _ServiceAPIClient
+from certbot_dns_norisnetwork.storage import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = "/run/certbot-dns-noris/agent.sock"
+DEFAULT_ZONE_INDEX_TTL = 3600
+
+
+class Agent:
+    """
+    Dispatch agent requests to one Service API client per API token.
+
+    The DNS zones of an account are loaded again once the zone index is older
+    than `zone_index_ttl` seconds, so that new zones are picked up. With a
+    `response_cache_size`, every client keeps up to that many bytes of Service
+    API responses in memory and revalidates them with conditional requests.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        rate_limit: Optional[float] = None,
+        zone_index_ttl: float = DEFAULT_ZONE_INDEX_TTL,
+        response_cache_size: int = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.zone_index_ttl = zone_index_ttl
+        self.response_cache_size = response_cache_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (client, time of the last zone index refresh), keyed by token hash
+        self._clients: Dict[str, Tuple[_ServiceAPIClient, float]] = {}
+
+    def get_client(self, token: str) -> _ServiceAPIClient:
+        """
+        Get the shared Service API client of an API token.
+
+        :param str token: The API token.
+        :rtype: _ServiceAPIClient
+        """
+        key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        now = self._clock()
+        with self._lock:
+            if key not in self._clients:
+                logger.info("Creating Service API client for token %s", key[:16])
+                client = _ServiceAPIClient(
+                    token,
+                    pool_size=self.pool_size,
+                    concurrency=self.concurrency,
+                    rate_limit=self.rate_limit,
+                    zone_index=ZoneIndex(),
+                    response_cache=(
+                        ResponseCache(self.response_cache_size)
+                        if self.response_cache_size > 0
+                        else None
+                    ),
+                )
+                self._clients[key] = (client, now)
+            client, refreshed = self._clients[key]
+            if now - refreshed > self.zone_index_ttl:
+                client.reset_zone_index()
+                self._clients[key] = (client, now)
+        return client
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Perform a single agent request.
+
+        :param dict request: The decoded request.
+        :returns: The response, with either a `result` or an `error`.
+        :rtype: dict
+        """
+        try:
+            operation = request["operation"]
+            client = self.get_client(request["token"])
+            if operation == "add_txt_records":
+                rr_ids = client.add_txt_records(
+                    _records(request["records"]), int(request["ttl"])
+                )
+                return {"result": encode_rr_ids(rr_ids)}
+            if operation == "del_txt_records":
+                client.del_txt_records(
+                    _records(request["records"]),
+                    decode_rr_ids(request.get("known_rr_ids") or []),
+                )
+                return {"result": None}
+            if operation == "get_zone_name":
+                return {"result": client.get_zone_name(request["domain"])}
+            return {"error": f"Unknown operation: {operation}"}
+        except errors.PluginError as exc:
+            return {"error": str(exc)}
+        except (KeyError, TypeError, ValueError) as exc:
+            return {"error": f"Invalid request to the noris DNS agent: {exc!r}"}
+
+    def close(self) -> None:
+        """Close the connections of all clients."""
+        with self._lock:
+            for client, _ in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+def _records(records: List[List[str]]) -> List[Tuple[str, str, str]]:
+    if any(len(record) != 3 for record in records):
+        raise ValueError("Records must be (domain, record_name, record_content) lists")
+    return cast(List[Tuple[str, str, str]], [tuple(record) for record in records])
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "AgentServer"
+
+    def handle(self) -> None:
+        line = self.rfile.readline(MAX_MESSAGE_SIZE)
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("not an object")
+        except ValueError as exc:
+            response: Dict[str, Any] = {"error": f"Invalid request: {exc}"}
+        else:
+            response = self.server.agent.handle(request)
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class AgentServer(socketserver.ThreadingUnixStreamServer):
+    """Unix socket server handling every connection on its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, path: str, agent: Agent) -> None:
+        self.agent = agent
+        _remove_stale_socket(path)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        # Only the owner may use the agent, as it acts with the API tokens it was given.
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, _RequestHandler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self) -> None:
+        super().server_close()
+        try:
+            os.unlink(self.server_address)  # type: ignore
+        except OSError:
+            pass
+
+
+def _remove_stale_socket(path: str) -> None:
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+    else:
+        raise errors.Error(f"A noris DNS agent is already listening on {path}.")
+    finally:
+        probe.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run the noris DNS agent until it is terminated."""
+    parser = argparse.ArgumentParser(
+        prog="certbot-dns-noris-agent",
+        description="Share one warm noris network Service API client between "
+        "certbot runs using the dns-noris plugin.",
+    )
+    parser.add_argument(
+        "--socket",
+        default=DEFAULT_SOCKET_PATH,
+        help=f"Path of the Unix socket to listen on (default: {DEFAULT_SOCKET_PATH}).",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help="Maximum number of keep-alive connections to the Service API per token.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Maximum number of DNS zones looked up or updated in parallel per request.",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=None,
+        help="Maximum number of Service API requests per second and token.",
+    )
+    parser.add_argument(
+        "--zone-index-ttl",
+        type=int,
+        default=DEFAULT_ZONE_INDEX_TTL,
+        help="Number of seconds after which the DNS zones of an account are loaded again.",
+    )
+    parser.add_argument(
+        "--response-cache-size",
+        type=int,
+        default=0,
+        help="Maximum number of MiB of Service API responses kept in memory per "
+        "token and revalidated with conditional requests (default: 0, disabled).",
+    )
+    parser.add_argument("--verbose", "-v", action="store_true")
+    args = parser.parse_args(argv)
+    if args.rate_limit is not None and (
+        args.rate_limit < 0 or math.isnan(args.rate_limit)
+    ):
+        parser.error("--rate-limit must be a non-negative number")
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+    agent = Agent(
+        pool_size=args.pool_size,
+        concurrency=args.concurrency,
+        rate_limit=args.rate_limit,
+        zone_index_ttl=args.zone_index_ttl,
+        response_cache_size=args.response_cache_size * 2**20,
+    )
+    server = AgentServer(args.socket, agent)
+    signal.signal(
+        signal.SIGTERM,
+        lambda *_: threading.Thread(target=server.shutdown, daemon=True).start(),
+    )
+    logger.info("Listening on %s", args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        agent.close()
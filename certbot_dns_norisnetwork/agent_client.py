@@ -0,0 +1,133 @@
+"""Client of the long-lived noris DNS agent, see `certbot_dns_norisnetwork.agent`."""
+import json
+import logging
+import socket
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from certbot import errors
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AGENT_TIMEOUT = 600.0
+# Upper bound of a single request or response line
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+
+class AgentUnavailableError(errors.PluginError):
+    """The agent could not be reached, no request has been sent to it."""
+
+
+def encode_rr_ids(rr_ids: Dict[Tuple[int, str, str], int]) -> List[List[Any]]:
+    """
+    Convert RR IDs keyed by (zone_id, record_name, record_content) to JSON.
+
+    :param dict rr_ids: The RR IDs as returned by `add_txt_records`.
+    :rtype: list
+    """
+    return [[*key, dns_rr_id] for key, dns_rr_id in rr_ids.items()]
+
+
+def decode_rr_ids(rr_ids: List[List[Any]]) -> Dict[Tuple[int, str, str], int]:
+    """
+    Convert RR IDs from JSON back to a dict, the inverse of `encode_rr_ids`.
+
+    :param list rr_ids: [zone_id, record_name, record_content, rr_id] lists.
+    :rtype: dict
+    """
+    return {
+        (zone_id, record_name, record_content): dns_rr_id
+        for zone_id, record_name, record_content, dns_rr_id in rr_ids
+    }
+
+
+class AgentClient:
+    """
+    Send DNS operations to the noris DNS agent over its Unix socket.
+
+    Offers the same record operations as the Service API client, so that the
+    Authenticator can use either of them.
+    """
+
+    def __init__(
+        self, path: str, token: str, timeout: float = DEFAULT_AGENT_TIMEOUT
+    ) -> None:
+        self.path = path
+        self.token = token
+        self.timeout = timeout
+
+    def add_txt_records(
+        self, records: List[Tuple[str, str, str]], record_ttl: int
+    ) -> Dict[Tuple[int, str, str], int]:
+        """
+        Add several TXT records through the agent.
+
+        :param list records: (domain, record_name, record_content) tuples.
+        :param int record_ttl: The record TTL.
+        :returns: The IDs of the created RRs, keyed by (zone_id, record_name, record_content).
+        :rtype: dict
+        :raises certbot.errors.PluginError: if the agent or the Service API fails.
+        """
+        return decode_rr_ids(
+            self._request("add_txt_records", records=records, ttl=record_ttl)
+        )
+
+    def del_txt_records(
+        self,
+        records: List[Tuple[str, str, str]],
+        known_rr_ids: Optional[Dict[Tuple[int, str, str], int]] = None,
+    ) -> None:
+        """
+        Delete several TXT records through the agent.
+
+        :param list records: (domain, record_name, record_content) tuples.
+        :param dict known_rr_ids: IDs of RRs as returned by `add_txt_records`.
+        :raises certbot.errors.PluginError: if the agent or the Service API fails.
+        """
+        self._request(
+            "del_txt_records",
+            records=records,
+            known_rr_ids=encode_rr_ids(known_rr_ids or {}),
+        )
+
+    def get_zone_name(self, domain: str) -> str:
+        """
+        Get the name of the DNS zone of a domain through the agent.
+
+        :param str domain: The domain for which to find the managed zone.
+        :rtype: str
+        :raises certbot.errors.PluginError: if the DNS zone cannot be found.
+        """
+        return self._request("get_zone_name", domain=domain)
+
+    def close(self) -> None:
+        """Nothing to release: every request uses its own connection."""
+
+    def _request(self, operation: str, **arguments: Any) -> Any:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as exc:
+            sock.close()
+            raise AgentUnavailableError(
+                f"Unable to connect to the noris DNS agent at {self.path}: {exc}"
+            ) from exc
+
+        message = {"operation": operation, "token": self.token, **arguments}
+        logger.debug("Sending %s to the noris DNS agent", operation)
+        try:
+            with sock, sock.makefile("rb") as reader:
+                sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+                line = reader.readline(MAX_MESSAGE_SIZE)
+            response = json.loads(line)
+        except (OSError, ValueError) as exc:
+            raise errors.PluginError(
+                f"Invalid response from the noris DNS agent: {exc}"
+            ) from exc
+
+        if not isinstance(response, dict):
+            raise errors.PluginError("Invalid response from the noris DNS agent.")
+        if "error" in response:
+            raise errors.PluginError(response["error"])
+        return response.get("result")
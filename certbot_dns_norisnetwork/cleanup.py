@@ -0,0 +1,121 @@
+"""Deferred deletion of TXT records, through a cleanup journal."""
+# The functions extend the Service API client and use its internals.
+# pylint: disable=protected-access
+import logging
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from certbot import errors
+
+from certbot_dns_norisnetwork.serviceapi import _ServiceAPIClient, _ServiceAPIError
+from certbot_dns_norisnetwork.storage import CleanupJournal
+
+logger = logging.getLogger(__name__)
+
+
+def journal_txt_records(
+    client: _ServiceAPIClient,
+    journal: CleanupJournal,
+    records: List[Tuple[str, str, str]],
+    known_rr_ids: Optional[Dict[Tuple[int, str, str], int]] = None,
+) -> None:
+    """
+    Record TXT records in a cleanup journal, to be deleted later.
+
+    :param _ServiceAPIClient client: The client deleting the records.
+    :param CleanupJournal journal: The journal.
+    :param list records: The records to delete as (domain, record_name, record_content)
+        tuples, with the same meaning as the arguments of
+        `_ServiceAPIClient.del_txt_record`.
+    :param dict known_rr_ids: IDs of RRs as returned by `_ServiceAPIClient.add_txt_records`.
+    :raises certbot.errors.PluginError: if a DNS zone cannot be found.
+    :raises OSError: if the journal cannot be written.
+    """
+    with client._phase("cleanup"):
+        rrs_per_zone = client._group_records_by_zone(records)
+    known_rr_ids = known_rr_ids or {}
+    journal.append(
+        [
+            {
+                "zone_id": zone_id,
+                "dns_rrs_endpoint": dns_rrs_endpoint,
+                "record_name": record_name,
+                "record_content": record_content,
+                "rr_id": known_rr_ids.get((zone_id, record_name, record_content)),
+            }
+            for zone_id, (dns_rrs_endpoint, rrs) in rrs_per_zone.items()
+            for record_name, record_content in rrs
+        ]
+    )
+
+
+def drain_cleanup_journal(client: _ServiceAPIClient, journal: CleanupJournal) -> int:
+    """
+    Delete the TXT records of a cleanup journal, using a single request per DNS zone.
+
+    If the IDs of all records of a zone are known, they are deleted directly.
+    Otherwise, or if that fails because some of them are already gone, the
+    records still present in the zone are looked up first. Entries are only
+    removed from the journal once the records of their zone are deleted.
+
+    :param _ServiceAPIClient client: The client deleting the records.
+    :param CleanupJournal journal: The journal.
+    :returns: The number of journal entries that were processed.
+    :rtype: int
+    """
+    entries = journal.read()
+    entries_per_zone: Dict[int, List[Dict[str, Any]]] = {}
+    for entry in entries:
+        entries_per_zone.setdefault(entry["zone_id"], []).append(entry)
+
+    def delete(zone_id: int) -> bool:
+        zone_entries = entries_per_zone[zone_id]
+        try:
+            rr_ids = list(dict.fromkeys(entry["rr_id"] for entry in zone_entries))
+            if None not in rr_ids:
+                try:
+                    client._delete_txt_records(zone_id, rr_ids)
+                    return True
+                except _ServiceAPIError as exc:
+                    if not 400 <= exc.status_code < 500 or exc.status_code == 429:
+                        raise
+                    logger.debug(
+                        "Looking up the journaled TXT records of DNS zone %s: %s",
+                        zone_id,
+                        exc,
+                    )
+
+            existing = client._get_txt_rrs_index(
+                zone_entries[0]["dns_rrs_endpoint"],
+                [entry["record_name"] for entry in zone_entries],
+            )
+            dns_rr_ids = []
+            for entry in zone_entries:
+                record = existing.get(
+                    (entry["record_name"], f'"{entry["record_content"]}"')
+                )
+                if record is not None and record.id not in dns_rr_ids:
+                    dns_rr_ids.append(record.id)
+            if dns_rr_ids:
+                client._delete_txt_records(zone_id, dns_rr_ids)
+            return True
+        except errors.PluginError as exc:
+            logger.warning(
+                "Unable to delete the journaled TXT records of DNS zone %s: %s",
+                zone_id,
+                exc,
+            )
+            return False
+
+    with client._phase("cleanup"):
+        deleted = client._map_concurrently(
+            delete, entries_per_zone, "Unable to drain the cleanup journal"
+        )
+    processed = [
+        entry
+        for zone_id, done in deleted.items()
+        if done
+        for entry in entries_per_zone[zone_id]
+    ]
+    journal.remove(processed)
+    return len(processed)
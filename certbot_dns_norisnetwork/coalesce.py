@@ -0,0 +1,259 @@
+"""
+Coalescing of the DNS zone updates of concurrent certbot processes.
+
+Every process spools its PATCH request to a directory per DNS zone. The
+process that gets the lock of the zone becomes the leader: it waits for a
+short window, claims all spooled requests, sends them as a single PATCH and
+writes the result of every request back to the spool directory, where the
+other processes pick up their own result.
+"""
+
+import contextlib
+import logging
+import os
+import time
+import uuid
+
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from certbot import errors
+
+from certbot_dns_norisnetwork.defaults import DEFAULT_COALESCE_WINDOW
+from certbot_dns_norisnetwork.storage import read_json, write_json_atomic
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.05
+# Results of processes that exited before picking them up are removed after this
+STALE_RESULT_AGE = 3600
+# Status codes of a merged PATCH after which every request is sent on its own,
+# so that one invalid or conflicting request does not fail the others.
+SPLIT_STATUS_CODES = frozenset({400, 409, 422})
+
+
+class PatchError(errors.PluginError):
+    """The error response to a coalesced PATCH request."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def merge_patches(patches: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge the `_create` and `_delete` entries of several DNS zone PATCH requests.
+
+    :param list patches: The bodies of the PATCH requests.
+    :returns: The body of a single PATCH request with all entries.
+    :rtype: dict
+    """
+    attributes = [patch["_attributes"] for patch in patches]
+    log_messages = dict.fromkeys(
+        attribute["_log_message"]
+        for attribute in attributes
+        if attribute.get("_log_message")
+    )
+    return {
+        "_attributes": {
+            "_log_message": ", ".join(log_messages),
+            "_delete": [
+                entry for attribute in attributes for entry in attribute["_delete"]
+            ],
+            "_create": [
+                entry for attribute in attributes for entry in attribute["_create"]
+            ],
+        }
+    }
+
+
+class ZoneWriteCoalescer:
+    """
+    Merge the PATCH requests of concurrent processes to the same DNS zone.
+
+    Processes coalesce if they use the same spool directory, which must only
+    be shared by processes using the same API token: the leader sends the
+    requests of all processes with its own token. On platforms without
+    `fcntl` every request is sent on its own.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        window: float = DEFAULT_COALESCE_WINDOW,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.path = path
+        self.window = window
+        self._sleep = sleep
+
+    def patch(
+        self,
+        zone_id: int,
+        data: Dict[str, Any],
+        send: Callable[[Dict[str, Any]], Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """
+        Send a PATCH request to a DNS zone, together with those of other processes.
+
+        :param int zone_id: The ID of the DNS zone.
+        :param dict data: The body of the PATCH request.
+        :param callable send: Sends a PATCH request body to the DNS zone.
+        :returns: The response to the (merged) PATCH request.
+        :rtype: dict
+        :raises PatchError: if the Service API rejected the (merged) request.
+        :raises certbot.errors.PluginError: if the request was claimed by a
+            leader that exited without a result, or no result was written
+            for the request sent by this process.
+        """
+        if fcntl is None:  # pragma: no cover
+            return send(data)
+
+        zone_dir = os.path.join(self.path, f"zone-{zone_id}")
+        os.makedirs(zone_dir, mode=0o700, exist_ok=True)
+        request_id = uuid.uuid4().hex
+        write_json_atomic(self._request_path(zone_dir, request_id), data)
+
+        while True:
+            result = self._take_result(zone_dir, request_id)
+            if result is None:
+                with self._try_lock(zone_dir) as acquired:
+                    if not acquired:
+                        self._sleep(POLL_INTERVAL)
+                        continue
+                    result = self._take_result(zone_dir, request_id)
+                    if result is None:
+                        if not os.path.exists(self._request_path(zone_dir, request_id)):
+                            raise errors.PluginError(
+                                f"The update of DNS zone {zone_id} was claimed by a "
+                                "process that exited before sending it."
+                            )
+                        self._lead(zone_dir, send)
+                        result = self._take_result(zone_dir, request_id)
+                        if result is None:
+                            raise errors.PluginError(
+                                f"The update of DNS zone {zone_id} was sent "
+                                "without writing its result."
+                            )
+            return self._unpack(result)
+
+    def _lead(
+        self, zone_dir: str, send: Callable[[Dict[str, Any]], Dict[str, Any]]
+    ) -> None:
+        # Give concurrent processes the chance to add their requests.
+        self._sleep(self.window)
+        self._remove_stale_files(zone_dir)
+
+        claimed: Dict[str, Dict[str, Any]] = {}
+        for name in sorted(os.listdir(zone_dir)):
+            if not (name.startswith("req-") and name.endswith(".json")):
+                continue
+            request_id = name[len("req-") : -len(".json")]
+            claimed_path = self._claimed_path(zone_dir, request_id)
+            os.replace(os.path.join(zone_dir, name), claimed_path)
+            data = read_json(claimed_path)
+            if isinstance(data, dict) and isinstance(data.get("_attributes"), dict):
+                claimed[request_id] = data
+            else:
+                self._put_result(zone_dir, request_id, {"error": "Invalid request"})
+                os.unlink(claimed_path)
+
+        try:
+            if len(claimed) > 1:
+                logger.info(
+                    "Sending %d coalesced updates of DNS zone %s",
+                    len(claimed),
+                    os.path.basename(zone_dir),
+                )
+            for request_id, result in self._send(claimed, send).items():
+                self._put_result(zone_dir, request_id, result)
+        finally:
+            for request_id in claimed:
+                with contextlib.suppress(OSError):
+                    os.unlink(self._claimed_path(zone_dir, request_id))
+
+    def _send(
+        self,
+        requests: Dict[str, Dict[str, Any]],
+        send: Callable[[Dict[str, Any]], Dict[str, Any]],
+    ) -> Dict[str, Dict[str, Any]]:
+        try:
+            response = send(merge_patches(list(requests.values())))
+        except errors.PluginError as exc:
+            status_code = getattr(exc, "status_code", None)
+            if len(requests) > 1 and status_code in SPLIT_STATUS_CODES:
+                logger.info(
+                    "Coalesced update failed with status %s, sending the %d "
+                    "updates one by one",
+                    status_code,
+                    len(requests),
+                )
+                results = {}
+                for request_id, data in requests.items():
+                    results.update(self._send({request_id: data}, send))
+                return results
+            return {
+                request_id: {"error": str(exc), "status_code": status_code}
+                for request_id in requests
+            }
+        return {request_id: {"response": response} for request_id in requests}
+
+    @staticmethod
+    def _unpack(result: Dict[str, Any]) -> Dict[str, Any]:
+        if "error" in result:
+            raise PatchError(result["error"], result.get("status_code"))
+        return result.get("response") or {}
+
+    def _take_result(self, zone_dir: str, request_id: str) -> Optional[Dict[str, Any]]:
+        path = os.path.join(zone_dir, f"res-{request_id}.json")
+        if not os.path.exists(path):
+            return None
+        result = read_json(path)
+        os.unlink(path)
+        if not isinstance(result, dict):
+            return {"error": "Invalid result of the coalesced update"}
+        return result
+
+    @staticmethod
+    def _put_result(zone_dir: str, request_id: str, result: Dict[str, Any]) -> None:
+        write_json_atomic(os.path.join(zone_dir, f"res-{request_id}.json"), result)
+
+    @staticmethod
+    def _request_path(zone_dir: str, request_id: str) -> str:
+        return os.path.join(zone_dir, f"req-{request_id}.json")
+
+    @staticmethod
+    def _claimed_path(zone_dir: str, request_id: str) -> str:
+        return os.path.join(zone_dir, f"claimed-{request_id}.json")
+
+    @staticmethod
+    def _remove_stale_files(zone_dir: str) -> None:
+        # Only the leader holding the lock claims requests, so claimed requests
+        # found now belong to a leader that exited while sending them.
+        now = time.time()
+        for name in os.listdir(zone_dir):
+            path = os.path.join(zone_dir, name)
+            with contextlib.suppress(OSError):
+                if name.startswith("claimed-") or (
+                    name.startswith("res-")
+                    and os.path.getmtime(path) + STALE_RESULT_AGE < now
+                ):
+                    os.unlink(path)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _try_lock(zone_dir: str) -> Iterator[bool]:
+        with open(os.path.join(zone_dir, "leader.lock"), "a", encoding="utf-8") as lock:
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
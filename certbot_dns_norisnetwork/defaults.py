@@ -0,0 +1,10 @@
+"""Defaults of the options shared by the Authenticator, the agent and the tools."""
+DEFAULT_POOL_SIZE = 10
+
+DEFAULT_PROPAGATION_TIMEOUT = 300
+DEFAULT_PROPAGATION_MIN_SECONDS = 10
+DEFAULT_PROPAGATION_MAX_SECONDS = 600
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_CLEANUP_TIMEOUT = 30
+DEFAULT_COALESCE_WINDOW = 0.2
@@ -0,0 +1,142 @@
+"""
+Delegation of dns-01 challenges to a dedicated challenge zone.
+
+If `_acme-challenge.<domain>` is a CNAME to a name in a small DNS zone, the
+TXT records are created at the target of the CNAME, so that the large zone of
+the domain is neither changed nor listed. The target is either configured as
+challenge alias or looked up in the DNS.
+"""
+
+import logging
+
+from typing import Dict, Optional, Protocol
+
+from acme import challenges
+from certbot import errors
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of CNAMEs followed from a validation name
+MAX_CNAME_CHAIN = 8
+
+
+class CNAMEResolver(Protocol):
+    """Interface of the DNS lookups needed to follow a delegated validation name."""
+
+    def get_cname(self, name: str) -> Optional[str]:
+        """
+        Get the target of the CNAME of a name.
+
+        :param str name: The fully qualified name.
+        :returns: The target without trailing dot, or None if the name has no CNAME.
+        :raises certbot.errors.PluginError: if the lookup fails.
+        """
+
+
+class DNSPythonCNAMEResolver:
+    """CNAMEResolver implementation based on dnspython."""
+
+    def __init__(self, timeout: float = 5.0) -> None:
+        try:
+            import dns.resolver  # pylint: disable=import-outside-toplevel
+        except ImportError as exc:
+            raise errors.PluginError(
+                "Following the CNAME of the validation names requires dnspython. "
+                "Install it with `pip install certbot-dns-norisnetwork[propagation]`."
+            ) from exc
+        self._resolver = dns.resolver.Resolver()
+        self._resolver.lifetime = timeout
+
+    def get_cname(self, name: str) -> Optional[str]:
+        """Look up the target of the CNAME record of a name, if it has one."""
+        # pylint: disable=import-outside-toplevel
+        import dns.exception
+        import dns.resolver
+
+        try:
+            answer = self._resolver.resolve(name, "CNAME")
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            return None
+        except dns.exception.DNSException as exc:
+            raise errors.PluginError(
+                f"Unable to look up the CNAME of {name}: {exc}"
+            ) from exc
+        return str(answer[0].target).rstrip(".")
+
+
+def parse_aliases(value: Optional[str]) -> Dict[str, str]:
+    """
+    Parse the challenge aliases of the domains.
+
+    :param str value: Either a single alias for all domains, or comma-separated
+        `domain:alias` entries, each applying to the domain and its subdomains.
+    :returns: The aliases keyed by domain, with the empty domain matching all.
+    :rtype: dict
+    :raises certbot.errors.PluginError: if an entry is invalid.
+    """
+    aliases = {}
+    for entry in (value or "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        domain, _, alias = entry.rpartition(":")
+        alias = _normalize(alias)
+        if not alias:
+            raise errors.PluginError(f"Invalid challenge alias: {entry}")
+        aliases[_normalize(domain)] = alias
+    return aliases
+
+
+class ChallengeDelegation:
+    """
+    Map the validation names of domains to the names of their TXT records.
+
+    A configured alias `alias.example.net` of a domain maps its validation name
+    to `_acme-challenge.alias.example.net`. Domains without an alias follow the
+    CNAMEs of their validation name, if a resolver is given.
+    """
+
+    def __init__(
+        self, aliases: Dict[str, str], resolver: Optional[CNAMEResolver] = None
+    ) -> None:
+        self.aliases = aliases
+        self.resolver = resolver
+
+    def get_target(self, domain: str, validation_name: str) -> str:
+        """
+        Get the name at which the TXT record of a challenge is created.
+
+        :param str domain: The domain of the challenge.
+        :param str validation_name: The validation name, `_acme-challenge.<domain>`.
+        :returns: The name of the TXT record, the validation name if not delegated.
+        :rtype: str
+        :raises certbot.errors.PluginError: if the CNAMEs cannot be followed.
+        """
+        alias = self._get_alias(domain)
+        if alias is not None:
+            return f"{challenges.DNS01.LABEL}.{alias}"
+        if self.resolver is None:
+            return validation_name
+
+        name = validation_name
+        for _ in range(MAX_CNAME_CHAIN):
+            target = self.resolver.get_cname(name)
+            if target is None:
+                return name
+            name = target
+        raise errors.PluginError(
+            f"More than {MAX_CNAME_CHAIN} CNAMEs to follow from {validation_name}."
+        )
+
+    def _get_alias(self, domain: str) -> Optional[str]:
+        labels = _normalize(domain).split(".")
+        for i in range(len(labels)):
+            alias = self.aliases.get(".".join(labels[i:]))
+            if alias is not None:
+                return alias
+        return self.aliases.get("")
+
+
+def _normalize(name: str) -> str:
+    name = name.strip().rstrip(".").lower()
+    return name[2:] if name.startswith("*.") else name
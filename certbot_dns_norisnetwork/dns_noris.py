@@ -1,17 +1,58 @@
-"""DNS Authenticator for noris network."""
-import json
-import logging
-
-from typing import Any, Callable, Dict, Optional, Tuple
+"""DNS Authenticator for noris network.
 
-import requests
+Certbot imports every installed plugin on each invocation, also when this
+Authenticator is not used. This module therefore only imports the Service API
+client and the optional subsystems when a run needs them.
+"""
 
+import atexit
+import logging
+import math
+import sys
+import threading
+import time
+
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from acme import challenges
+from certbot import achallenges
 from certbot import errors
+from certbot.display import util as display_util
 from certbot.plugins import dns_common
 
+from certbot_dns_norisnetwork.defaults import (
+    DEFAULT_CLEANUP_TIMEOUT,
+    DEFAULT_COALESCE_WINDOW,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_PROPAGATION_MAX_SECONDS,
+    DEFAULT_PROPAGATION_MIN_SECONDS,
+    DEFAULT_PROPAGATION_TIMEOUT,
+)
+from certbot_dns_norisnetwork.tracing import NULL_TRACER, AnyTracer, Tracer
+
+if TYPE_CHECKING:  # pragma: no cover
+    from certbot_dns_norisnetwork.agent_client import AgentClient
+    from certbot_dns_norisnetwork.delegation import CNAMEResolver
+    from certbot_dns_norisnetwork.metrics import Metrics
+    from certbot_dns_norisnetwork.propagation import TXTResolver
+    from certbot_dns_norisnetwork.models import ZoneIndex
+    from certbot_dns_norisnetwork.serviceapi import _ServiceAPIClient
+    from certbot_dns_norisnetwork.storage import PropagationStats, ZoneCache
+
 logger = logging.getLogger(__name__)
 
-API_BASE_PATH = "https://service-api.noris.net/v1/api"
+_V = TypeVar("_V")
 
 
 class Authenticator(dns_common.DNSAuthenticator):
@@ -28,6 +69,32 @@ class Authenticator(dns_common.DNSAuthenticator):
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
         self.credentials: Optional[dns_common.CredentialsConfiguration] = None
+        self._client: Optional["_ServiceAPIClient"] = None
+        self._agent_client: Optional["AgentClient"] = None
+        self._agent_unavailable = False
+        self._zone_index: Optional["ZoneIndex"] = None
+        self._zone_cache: Optional["ZoneCache"] = None
+        # Resolver used to check the propagation of the records, dnspython by default
+        self.txt_resolver: Optional["TXTResolver"] = None
+        # Resolver used to follow the CNAMEs of the validation names, dnspython by default
+        self.cname_resolver: Optional["CNAMEResolver"] = None
+        # Names of the TXT records of delegated challenges, keyed by validation name
+        self._challenge_targets: Dict[str, str] = {}
+        self._propagation_stats: Optional["PropagationStats"] = None
+        # Fixed wait of the run by zone name, recorded with the validation outcome
+        self._propagation_waits: Dict[str, int] = {}
+        # (zone_name, record_name, record_content) of the records waited for
+        self._waited_records: List[Tuple[str, str, str]] = []
+        self._metrics: Optional["Metrics"] = None
+        self._tracer: AnyTracer = NULL_TRACER
+        # IDs of the RRs created by perform(), keyed by (zone_id, record_name, record_content)
+        self._created_rrs: Dict[Tuple[int, str, str], int] = {}
+        # Threads of the deferred cleanups with the metrics and trace of their runs,
+        # oldest first
+        self._cleanup_threads: List[
+            Tuple[threading.Thread, Optional["Metrics"], AnyTracer]
+        ] = []
+        self._cleanup_hook_registered = False
 
     @classmethod
     def add_parser_arguments(
@@ -35,6 +102,152 @@ class Authenticator(dns_common.DNSAuthenticator):
     ) -> None:
         super().add_parser_arguments(add, default_propagation_seconds)
         add("credentials", help="ServiceAPI credentials INI file.")
+        add(
+            "pool-size",
+            type=int,
+            default=DEFAULT_POOL_SIZE,
+            help="Maximum number of keep-alive connections to the Service API.",
+        )
+        add(
+            "concurrency",
+            type=int,
+            default=DEFAULT_CONCURRENCY,
+            help="Maximum number of DNS zones looked up or updated in parallel.",
+        )
+        add(
+            "zone-cache-ttl",
+            type=int,
+            default=0,
+            help="Number of seconds for which the DNS zone of a domain is cached "
+            "on disk between certbot runs (0 disables the cache).",
+        )
+        add(
+            "propagation-check",
+            action="store_true",
+            default=False,
+            help="Instead of waiting a fixed number of seconds, poll the authoritative "
+            "nameservers until they serve the TXT records (requires dnspython).",
+        )
+        add(
+            "propagation-timeout",
+            type=int,
+            default=DEFAULT_PROPAGATION_TIMEOUT,
+            help="Maximum number of seconds to poll the nameservers for with "
+            "--dns-noris-propagation-check.",
+        )
+        add(
+            "adaptive-propagation",
+            action="store_true",
+            default=False,
+            help="Learn the propagation time of every DNS zone from earlier runs "
+            "below the work directory and wait accordingly, instead of "
+            "--dns-noris-propagation-seconds for every zone.",
+        )
+        add(
+            "propagation-min-seconds",
+            type=int,
+            default=DEFAULT_PROPAGATION_MIN_SECONDS,
+            help="Minimum number of seconds to wait with --dns-noris-adaptive-propagation.",
+        )
+        add(
+            "propagation-max-seconds",
+            type=int,
+            default=DEFAULT_PROPAGATION_MAX_SECONDS,
+            help="Maximum number of seconds to wait with --dns-noris-adaptive-propagation.",
+        )
+        add(
+            "metrics-file",
+            default=None,
+            help="Write timing metrics of the run to this file, as JSON if it ends "
+            "with .json, otherwise in the Prometheus text format (e.g. for the "
+            "node exporter textfile collector).",
+        )
+        add(
+            "trace-file",
+            default=None,
+            help="Write a timeline of the run to this file, as OTLP JSON if it ends "
+            "with .otlp.json, otherwise in the Chrome trace event format (e.g. for "
+            "chrome://tracing or Perfetto).",
+        )
+        add(
+            "agent-socket",
+            default=None,
+            help="Send the DNS operations to the certbot-dns-noris-agent listening "
+            "on this Unix socket, falling back to direct Service API calls if the "
+            "agent is not reachable.",
+        )
+        add(
+            "coalesce-dir",
+            default=None,
+            help="Merge the updates of a DNS zone with those of concurrent certbot "
+            "processes using the same directory and API token into a single "
+            "Service API request.",
+        )
+        add(
+            "coalesce-window",
+            type=float,
+            default=DEFAULT_COALESCE_WINDOW,
+            help="Number of seconds to wait for the updates of concurrent certbot "
+            "processes with --dns-noris-coalesce-dir.",
+        )
+        add(
+            "deferred-cleanup",
+            action="store_true",
+            default=False,
+            help="Record the TXT records to delete in a journal below the work "
+            "directory and delete them in the background, instead of waiting for "
+            "the deletion. Records not deleted before certbot exits are deleted "
+            "by the next run. The deletion calls the Service API directly, also "
+            "with --dns-noris-agent-socket.",
+        )
+        add(
+            "cleanup-timeout",
+            type=int,
+            default=DEFAULT_CLEANUP_TIMEOUT,
+            help="Maximum number of seconds certbot waits at exit for the deferred "
+            "cleanup with --dns-noris-deferred-cleanup.",
+        )
+        add(
+            "deadline",
+            type=int,
+            default=0,
+            help="Maximum number of seconds for all Service API requests of a run, "
+            "split across the DNS zone lookup, the creation and the deletion of the "
+            "records (0 only limits every single request).",
+        )
+        add(
+            "hedge-delay",
+            type=float,
+            default=0,
+            help="Send lookups that the Service API has not answered within this "
+            "many seconds a second time and use the first response, e.g. the 95th "
+            "percentile of their latency (0 disables hedging).",
+        )
+        add(
+            "response-cache-size",
+            type=int,
+            default=0,
+            help="Maximum number of MiB of Service API responses kept below the "
+            "work directory and revalidated with conditional requests, so that "
+            "unchanged DNS zones and RRs are not downloaded again (0 disables "
+            "the cache).",
+        )
+        add(
+            "challenge-alias",
+            default=None,
+            help="Create the TXT records at _acme-challenge.ALIAS, to which "
+            "_acme-challenge.<domain> is a CNAME, instead of in the DNS zone of "
+            "the domain. Either a single ALIAS for all domains, or comma-separated "
+            "DOMAIN:ALIAS entries, each applying to the domain and its subdomains.",
+        )
+        add(
+            "challenge-cname",
+            action="store_true",
+            default=False,
+            help="Follow the CNAME of _acme-challenge.<domain> and create the TXT "
+            "records at its target, for domains without --dns-noris-challenge-alias "
+            "(requires dnspython).",
+        )
 
     def more_info(self) -> str:
         return "This plugin configures a DNS TXT record to respond to a dns-01 challenge using noris network Service API."  # pylint: disable=line-too-long
@@ -46,218 +259,517 @@ class Authenticator(dns_common.DNSAuthenticator):
             {"token": "noris API Token"},
         )
 
-    def _perform(self, domain: str, validation_name: str, validation: str) -> None:
-        self._get_serviceapi_client().add_txt_record(
-            domain, validation_name, validation, self.ttl
-        )
-
-    def _cleanup(self, domain: str, validation_name: str, validation: str) -> None:
-        self._get_serviceapi_client().del_txt_record(
-            domain, validation_name, validation
-        )
+    def perform(
+        self, achalls: List[achallenges.AnnotatedChallenge]
+    ) -> List[challenges.ChallengeResponse]:
+        self._setup_credentials()
+
+        self._attempt_cleanup = True
+
+        # The trace is written by cleanup(), which certbot also calls if perform() fails.
+        if self._tracer is NULL_TRACER and self.conf("trace-file"):
+            self._tracer = Tracer()
+        # Also with the agent, which makes the Service API requests itself.
+        self._get_metrics()
+
+        with self._tracer.span("perform", challenges=len(achalls)):
+            records = []
+            responses = []
+            for achall in achalls:
+                domain = achall.domain
+                validation_domain_name = achall.validation_domain_name(domain)
+                validation = achall.validation(achall.account_key)
+
+                records.append((domain, validation_domain_name, validation))
+                responses.append(achall.response(achall.account_key))
+            records = self._delegate(records)
+
+            # All records of a zone are created with a single PATCH request,
+            # instead of one request per challenge.
+            try:
+                self._created_rrs.update(
+                    self._call_api(lambda api: api.add_txt_records(records, self.ttl))
+                )
+            finally:
+                if self._zone_cache is not None:
+                    self._zone_cache.save()
+
+            self._wait_for_propagation(records)
+
+        return responses
+
+    def _wait_for_propagation(self, records: List[Tuple[str, str, str]]) -> None:
+        with self._tracer.span("propagation_wait", records=len(records)):
+            if self._metrics is None:
+                self._sleep_or_check_propagation(records)
+                return
+            # pylint: disable=import-outside-toplevel
+            from certbot_dns_norisnetwork.metrics import PROPAGATION_WAIT
+
+            with self._metrics.time(PROPAGATION_WAIT):
+                self._sleep_or_check_propagation(records)
+
+    def _sleep_or_check_propagation(self, records: List[Tuple[str, str, str]]) -> None:
+        if self.conf("propagation-check"):
+            try:
+                self._check_propagation(records)
+                return
+            except errors.PluginError as exc:
+                logger.warning(
+                    "Unable to check DNS propagation, falling back to waiting: %s", exc
+                )
+
+        seconds, zone_names = self._get_propagation_seconds(records)
+        display_util.notify(f"Waiting {seconds} seconds for DNS changes to propagate")
+        time.sleep(seconds)
+        # The records of all zones are validated together, after the longest wait.
+        self._propagation_waits = dict.fromkeys(zone_names.values(), seconds)
+        self._waited_records = [
+            (zone_names[domain], validation_name, validation)
+            for domain, validation_name, validation in records
+            if domain in zone_names
+        ]
+
+    def _get_propagation_seconds(
+        self, records: List[Tuple[str, str, str]]
+    ) -> Tuple[int, Dict[str, str]]:
+        seconds = self.conf("propagation-seconds")
+        if not self.conf("adaptive-propagation"):
+            return seconds, {}
+        try:
+            zone_names = self._get_zone_names(records)
+        except errors.PluginError as exc:
+            logger.warning("Unable to determine the DNS zones, not adapting: %s", exc)
+            return seconds, {}
+
+        # pylint: disable=import-outside-toplevel
+        from certbot_dns_norisnetwork.propagation import adaptive_wait
+
+        stats = self._get_propagation_stats()
+        waits = {
+            zone_name: adaptive_wait(
+                stats.samples(zone_name),
+                seconds,
+                self.conf("propagation-min-seconds"),
+                self.conf("propagation-max-seconds"),
+            )
+            for zone_name in set(zone_names.values())
+        }
+        for zone_name, wait in sorted(waits.items()):
+            logger.info("Learned propagation wait of %s: %d seconds", zone_name, wait)
+        return max(waits.values()), zone_names
+
+    def _get_propagation_stats(self) -> "PropagationStats":
+        if self._propagation_stats is None:
+            # pylint: disable=import-outside-toplevel
+            from certbot_dns_norisnetwork.storage import (
+                PropagationStats,
+                account_state_path,
+            )
 
-    def _get_serviceapi_client(self) -> "_ServiceAPIClient":
-        if not self.credentials:
-            raise errors.PluginError("Plugin has not been prepared.")
-        return _ServiceAPIClient(self.credentials.conf("token"))
+            self._propagation_stats = PropagationStats(
+                account_state_path(
+                    self.config.work_dir, "propagation", self._get_token()
+                )
+            )
+        return self._propagation_stats
 
+    def _get_propagation_outcomes(self, exc: Optional[BaseException]) -> Dict[str, str]:
+        """
+        Get the outcome of the fixed wait of every DNS zone of the run.
 
-class _ServiceAPIClient:
-    """
-    Encapsulates all communication with the Service API.
-    """
+        Must be called before the records are deleted, as the nameservers are
+        asked which zones serve them after a failed validation.
 
-    def __init__(self, token: str) -> None:
-        logger.debug("Creating ServiceAPIClient")
-        self.token = token
-        self.headers = {
-            "Content-Type": "application/json",
-            "X-noris-API-Token": self.token,
+        :param exc: The error certbot is handling, or None.
+        :returns: The outcomes keyed by zone name, without the zones whose
+            outcome is unknown.
+        :rtype: dict
+        """
+        if not self._propagation_waits:
+            return {}
+        # pylint: disable=import-outside-toplevel
+        from certbot_dns_norisnetwork.propagation import INVALID, VALID
+
+        zone_names = set(self._propagation_waits)
+        # certbot cleans up while the error of a failed validation is raised.
+        if exc is None:
+            return dict.fromkeys(zone_names, VALID)
+        if not isinstance(exc, errors.AuthorizationError):
+            return {}
+        unpropagated = self._get_unpropagated_zones()
+        if unpropagated is None:
+            # Without the nameservers, only the zone of a single-zone run is known.
+            return dict.fromkeys(zone_names, INVALID) if len(zone_names) == 1 else {}
+        return {
+            zone_name: INVALID if zone_name in unpropagated else VALID
+            for zone_name in zone_names
         }
 
-    def _api_request(
-        self,
-        method: str,
-        endpoint: str,
-        data: Optional[Dict[str, Any]] = None,
-        params: Optional[Dict[str, str]] = None,
-    ) -> Dict[str, Any]:
-        url = self._get_url(endpoint)
-        resp = requests.request(
-            method, url, headers=self.headers, json=data, params=params, timeout=120
-        )
-        logger.debug("API %s Request to URL: %s", method, url)
-
-        if resp.status_code >= 400:
-            raise errors.PluginError(
-                f"HTTP Error during API request at {url} with status code: {resp.status_code}"
+    def _save_propagation_stats(self, outcomes: Dict[str, str]) -> None:
+        for zone_name, outcome in sorted(outcomes.items()):
+            self._get_propagation_stats().add(
+                zone_name, self._propagation_waits[zone_name], outcome
             )
+        self._propagation_waits = {}
+        self._waited_records = []
+        if self._propagation_stats is not None:
+            self._propagation_stats.save()
+            self._propagation_stats = None
 
-        try:
-            response = resp.json()
-        except json.decoder.JSONDecodeError as exc:
-            raise errors.PluginError(f"{exc}: API response with non JSON: {resp.text}")
-        return response
-
-    def _get_url(self, endpoint: str) -> str:
-        return API_BASE_PATH + endpoint
+    def _get_unpropagated_zones(self) -> Optional[Set[str]]:
+        """
+        Get the DNS zones to blame for a failed validation after a fixed wait.
 
-    def _get_record_name(self, record_name, zone_name):
-        return record_name.replace(zone_name, "").rstrip(".")
+        certbot does not tell which challenges failed, so the nameservers are
+        asked once which zones still do not serve their records. The failure
+        may have other causes, and zones that serve their records are not
+        charged with it.
 
-    def add_txt_record(
-        self, domain: str, record_name: str, record_content: str, record_ttl: int
-    ) -> None:
+        :returns: The names of the zones, or None if the nameservers cannot be asked.
         """
-        Add a TXT record using the supplied information.
+        # pylint: disable=import-outside-toplevel
+        from certbot_dns_norisnetwork.propagation import (
+            DNSPythonResolver,
+            PropagationChecker,
+        )
 
-        :param str domain: The domain to use to look up the DNS zone.
-        :param str record_name: The record name (typically beginning with '_acme-challenge.').
-        :param str record_content: The record content (typically the challenge validation).
-        :param int record_ttl: The record TTL (number of seconds that the record may be cached).
-        :raises certbot.errors.PluginError: if an error occurs communicating with the Service API
-        """
+        zone_names = set(self._propagation_waits)
         try:
-            zone_id, zone_name, _ = self._find_managed_zone_id(domain)
-            logger.info("Domain found: DNS zone with id %s", zone_id)
+            if self.txt_resolver is None:
+                self.txt_resolver = DNSPythonResolver()
+            checker = PropagationChecker(self.txt_resolver, 0)
+            checker.wait(self._waited_records)
         except errors.PluginError as exc:
-            logger.error("Error finding DNS zone using the Service API: %s", exc)
-            raise
-
-        original_record_name = record_name
-        record_name = self._get_record_name(record_name, zone_name)
-        logger.info(
-            "Using record_name: %s from original: %s", record_name, original_record_name
+            logger.debug("Unable to find the DNS zones that failed: %s", exc)
+            return None
+        return zone_names - checker.elapsed.keys()
+
+    def _check_propagation(self, records: List[Tuple[str, str, str]]) -> None:
+        # pylint: disable=import-outside-toplevel
+        from certbot_dns_norisnetwork.propagation import (
+            PROPAGATED,
+            DNSPythonResolver,
+            PropagationChecker,
         )
 
-        logger.info("Insert new TXT record with name %s.", record_name)
-        self._insert_txt_record(zone_id, record_name, record_content, record_ttl)
-
-    def del_txt_record(
-        self, domain: str, record_name: str, record_content: str
-    ) -> None:
+        if self.txt_resolver is None:
+            self.txt_resolver = DNSPythonResolver()
+        checker = PropagationChecker(
+            self.txt_resolver, self.conf("propagation-timeout")
+        )
+        display_util.notify(
+            "Waiting for the nameservers to serve the DNS changes "
+            f"(at most {self.conf('propagation-timeout')} seconds)"
+        )
+        zone_names = self._get_zone_names(records)
+        checker.wait(
+            (zone_names[domain], validation_name, validation)
+            for domain, validation_name, validation in records
+        )
+        if self.conf("adaptive-propagation"):
+            stats = self._get_propagation_stats()
+            for zone_name, seconds in checker.elapsed.items():
+                stats.add(zone_name, seconds, PROPAGATED)
+
+    def _delegate(
+        self, records: List[Tuple[str, str, str]]
+    ) -> List[Tuple[str, str, str]]:
         """
-        Delete a TXT record using the supplied information.
+        Move the records of delegated challenges to the target of their CNAME.
 
-        :param str domain: The domain to use to look up the managed zone.
-        :param str record_name: The record name (typically beginning with '_acme-challenge.').
-        :param str record_content: The record value normalized with double quotes.
-        :raises certbot.errors.PluginError: if an error occurs communicating with the ISPConfig API
+        :param list records: (domain, validation_name, validation) tuples.
+        :returns: The records, with the target of a delegated record as both its
+            domain, used to find the DNS zone, and its name.
+        :rtype: list
         """
-        try:
-            zone_id, zone_name, dns_rrs_endpoint = self._find_managed_zone_id(domain)
-            logger.info("Domain found: DNS zone with id %s", zone_id)
-        except errors.PluginError as exc:
-            logger.error("Error finding DNS zone using the Service API: %s", exc)
-            raise
-
-        original_record_name = record_name
-        record_name = self._get_record_name(record_name, zone_name)
-        logger.info(
-            "Using record_name: %s from original: %s", record_name, original_record_name
-        )
-
-        record = self.get_existing_txt_rrs(
-            dns_rrs_endpoint, record_name, record_content
-        )
-
-        if record is not None:
-            logger.info("Delete TXT record with ID: %s", record["id"])
-            self._delete_txt_record(zone_id, record["id"])
-
-    def _prepare_rr_data(
-        self, record_name: str, record_content: str, record_ttl: int
-    ) -> Dict[str, Any]:
-        rr_data = {
-            "_attributes": {
-                "_log_message": "dns-01 challenge",
-                "_delete": [],
-                "_create": [
-                    {
-                        "name": record_name,
-                        "type": "TXT",
-                        "ttl": record_ttl,
-                        "rdata": f'"{record_content}"',
-                    }
-                ],
-            }
-        }
-        return rr_data
+        if not self.conf("challenge-alias") and not self.conf("challenge-cname"):
+            return records
+        # pylint: disable=import-outside-toplevel
+        from certbot_dns_norisnetwork.delegation import (
+            ChallengeDelegation,
+            DNSPythonCNAMEResolver,
+            parse_aliases,
+        )
 
-    def _insert_txt_record(
-        self, zone_id: int, record_name: str, record_content: str, record_ttl: int
-    ) -> None:
-        rr_data = self._prepare_rr_data(record_name, record_content, record_ttl)
-        endpoint = f"/data/dns/zone/{zone_id}/"
-        self._api_request("PATCH", endpoint, rr_data)
-
-    def _delete_txt_record(self, zone_id: int, dns_rr_id: int) -> None:
-        del_data = {
-            "_attributes": {
-                "_create": [],
-                "_delete": [{"id": dns_rr_id}],
-                "_log_message": "dns-01 challenge delete",
-            }
+        if self.conf("challenge-cname") and self.cname_resolver is None:
+            self.cname_resolver = DNSPythonCNAMEResolver()
+        delegation = ChallengeDelegation(
+            parse_aliases(self.conf("challenge-alias")),
+            self.cname_resolver if self.conf("challenge-cname") else None,
+        )
+        delegated = []
+        for domain, validation_name, validation in records:
+            # The cleanup uses the targets of perform(), without looking them up again.
+            target = self._challenge_targets.get(validation_name)
+            if target is None:
+                target = delegation.get_target(domain, validation_name)
+                self._challenge_targets[validation_name] = target
+                if target != validation_name:
+                    logger.info(
+                        "Creating the TXT record of %s at %s", validation_name, target
+                    )
+            if target == validation_name:
+                delegated.append((domain, validation_name, validation))
+            else:
+                delegated.append((target, target, validation))
+        return delegated
+
+    def _get_zone_names(self, records: List[Tuple[str, str, str]]) -> Dict[str, str]:
+        def get_zone_name(domain: str) -> str:
+            return self._call_api(lambda api: api.get_zone_name(domain))
+
+        return {
+            domain: get_zone_name(domain)
+            for domain in dict.fromkeys(domain for domain, _, _ in records)
         }
-        endpoint = f"/data/dns/zone/{zone_id}/"
-        self._api_request("PATCH", endpoint, del_data)
 
-    def _find_managed_zone_id(self, domain: str) -> Tuple[int, str, str]:
-        """
-        Find the DNS zone for a given domain.
+    def _perform(self, domain: str, validation_name: str, validation: str) -> None:
+        self._get_serviceapi_client().add_txt_record(
+            domain, validation_name, validation, self.ttl
+        )
 
-        :param str domain: The domain for which to find the managed zone.
-        :returns: The ID of the managed zone, if found.
-        :rtype: str
-        :raises certbot.errors.PluginError: if the DNS zone cannot be found.
-        """
+    def _cleanup(self, domain: str, validation_name: str, validation: str) -> None:
+        self._get_serviceapi_client().del_txt_record(
+            domain, validation_name, validation
+        )
 
-        logger.info("Looking for the DNS zone of domain: %s.", domain)
+    def cleanup(self, achalls: List[achallenges.AnnotatedChallenge]) -> None:
+        # The error certbot is handling, e.g. the AuthorizationError of a failed validation
+        exc = sys.exc_info()[1]
+        # Determined while the nameservers may still serve the records
+        propagation_outcomes = self._get_propagation_outcomes(exc)
         try:
-            zone_info = self._api_request(
-                "GET",
-                "/data/dns/zone/",
-                params={"_query": json.dumps({"for_fqdn": domain})},
-            )
-            zone_id = zone_info["_data"][0]["id"]
-            zone_name = zone_info["_data"][0]["name_idna"]
-            dns_rrs_endpoint = zone_info["_data"][0]["_links"][0]["href"]
-        except IndexError as exc:
-            # An API request for a domain that is not managed either by the user
-            # or by noris returns a successful (status_code 200), but empty response.
-            # e.g. {"data": [], "recordsFiltered": 0}
-            logger.warning("%s: Domain %s not related to a known DNS zone", exc, domain)
-            raise errors.PluginError(
-                f"Unable to determine managed DNS zone for {domain}."
-            )
-
-        return zone_id, zone_name, dns_rrs_endpoint
+            with self._tracer.span("cleanup", challenges=len(achalls)):
+                if self._attempt_cleanup:
+                    records = []
+                    for achall in achalls:
+                        domain = achall.domain
+                        validation_domain_name = achall.validation_domain_name(domain)
+                        validation = achall.validation(achall.account_key)
+
+                        records.append((domain, validation_domain_name, validation))
+                    records = self._delegate(records)
+
+                    if records and self.conf("deferred-cleanup"):
+                        self._defer_cleanup(records)
+                    elif records:
+                        self._call_api(
+                            lambda api: api.del_txt_records(records, self._created_rrs)
+                        )
+        finally:
+            self._created_rrs.clear()
+            self._challenge_targets.clear()
+            self._save_propagation_stats(propagation_outcomes)
+            self._close_serviceapi_client()
+            self._write_metrics()
+            self._write_trace()
+
+    def _defer_cleanup(self, records: List[Tuple[str, str, str]]) -> None:
+        # pylint: disable=import-outside-toplevel
+        from certbot_dns_norisnetwork.cleanup import (
+            drain_cleanup_journal,
+            journal_txt_records,
+        )
+        from certbot_dns_norisnetwork.storage import CleanupJournal, account_state_path
 
-    def get_existing_txt_rrs(
-        self, endpoint: str, record_name: str, record_content: str
-    ) -> Optional[Dict[str, Any]]:
+        # Also with an agent: the drain thread outlives the run and needs a client
+        # of its own, and the journal is local to this host.
+        client = self._get_serviceapi_client()
+        journal = CleanupJournal(
+            account_state_path(self.config.work_dir, "cleanup", self._get_token())
+        )
+        try:
+            journal_txt_records(client, journal, records, self._created_rrs)
+        except OSError as exc:
+            logger.warning(
+                "Unable to write the cleanup journal, deleting the records now: %s", exc
+            )
+            client.del_txt_records(records, self._created_rrs)
+            return
+
+        # The thread owns the client from now on, and drains the whole journal,
+        # including the records left behind by earlier runs.
+        self._client = None
+
+        def drain() -> None:
+            try:
+                with client.tracer.span("deferred_cleanup"):
+                    drain_cleanup_journal(client, journal)
+            finally:
+                client.close()
+
+        thread = threading.Thread(target=drain, name="dns-noris-cleanup", daemon=True)
+        thread.start()
+        self._cleanup_threads.append((thread, client.metrics, client.tracer))
+        if not self._cleanup_hook_registered:
+            atexit.register(self._wait_for_deferred_cleanup)
+            self._cleanup_hook_registered = True
+
+    def _wait_for_deferred_cleanup(self) -> None:
+        deadline = time.monotonic() + self.conf("cleanup-timeout")
+        for thread, metrics, tracer in self._cleanup_threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+            if thread.is_alive():
+                logger.info(
+                    "Deferred cleanup still running, the remaining TXT records "
+                    "are deleted by the next run."
+                )
+                continue
+            # cleanup() wrote the metrics and the trace before the records were deleted.
+            if metrics is not None:
+                metrics.write(self.conf("metrics-file"))
+            if isinstance(tracer, Tracer):
+                tracer.write(self.conf("trace-file"))
+        self._cleanup_threads = []
+
+    def _get_metrics(self) -> Optional["Metrics"]:
+        if self._metrics is None and self.conf("metrics-file"):
+            # pylint: disable=import-outside-toplevel
+            from certbot_dns_norisnetwork.metrics import Metrics
+
+            self._metrics = Metrics()
+        return self._metrics
+
+    def _write_metrics(self) -> None:
+        if self._metrics is not None:
+            self._metrics.write(self.conf("metrics-file"))
+            self._metrics = None
+
+    def _write_trace(self) -> None:
+        if isinstance(self._tracer, Tracer):
+            self._tracer.write(self.conf("trace-file"))
+            self._tracer = NULL_TRACER
+
+    def _call_api(self, func: Callable[[Any], _V]) -> _V:
         """
-        Get existing TXT records from the RRset for the record name.
+        Call the noris DNS agent, or the Service API if no agent is reachable.
 
-        If an error occurs while requesting the record set, it is suppressed
-        and None is returned.
+        :param callable func: Performs the operation on an `AgentClient` or a
+            `_ServiceAPIClient`.
+        :returns: The result of `func`.
+        """
+        agent_client = self._get_agent_client()
+        if agent_client is not None:
+            # pylint: disable=import-outside-toplevel
+            from certbot_dns_norisnetwork.agent_client import AgentUnavailableError
+
+            try:
+                return func(agent_client)
+            except AgentUnavailableError as exc:
+                logger.warning(
+                    "Falling back to direct Service API calls for this run: %s", exc
+                )
+                self._agent_client = None
+                self._agent_unavailable = True
+        return func(self._get_serviceapi_client())
+
+    def _get_agent_client(self) -> Optional["AgentClient"]:
+        if self._agent_unavailable or not self.conf("agent-socket"):
+            return None
+        if not self.credentials:
+            raise errors.PluginError("Plugin has not been prepared.")
+        if self._agent_client is None:
+            # pylint: disable=import-outside-toplevel
+            from certbot_dns_norisnetwork.agent_client import AgentClient
 
-        :param str endpoint: The endpoint to get DNS RRs for the specific zone ID.
-        :param str record_name: The record name (typically beginning with '_acme-challenge.').
-        :param str record_content: The record value normalized with double quotes.
+            self._agent_client = AgentClient(
+                self.conf("agent-socket"), self._get_token()
+            )
+        return self._agent_client
 
-        :returns: TXT record value or None
-        :rtype: `string` or `None`
+    def _get_serviceapi_client(self) -> "_ServiceAPIClient":
+        if not self.credentials:
+            raise errors.PluginError("Plugin has not been prepared.")
+        if self._client is None:
+            # pylint: disable=import-outside-toplevel
+            from certbot_dns_norisnetwork.coalesce import ZoneWriteCoalescer
+            from certbot_dns_norisnetwork.limits import DeadlineBudget
+            from certbot_dns_norisnetwork.models import ZoneIndex
+            from certbot_dns_norisnetwork.serviceapi import _ServiceAPIClient
+            from certbot_dns_norisnetwork.storage import (
+                ResponseCache,
+                ZoneCache,
+                account_state_path,
+            )
 
-        """
+            token = self._get_token()
+            if self._zone_index is None:
+                self._zone_index = ZoneIndex()
+            if self._zone_cache is None and self.conf("zone-cache-ttl") > 0:
+                self._zone_cache = ZoneCache(
+                    account_state_path(self.config.work_dir, "zones", token),
+                    self.conf("zone-cache-ttl"),
+                )
+            coalescer = None
+            if self.conf("coalesce-dir"):
+                coalescer = ZoneWriteCoalescer(
+                    account_state_path(
+                        self.conf("coalesce-dir"), "spool", token, suffix=""
+                    ),
+                    self.conf("coalesce-window"),
+                )
+            self._client = _ServiceAPIClient(
+                token,
+                rate_limit=self._get_rate_limit(),
+                pool_size=self.conf("pool-size"),
+                concurrency=self.conf("concurrency"),
+                zone_index=self._zone_index,
+                zone_cache=self._zone_cache,
+                metrics=self._get_metrics(),
+                tracer=self._tracer,
+                coalescer=coalescer,
+                deadline=(
+                    DeadlineBudget(self.conf("deadline"))
+                    if self.conf("deadline") > 0
+                    else None
+                ),
+                hedge_delay=self.conf("hedge-delay"),
+                response_cache=(
+                    ResponseCache(
+                        self.conf("response-cache-size") * 2**20,
+                        account_state_path(self.config.work_dir, "responses", token),
+                    )
+                    if self.conf("response-cache-size") > 0
+                    else None
+                ),
+            )
+        return self._client
 
-        dns_rrs = self._api_request("GET", endpoint)["_data"]
+    def _get_token(self) -> str:
+        if not self.credentials:
+            raise errors.PluginError("Plugin has not been prepared.")
+        token = self.credentials.conf("token")
+        if not token:
+            raise errors.PluginError(
+                "Missing token in the ServiceAPI credentials INI file."
+            )
+        return token
 
-        for record in dns_rrs:
-            if (
-                record["name_prefix"] == record_name
-                and record["dns_rr_type"]["_title"] == "TXT"
-                and record["rdata"] == f'"{record_content}"'
-            ):
-                return record
-        return None
+    def _get_rate_limit(self) -> Optional[float]:
+        assert self.credentials is not None
+        rate_limit = self.credentials.conf("rate_limit")
+        if not rate_limit:
+            return None
+        try:
+            rate = float(rate_limit)
+        except ValueError as exc:
+            raise errors.PluginError(
+                f"Invalid rate_limit in the ServiceAPI credentials INI file: {rate_limit}"
+            ) from exc
+        # The rate limiter would compute negative or NaN waits for time.sleep()
+        if rate < 0 or math.isnan(rate):
+            raise errors.PluginError(
+                "The rate_limit in the ServiceAPI credentials INI file must be a "
+                f"non-negative number: {rate_limit}"
+            )
+        return rate
+
+    def _close_serviceapi_client(self) -> None:
+        self._agent_client = None
+        self._agent_unavailable = False
+        if self._zone_cache is not None:
+            self._zone_cache.save()
+        if self._client is not None:
+            self._client.close()
+            self._client = None
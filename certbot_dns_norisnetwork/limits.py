@@ -0,0 +1,131 @@
+"""Limits of the rate and of the duration of the Service API requests."""
+import contextlib
+import threading
+import time
+
+from typing import Callable, Dict, Iterator, Optional, Set, Tuple
+
+from certbot import errors
+
+# Share of the deadline budget of every phase of a run, relative to the
+# phases still to come
+DEADLINE_PHASE_WEIGHTS = {"lookup": 1.0, "write": 1.0, "cleanup": 1.0}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the rate of Service API requests.
+
+    Up to `rate` requests per second are allowed on average, with bursts of
+    at most `capacity` requests.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take a token, waiting until one is available."""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            self._sleep(delay)
+
+
+class DeadlineBudget:
+    """
+    Time budget of the Service API requests of a run, split across its phases.
+
+    A phase gets the share of the remaining budget given by its weight,
+    relative to the phases still to come, so that time left over by a fast
+    phase is available to the later ones. Time spent outside of phases, e.g.
+    waiting for the propagation of the records, is not counted.
+    """
+
+    def __init__(
+        self,
+        seconds: float,
+        weights: Optional[Dict[str, float]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.seconds = seconds
+        self.weights = dict(weights or DEADLINE_PHASE_WEIGHTS)
+        self._clock = clock
+        self._spent = 0.0
+        self._done: Set[str] = set()
+        self._phase: Optional[str] = None
+        self._deadline: Optional[float] = None
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Limit the requests of the context to the share of the budget of a phase.
+
+        Phases do not nest: a phase entered within another one, e.g. the DNS
+        zone lookup of the cleanup, is part of the outer phase.
+
+        :param str name: The name of the phase, a key of `weights`.
+        """
+        if self._phase is not None:
+            yield
+            return
+        pending = {phase for phase in self.weights if phase not in self._done}
+        pending.add(name)
+        share = self.weights[name] / sum(self.weights[phase] for phase in pending)
+        start = self._clock()
+        self._phase = name
+        self._deadline = start + max(0.0, self.seconds - self._spent) * share
+        try:
+            yield
+        finally:
+            self._spent += self._clock() - start
+            self._done.add(name)
+            self._phase = None
+            self._deadline = None
+
+    def remaining(self) -> float:
+        """
+        Get the time left for the current phase, or for the run outside of phases.
+
+        :rtype: float
+        """
+        if self._deadline is not None:
+            return self._deadline - self._clock()
+        return self.seconds - self._spent
+
+    def timeout(self, connect: float, read: float) -> Tuple[float, float]:
+        """
+        Limit the timeouts of a request to the time left.
+
+        :param float connect: The connect timeout without a deadline.
+        :param float read: The read timeout without a deadline.
+        :returns: The (connect, read) timeouts.
+        :rtype: tuple
+        :raises certbot.errors.PluginError: if no time is left.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise errors.PluginError(
+                f"Deadline of {self.seconds} seconds for the Service API requests "
+                f"exceeded{f' in the {self._phase} phase' if self._phase else ''}."
+            )
+        return min(connect, remaining), min(read, remaining)
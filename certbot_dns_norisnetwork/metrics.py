@@ -0,0 +1,246 @@
+"""Timing metrics of the Service API requests made during a certbot run."""
+import contextlib
+import json
+import logging
+import re
+import threading
+import time
+
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from certbot_dns_norisnetwork.storage import write_text_atomic
+
+logger = logging.getLogger(__name__)
+
+HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+ZONE_LOOKUP = "zone_lookup"
+INSERT = "insert"
+LIST_RRS = "list_rrs"
+DELETE = "delete"
+PROPAGATION_WAIT = "propagation_wait"
+OTHER = "other"
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def endpoint_template(endpoint: str) -> str:
+    """
+    Reduce an endpoint to its template, e.g. `/data/dns/zone/{id}/`.
+
+    :param str endpoint: The endpoint, optionally with a query string.
+    :rtype: str
+    """
+    return _ID_SEGMENT.sub("/{id}", endpoint.split("?", 1)[0])
+
+
+def classify_request(method: str, endpoint: str, data: Optional[Dict[str, Any]]) -> str:
+    """
+    Determine the operation a Service API request belongs to.
+
+    :param str method: The HTTP method.
+    :param str endpoint: The endpoint template.
+    :param dict data: The JSON payload of the request.
+    :returns: One of the operation names of this module.
+    :rtype: str
+    """
+    if method == "GET" and endpoint == "/data/dns/zone/":
+        return ZONE_LOOKUP
+    if method == "GET" and endpoint == "/data/dns/record/":
+        return LIST_RRS
+    if method == "PATCH" and endpoint == "/data/dns/zone/{id}/":
+        created = ((data or {}).get("_attributes") or {}).get("_create")
+        return INSERT if created else DELETE
+    return OTHER
+
+
+class _Histogram:
+    def __init__(self) -> None:
+        self.buckets = [0] * len(HISTOGRAM_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Add a value to its bucket and to the buckets above."""
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+
+class Metrics:
+    """
+    Thread-safe collection of per-operation latency histograms and request counters.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._durations: Dict[str, _Histogram] = {}
+        self._requests: Dict[Tuple[str, str, str, str], int] = {}
+        self._bytes: Dict[str, int] = {}
+
+    def observe_request(
+        self,
+        method: str,
+        endpoint: str,
+        status: Any,
+        latency: float,
+        size: int,
+        data: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Record a single HTTP request to the Service API.
+
+        :param str method: The HTTP method.
+        :param str endpoint: The requested endpoint.
+        :param status: The HTTP status code, or "error" if no response was received.
+        :param float latency: The duration of the request in seconds.
+        :param int size: The number of bytes received.
+        :param dict data: The JSON payload of the request.
+        """
+        template = endpoint_template(endpoint)
+        operation = classify_request(method, template, data)
+        logger.debug(
+            "API %s %s (%s): status %s, %.3f s, %d bytes",
+            method,
+            template,
+            operation,
+            status,
+            latency,
+            size,
+        )
+        with self._lock:
+            key = (operation, method, template, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._bytes[operation] = self._bytes.get(operation, 0) + size
+            self._durations.setdefault(operation, _Histogram()).observe(latency)
+
+    def observe(self, operation: str, seconds: float) -> None:
+        """
+        Record the duration of an operation that is not a Service API request.
+
+        :param str operation: The operation name, e.g. `propagation_wait`.
+        :param float seconds: The duration.
+        """
+        with self._lock:
+            self._durations.setdefault(operation, _Histogram()).observe(seconds)
+
+    @contextlib.contextmanager
+    def time(self, operation: str) -> Iterator[None]:
+        """Record the duration of the context as an operation."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(operation, time.monotonic() - start)
+
+    def to_json(self) -> Dict[str, Any]:
+        """
+        Export the metrics as a JSON-compatible document.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "operations": {
+                    operation: {
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "buckets": {
+                            str(bound): count
+                            for bound, count in zip(
+                                HISTOGRAM_BUCKETS, histogram.buckets
+                            )
+                        },
+                        "bytes": self._bytes.get(operation, 0),
+                    }
+                    for operation, histogram in sorted(self._durations.items())
+                },
+                "requests": [
+                    {
+                        "operation": operation,
+                        "method": method,
+                        "endpoint": endpoint,
+                        "status": status,
+                        "count": count,
+                    }
+                    for (operation, method, endpoint, status), count in sorted(
+                        self._requests.items()
+                    )
+                ],
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        Export the metrics in the Prometheus text format, e.g. for the node exporter.
+
+        :rtype: str
+        """
+        lines = [
+            "# HELP noris_dns_operation_duration_seconds "
+            "Duration of the operations of the noris DNS certbot plugin.",
+            "# TYPE noris_dns_operation_duration_seconds histogram",
+        ]
+        with self._lock:
+            for operation, histogram in sorted(self._durations.items()):
+                for bound, count in zip(HISTOGRAM_BUCKETS, histogram.buckets):
+                    lines.append(
+                        "noris_dns_operation_duration_seconds_bucket"
+                        f'{{operation="{operation}",le="{bound}"}} {count}'
+                    )
+                lines += [
+                    "noris_dns_operation_duration_seconds_bucket"
+                    f'{{operation="{operation}",le="+Inf"}} {histogram.count}',
+                    "noris_dns_operation_duration_seconds_sum"
+                    f'{{operation="{operation}"}} {histogram.sum}',
+                    "noris_dns_operation_duration_seconds_count"
+                    f'{{operation="{operation}"}} {histogram.count}',
+                ]
+
+            lines += [
+                "# HELP noris_dns_api_requests_total Service API requests.",
+                "# TYPE noris_dns_api_requests_total counter",
+            ]
+            for (operation, method, endpoint, status), count in sorted(
+                self._requests.items()
+            ):
+                lines.append(
+                    f'noris_dns_api_requests_total{{operation="{operation}",'
+                    f'method="{method}",endpoint="{endpoint}",status="{status}"}} {count}'
+                )
+
+            lines += [
+                "# HELP noris_dns_api_response_bytes_total "
+                "Bytes received from the Service API.",
+                "# TYPE noris_dns_api_response_bytes_total counter",
+            ]
+            for operation, size in sorted(self._bytes.items()):
+                lines.append(
+                    f'noris_dns_api_response_bytes_total{{operation="{operation}"}} {size}'
+                )
+
+        lines += [
+            "# HELP noris_dns_last_run_timestamp_seconds End of the last certbot run.",
+            "# TYPE noris_dns_last_run_timestamp_seconds gauge",
+            f"noris_dns_last_run_timestamp_seconds {time.time()}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """
+        Write the metrics to a file, as JSON if the path ends with `.json`,
+        otherwise in the Prometheus text format.
+
+        :param str path: The path of the file.
+        """
+        if path.endswith(".json"):
+            content = json.dumps(self.to_json(), indent=2)
+        else:
+            content = self.to_prometheus()
+        try:
+            # readable by the node exporter
+            write_text_atomic(path, content, mode=0o644)
+        except OSError as exc:
+            logger.warning("Unable to write metrics to %s: %s", path, exc)
@@ -0,0 +1,179 @@
+"""Compact models of the Service API objects used by the plugin."""
+import json
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+# Fields of an RR that may carry the time of its last change
+RR_TIMESTAMP_FIELDS = ("modified", "created")
+
+
+def loads(content: Union[bytes, str]) -> Any:
+    """
+    Decode a JSON document, with orjson if it is installed.
+
+    :param content: The encoded document.
+    :raises ValueError: if the content is not valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(content)  # pylint: disable=no-member
+    return json.loads(content)
+
+
+class Zone(NamedTuple):
+    """A DNS zone, as (zone_id, zone_name, dns_rrs_endpoint) tuple."""
+
+    id: int
+    name: str
+    dns_rrs_endpoint: str
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "Zone":
+        """
+        Decode a DNS zone of the Service API.
+
+        :param dict data: The zone as returned by the Service API.
+        :rtype: Zone
+        """
+        return cls(data["id"], data["name_idna"], data["_links"][0]["href"])
+
+
+class ZoneIndex:
+    """
+    In-memory index of the DNS zones of an account.
+
+    Answers longest-suffix lookups locally, so that the DNS zone of a domain
+    does not have to be requested from the Service API for every domain.
+    """
+
+    def __init__(self) -> None:
+        self.loaded = False
+        self._zones: Dict[str, Tuple[int, str, str]] = {}
+
+    def load(self, zones: Iterable[Tuple[int, str, str]]) -> None:
+        """
+        Fill the index with all DNS zones of the account.
+
+        :param zones: (zone_id, zone_name, dns_rrs_endpoint) tuples.
+        """
+        for zone in zones:
+            self.add(zone)
+        self.loaded = True
+
+    def add(self, zone: Tuple[int, str, str]) -> None:
+        """
+        Add a single DNS zone to the index.
+
+        :param tuple zone: (zone_id, zone_name, dns_rrs_endpoint) tuple.
+        """
+        self._zones[self._normalize(zone[1])] = zone
+
+    def discard(self, zone_id: int) -> None:
+        """
+        Remove a DNS zone from the index.
+
+        :param int zone_id: The ID of the DNS zone.
+        """
+        for name in [n for n, zone in self._zones.items() if zone[0] == zone_id]:
+            del self._zones[name]
+
+    def clear(self) -> None:
+        """Remove all DNS zones from the index."""
+        self._zones.clear()
+        self.loaded = False
+
+    def lookup(self, domain: str) -> Optional[Tuple[int, str, str]]:
+        """
+        Find the most specific indexed DNS zone containing a domain.
+
+        :param str domain: The domain for which to find the zone.
+        :returns: (zone_id, zone_name, dns_rrs_endpoint) or None
+        """
+        labels = self._normalize(domain).split(".")
+        for i in range(len(labels)):
+            zone = self._zones.get(".".join(labels[i:]))
+            if zone is not None:
+                return zone
+        return None
+
+    @staticmethod
+    def _normalize(name: str) -> str:
+        return name.rstrip(".").lower()
+
+
+class ResourceRecord:
+    """A DNS RR, holding only the fields used by the plugin."""
+
+    __slots__ = ("id", "name_prefix", "rr_type", "rdata", "changed")
+
+    def __init__(
+        self,
+        id: int,  # pylint: disable=redefined-builtin
+        name_prefix: str,
+        rr_type: Optional[str],
+        rdata: str,
+        changed: Any = None,
+    ) -> None:
+        self.id = id
+        self.name_prefix = name_prefix
+        self.rr_type = rr_type
+        self.rdata = rdata
+        # Raw value of the first timestamp field, only parsed when needed
+        self.changed = changed
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "ResourceRecord":
+        """
+        Decode a DNS RR of the Service API.
+
+        :param dict data: The RR as returned by the Service API.
+        :rtype: ResourceRecord
+        """
+        rr_type = data.get("dns_rr_type")
+        return cls(
+            data["id"],
+            data.get("name_prefix") or "",
+            rr_type.get("_title") if isinstance(rr_type, dict) else rr_type,
+            data.get("rdata") or "",
+            next((data[field] for field in RR_TIMESTAMP_FIELDS if field in data), None),
+        )
+
+    @property
+    def is_txt(self) -> bool:
+        """Whether the RR is a TXT record."""
+        return self.rr_type == "TXT"
+
+    @property
+    def timestamp(self) -> Optional[float]:
+        """The time of the last change of the RR as UNIX timestamp, if known."""
+        if isinstance(self.changed, (int, float)) and not isinstance(
+            self.changed, bool
+        ):
+            return float(self.changed)
+        if isinstance(self.changed, str):
+            try:
+                parsed = datetime.fromisoformat(self.changed.replace("Z", "+00:00"))
+            except ValueError:
+                return None
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            return parsed.timestamp()
+        return None
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ResourceRecord):
+            return NotImplemented
+        return all(
+            getattr(self, slot) == getattr(other, slot) for slot in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"ResourceRecord(id={self.id!r}, name_prefix={self.name_prefix!r}, "
+            f"rr_type={self.rr_type!r}, rdata={self.rdata!r})"
+        )
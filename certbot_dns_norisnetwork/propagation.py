@@ -0,0 +1,255 @@
+"""Active check of the propagation of TXT records to the authoritative nameservers."""
+import logging
+import math
+import time
+
+from typing import Any, Callable, Dict, Iterable, List, Protocol, Set, Tuple
+
+from certbot import errors
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INITIAL_DELAY = 1.0
+DEFAULT_MAX_DELAY = 16.0
+
+# Outcomes of the propagation samples of a DNS zone
+PROPAGATED = "propagated"  # measured time until all nameservers served the records
+VALID = "valid"  # fixed wait after which the challenges were validated
+INVALID = "invalid"  # fixed wait after which the validation failed
+
+ADAPTIVE_PERCENTILE = 0.95
+ADAPTIVE_MARGIN = 5.0
+FAILURE_BACKOFF = 2.0
+# Number of runs validated with a fixed wait after which a shorter wait is tried
+PROBE_AFTER = 3
+PROBE_FACTOR = 0.8
+
+
+class TXTResolver(Protocol):
+    """Interface of the DNS lookups needed to check the propagation of TXT records."""
+
+    def get_nameservers(self, zone_name: str) -> List[str]:
+        """
+        Get the addresses of the authoritative nameservers of a DNS zone.
+
+        :param str zone_name: The name of the DNS zone.
+        :returns: The IP addresses of the nameservers.
+        :raises certbot.errors.PluginError: if the nameservers cannot be determined.
+        """
+
+    def get_txt_values(self, nameserver: str, name: str) -> Set[str]:
+        """
+        Ask a nameserver for the TXT records of a name.
+
+        :param str nameserver: The IP address of the nameserver.
+        :param str name: The fully qualified name of the records.
+        :returns: The values of the TXT records.
+        """
+
+
+class DNSPythonResolver:
+    """TXTResolver implementation based on dnspython."""
+
+    def __init__(self, port: int = 53, timeout: float = 5.0) -> None:
+        try:
+            import dns.resolver  # pylint: disable=import-outside-toplevel
+        except ImportError as exc:
+            raise errors.PluginError(
+                "Checking DNS propagation requires dnspython. Install it with "
+                "`pip install certbot-dns-norisnetwork[propagation]`."
+            ) from exc
+        self.port = port
+        self.timeout = timeout
+        self._resolver = dns.resolver.Resolver()
+        self._resolver.lifetime = timeout
+
+    def get_nameservers(self, zone_name: str) -> List[str]:
+        """Look up the IP addresses of the nameservers of a DNS zone."""
+        import dns.exception  # pylint: disable=import-outside-toplevel
+
+        try:
+            nameservers = [
+                str(rdata.target) for rdata in self._resolver.resolve(zone_name, "NS")
+            ]
+            return sorted(
+                {
+                    rdata.address
+                    for nameserver in nameservers
+                    for rdata in self._resolver.resolve(nameserver, "A")
+                }
+            )
+        except dns.exception.DNSException as exc:
+            raise errors.PluginError(
+                f"Unable to determine the nameservers of {zone_name}: {exc}"
+            ) from exc
+
+    def get_txt_values(self, nameserver: str, name: str) -> Set[str]:
+        """Ask a nameserver for the TXT records of a name, falling back to TCP."""
+        # pylint: disable=import-outside-toplevel
+        import dns.flags
+        import dns.message
+        import dns.query
+        import dns.rdatatype
+
+        query = dns.message.make_query(name, dns.rdatatype.TXT)
+        response = dns.query.udp(
+            query, nameserver, timeout=self.timeout, port=self.port
+        )
+        if response.flags & dns.flags.TC:
+            response = dns.query.tcp(
+                query, nameserver, timeout=self.timeout, port=self.port
+            )
+        return {
+            b"".join(rdata.strings).decode("utf-8")
+            for rrset in response.answer
+            if rrset.rdtype == dns.rdatatype.TXT
+            for rdata in rrset
+        }
+
+
+class PropagationChecker:
+    """
+    Wait until the authoritative nameservers of the DNS zones serve the TXT records.
+
+    The nameservers are polled with an exponential backoff until all of them
+    answer with the expected values, or until the timeout is reached. The time
+    each DNS zone took to propagate is kept in `elapsed`.
+    """
+
+    def __init__(
+        self,
+        resolver: TXTResolver,
+        timeout: float,
+        initial_delay: float = DEFAULT_INITIAL_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.resolver = resolver
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+        self._clock = clock
+        # Seconds until all nameservers of a zone served its records, by zone name
+        self.elapsed: Dict[str, float] = {}
+
+    def wait(self, records: Iterable[Tuple[str, str, str]]) -> bool:
+        """
+        Wait for TXT records to be served by all authoritative nameservers.
+
+        :param records: (zone_name, record_name, record_content) tuples, with fully
+            qualified record names.
+        :returns: True if all records propagated, False if the timeout was reached.
+        :rtype: bool
+        :raises certbot.errors.PluginError: if the nameservers of a zone cannot be determined.
+        """
+        start = self._clock()
+        deadline = start + self.timeout
+
+        nameservers: Dict[str, List[str]] = {}
+        pending: Dict[Tuple[str, str, str], Set[str]] = {}
+        for zone_name, record_name, record_content in records:
+            if zone_name not in nameservers:
+                nameservers[zone_name] = self.resolver.get_nameservers(zone_name)
+                if not nameservers[zone_name]:
+                    raise errors.PluginError(f"No nameservers found for {zone_name}.")
+            for nameserver in nameservers[zone_name]:
+                pending.setdefault((zone_name, nameserver, record_name), set()).add(
+                    record_content
+                )
+
+        delay = self.initial_delay
+        while True:
+            for key, values in list(pending.items()):
+                _, nameserver, record_name = key
+                try:
+                    values -= self.resolver.get_txt_values(nameserver, record_name)
+                except Exception as exc:  # pylint: disable=broad-except
+                    logger.debug(
+                        "Querying %s for %s failed: %s", nameserver, record_name, exc
+                    )
+                if not values:
+                    del pending[key]
+            now = self._clock()
+            for zone_name in nameservers.keys() - {zone for zone, _, _ in pending}:
+                self.elapsed.setdefault(zone_name, now - start)
+            if not pending:
+                return True
+
+            remaining = deadline - now
+            if remaining <= 0:
+                logger.warning(
+                    "TXT records not yet propagated to all nameservers: %s",
+                    ", ".join(f"{name}@{ns}" for _, ns, name in sorted(pending)),
+                )
+                return False
+            logger.debug(
+                "Waiting %.1f seconds for %d pending TXT record(s)", delay, len(pending)
+            )
+            self._sleep(min(delay, remaining))
+            delay = min(delay * 2, self.max_delay)
+
+
+def adaptive_wait(
+    samples: Iterable[Dict[str, Any]],
+    default: float,
+    minimum: float,
+    maximum: float,
+) -> int:
+    """
+    Get the number of seconds to wait for the propagation of a DNS zone.
+
+    Every sample is turned into the wait it asks for: a measured propagation
+    time plus a margin, a fixed wait that was validated as is, and a fixed
+    wait after which the validation failed multiplied by a backoff. The wait
+    is a high percentile of these, so that single outliers are ignored, but
+    never shorter than what the latest sample asks for.
+
+    A fixed wait that was validated is kept, and once it was validated
+    `PROBE_AFTER` times in a row a shorter wait is tried, unless that wait
+    failed before. Without measured propagation times, this is the only way
+    for the wait to go down.
+
+    :param samples: Dicts with the `seconds` and the `outcome` of earlier runs,
+        oldest first.
+    :param float default: The wait of DNS zones without samples.
+    :param float minimum: The lower bound of the wait.
+    :param float maximum: The upper bound of the wait.
+    :rtype: int
+    """
+    history = list(samples)
+    required = []
+    for sample in history:
+        if sample["outcome"] == PROPAGATED:
+            required.append(sample["seconds"] + ADAPTIVE_MARGIN)
+        elif sample["outcome"] == VALID:
+            required.append(sample["seconds"])
+        elif sample["outcome"] == INVALID:
+            required.append(sample["seconds"] * FAILURE_BACKOFF)
+
+    streak = _valid_streak(history)
+    if streak:
+        wait = streak[-1]
+        if len([seconds for seconds in streak if seconds <= wait]) >= PROBE_AFTER:
+            failed = [s["seconds"] for s in history if s["outcome"] == INVALID]
+            if all(seconds < wait * PROBE_FACTOR for seconds in failed):
+                wait *= PROBE_FACTOR
+    elif required:
+        ranked = sorted(required)
+        wait = max(
+            ranked[math.ceil(ADAPTIVE_PERCENTILE * len(ranked)) - 1], required[-1]
+        )
+    else:
+        wait = default
+    return math.ceil(min(max(wait, minimum), maximum))
+
+
+def _valid_streak(samples: List[Dict[str, Any]]) -> List[float]:
+    """Get the waits of the latest samples that were validated, oldest first."""
+    streak: List[float] = []
+    for sample in reversed(samples):
+        if sample["outcome"] != VALID:
+            break
+        streak.insert(0, sample["seconds"])
+    return streak
@@ -0,0 +1,958 @@
+"""Client of the noris network Service API."""
+import contextlib
+import json
+import logging
+import random
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+from email.utils import parsedate_to_datetime
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from certbot import errors
+
+from certbot_dns_norisnetwork.coalesce import PatchError, ZoneWriteCoalescer
+from certbot_dns_norisnetwork.defaults import DEFAULT_POOL_SIZE
+from certbot_dns_norisnetwork.limits import DeadlineBudget, TokenBucket
+from certbot_dns_norisnetwork.metrics import Metrics
+from certbot_dns_norisnetwork.models import ResourceRecord, Zone, ZoneIndex, loads
+from certbot_dns_norisnetwork.storage import ResponseCache, ZoneCache
+from certbot_dns_norisnetwork.tracing import NULL_TRACER, AnyTracer
+
+logger = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+_K = TypeVar("_K")
+_V = TypeVar("_V")
+
+API_BASE_PATH = "https://service-api.noris.net/v1/api"
+
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 120
+
+DEFAULT_RETRIES = 4
+RETRY_BACKOFF = 0.5
+MAX_RETRY_DELAY = 30.0
+RETRYABLE_STATUS_CODES = frozenset({429, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+PAGE_SIZE = 500
+
+TXT_RR_TYPE_ID = 16
+# Up to this many distinct names, the TXT records of a zone are requested name
+# by name. More names are looked up with a single listing of all TXT records of
+# the zone, so that the number of requests per zone does not grow with them.
+MAX_NAME_QUERIES = 2
+
+
+class _ServiceAPIError(errors.PluginError):
+    """An error response of the Service API."""
+
+    def __init__(self, message: str, status_code: int) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _run_in_thread(func: Callable[[], _T]) -> "Future[_T]":
+    """
+    Call a function on a daemon thread of its own.
+
+    :param callable func: The function to call.
+    :returns: The future of the result of `func`.
+    """
+    future: "Future[_T]" = Future()
+
+    def run() -> None:
+        try:
+            future.set_result(func())
+        except BaseException as exc:  # pylint: disable=broad-except
+            future.set_exception(exc)
+
+    threading.Thread(target=run, name="dns-noris-hedge", daemon=True).start()
+    return future
+
+
+class _ServiceAPIClient:
+    """
+    Encapsulates all communication with the Service API.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        timeout: Tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+        zone_index: Optional[ZoneIndex] = None,
+        zone_cache: Optional[ZoneCache] = None,
+        concurrency: int = 1,
+        retries: int = DEFAULT_RETRIES,
+        rate_limit: Optional[float] = None,
+        metrics: Optional[Metrics] = None,
+        tracer: Optional[AnyTracer] = None,
+        coalescer: Optional[ZoneWriteCoalescer] = None,
+        deadline: Optional[DeadlineBudget] = None,
+        hedge_delay: float = 0,
+        response_cache: Optional[ResponseCache] = None,
+    ) -> None:
+        logger.debug("Creating ServiceAPIClient")
+        self.token = token
+        self.timeout = timeout
+        self.deadline = deadline
+        # GET requests not answered within this many seconds are sent a second time
+        self.hedge_delay = hedge_delay
+        self.response_cache = response_cache
+        self.concurrency = concurrency
+        self.retries = retries
+        self.rate_limiter = TokenBucket(rate_limit) if rate_limit else None
+        self.metrics = metrics
+        self.tracer = tracer or NULL_TRACER
+        self.coalescer = coalescer
+        self._zone_index_lock = threading.Lock()
+        self.zone_index = zone_index
+        self.zone_cache = zone_cache
+        self.headers = {
+            "Content-Type": "application/json",
+            "X-noris-API-Token": self.token,
+        }
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def close(self) -> None:
+        """Close all pooled connections to the Service API."""
+        logger.debug("Closing ServiceAPIClient")
+        if self.response_cache is not None:
+            self.response_cache.save()
+        self.session.close()
+
+    def _phase(self, name: str) -> ContextManager[None]:
+        if self.deadline is None:
+            return contextlib.nullcontext()
+        return self.deadline.phase(name)
+
+    def _api_request(
+        self,
+        method: str,
+        endpoint: str,
+        data: Optional[Dict[str, Any]] = None,
+        params: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Any]:
+        url = self._get_url(endpoint)
+        cache_key = None
+        cached = None
+        scope = self._get_cache_scope(method, endpoint)
+        if scope is not None:
+            assert self.response_cache is not None
+            cache_key = self._get_cache_key(url, params)
+            cached = self.response_cache.get(cache_key)
+        headers = self._get_conditional_headers(cached)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            timeout = self.timeout
+            if self.deadline is not None:
+                timeout = self.deadline.timeout(*timeout)
+            start = time.monotonic()
+            try:
+                resp = self._send(method, url, data, params, timeout, headers)
+            except requests.exceptions.RequestException as exc:
+                if self.metrics is not None:
+                    self.metrics.observe_request(
+                        method, endpoint, "error", time.monotonic() - start, 0, data
+                    )
+                if (
+                    attempt < self.retries
+                    and self._is_retryable_error(method, exc)
+                    and self._wait_before_retry(attempt, url, exc)
+                ):
+                    attempt += 1
+                    continue
+                raise errors.PluginError(
+                    f"Error during API request at {url}: {exc}"
+                ) from exc
+            logger.debug("API %s Request to URL: %s", method, url)
+            if self.metrics is not None:
+                self.metrics.observe_request(
+                    method,
+                    endpoint,
+                    resp.status_code,
+                    time.monotonic() - start,
+                    len(resp.content),
+                    data,
+                )
+
+            if (
+                attempt < self.retries
+                and self._is_retryable_response(method, resp)
+                and self._wait_before_retry(
+                    attempt,
+                    url,
+                    f"status code {resp.status_code}",
+                    resp.headers.get("Retry-After"),
+                )
+            ):
+                attempt += 1
+                continue
+            break
+
+        if resp.status_code >= 400:
+            raise _ServiceAPIError(
+                f"HTTP Error during API request at {url} with status code: {resp.status_code}",
+                resp.status_code,
+            )
+
+        if cached is not None and resp.status_code == 304:
+            # Unchanged responses are not downloaded again, only decoded.
+            logger.debug("API response from URL %s not modified", url)
+            content = cached["content"]
+        else:
+            content = resp.content
+            cached = None
+
+        try:
+            response = loads(content)
+        except ValueError as exc:
+            text = resp.text if cached is None else cached["content"]
+            raise errors.PluginError(f"{exc}: API response with non JSON: {text}")
+        if cached is None and cache_key is not None and resp.status_code == 200:
+            self._cache_response(cache_key, scope, resp)
+        return response
+
+    def _get_cache_scope(self, method: str, endpoint: str) -> Optional[str]:
+        """
+        Get the scope of the cached responses to a request.
+
+        :returns: `zones` for the DNS zones, `zone-<id>` for the RRs of a zone,
+            or None if the response is not cached.
+        """
+        if self.response_cache is None or method != "GET":
+            return None
+        url = urlsplit(endpoint)
+        if url.path == "/data/dns/zone/":
+            return "zones"
+        try:
+            zone = json.loads(dict(parse_qsl(url.query)).get("_query", "{}"))["zone"]
+            return f"zone-{int(zone['id'])}"
+        except (KeyError, TypeError, ValueError):
+            # The RRs of an unknown zone cannot be invalidated after a change.
+            return None
+
+    @staticmethod
+    def _get_cache_key(url: str, params: Optional[Dict[str, str]]) -> str:
+        """Combine the query of a URL with the parameters of its request."""
+        split = urlsplit(url)
+        query = parse_qsl(split.query) + sorted((params or {}).items())
+        return urlunsplit(split._replace(query=urlencode(query)))
+
+    @staticmethod
+    def _get_conditional_headers(
+        cached: Optional[Dict[str, Any]],
+    ) -> Optional[Dict[str, str]]:
+        if cached is None:
+            return None
+        headers = {}
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+        return headers
+
+    def _cache_response(
+        self, cache_key: str, scope: Optional[str], resp: requests.Response
+    ) -> None:
+        assert self.response_cache is not None and scope is not None
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        try:
+            content = resp.content.decode("utf-8")
+        except UnicodeDecodeError:
+            return
+        self.response_cache.put(cache_key, scope, content, etag, last_modified)
+
+    def _send(
+        self,
+        method: str,
+        url: str,
+        data: Optional[Dict[str, Any]],
+        params: Optional[Dict[str, str]],
+        timeout: Tuple[float, float],
+        headers: Optional[Dict[str, str]] = None,
+    ) -> requests.Response:
+        """
+        Send a request, hedging GET requests that are not answered in time.
+
+        If a GET request is not answered within `hedge_delay` seconds, an
+        identical request is sent and the first successful response is used.
+        Both run on threads of their own, so that the request losing the race
+        does not hold up other requests until it is answered.
+
+        :raises requests.exceptions.RequestException: if no request succeeded.
+        """
+
+        def request() -> requests.Response:
+            return self.session.request(
+                method, url, json=data, params=params, timeout=timeout, headers=headers
+            )
+
+        if method != "GET" or self.hedge_delay <= 0:
+            return request()
+
+        def hedge() -> requests.Response:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            return request()
+
+        first = _run_in_thread(request)
+        try:
+            return first.result(timeout=self.hedge_delay)
+        except FutureTimeoutError:
+            pass
+
+        logger.debug(
+            "API %s Request to URL %s not answered in %.2f seconds, sending it again",
+            method,
+            url,
+            self.hedge_delay,
+        )
+        pending = {first, _run_in_thread(hedge)}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+            if not pending:
+                return done.pop().result()
+
+    @staticmethod
+    def _is_retryable_error(
+        method: str, exc: requests.exceptions.RequestException
+    ) -> bool:
+        # Requests that never reached the Service API can always be repeated.
+        return method in IDEMPOTENT_METHODS or isinstance(
+            exc, requests.exceptions.ConnectTimeout
+        )
+
+    @staticmethod
+    def _is_retryable_response(method: str, resp: requests.Response) -> bool:
+        if resp.status_code not in RETRYABLE_STATUS_CODES:
+            return False
+        # A rate limited request was not processed and can always be repeated.
+        return method in IDEMPOTENT_METHODS or resp.status_code == 429
+
+    def _wait_before_retry(
+        self,
+        attempt: int,
+        url: str,
+        reason: Any,
+        retry_after: Optional[str] = None,
+    ) -> bool:
+        """
+        Sleep with exponential backoff and full jitter, or as long as the API asks.
+
+        :returns: False, without sleeping, if the deadline leaves no time for a retry.
+        :rtype: bool
+        """
+        delay = random.uniform(0, min(MAX_RETRY_DELAY, RETRY_BACKOFF * 2**attempt))
+        requested = self._parse_retry_after(retry_after)
+        if requested is not None:
+            delay = min(MAX_RETRY_DELAY, max(delay, requested))
+        if self.deadline is not None and delay >= self.deadline.remaining():
+            logger.info(
+                "Not retrying API request at %s after %s, the deadline is too close",
+                url,
+                reason,
+            )
+            return False
+        logger.info(
+            "Retrying API request at %s in %.1f seconds after %s", url, delay, reason
+        )
+        time.sleep(delay)
+        return True
+
+    @staticmethod
+    def _parse_retry_after(retry_after: Optional[str]) -> Optional[float]:
+        if not isinstance(retry_after, str):
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            return max(
+                0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()
+            )
+        except (TypeError, ValueError):
+            return None
+
+    def reset_zone_index(self) -> None:
+        """Forget the loaded DNS zones, so that they are loaded again on the next lookup."""
+        if self.zone_index is not None:
+            with self._zone_index_lock:
+                self.zone_index.clear()
+
+    def _map_concurrently(
+        self, func: Callable[[_K], _V], items: Iterable[_K], error_message: str
+    ) -> Dict[_K, _V]:
+        """
+        Call `func` for every item, on up to `concurrency` threads.
+
+        All items are processed even if some of them fail, and the errors of
+        all failed items are reported together.
+
+        :param callable func: The function to call for every item.
+        :param items: The distinct items to process.
+        :param str error_message: Describes what failed in the aggregated error.
+        :returns: The results, keyed by item.
+        :rtype: dict
+        :raises certbot.errors.PluginError: if the function fails for any item.
+        """
+        items = list(items)
+
+        def call(item: _K) -> Tuple[Optional[_V], Optional[errors.PluginError]]:
+            try:
+                return func(item), None
+            except errors.PluginError as exc:
+                return None, exc
+
+        if self.concurrency > 1 and len(items) > 1:
+            with ThreadPoolExecutor(
+                max_workers=min(self.concurrency, len(items))
+            ) as executor:
+                outcomes = list(executor.map(self.tracer.wrap(call), items))
+        else:
+            outcomes = [call(item) for item in items]
+
+        results: Dict[_K, _V] = {}
+        failures = []
+        for item, (result, exc) in zip(items, outcomes):
+            if exc is not None:
+                failures.append(f"{item}: {exc}")
+            else:
+                results[item] = result  # type: ignore
+        if failures:
+            raise errors.PluginError(f"{error_message} ({'; '.join(failures)})")
+        return results
+
+    def _get_url(self, endpoint: str) -> str:
+        return API_BASE_PATH + endpoint
+
+    @staticmethod
+    def _get_record_name(record_name: str, zone_name: str) -> str:
+        """
+        Get the name of a record relative to its DNS zone.
+
+        :param str record_name: The fully qualified record name.
+        :param str zone_name: The name of the DNS zone.
+        :returns: The lower-case record name without the zone name.
+        :rtype: str
+        :raises certbot.errors.PluginError: if the record is not part of the zone.
+        """
+        record_name = record_name.rstrip(".").lower()
+        zone_name = zone_name.rstrip(".").lower()
+        if record_name == zone_name:
+            return ""
+        if not record_name.endswith("." + zone_name):
+            raise errors.PluginError(
+                f"Record {record_name} is not part of the DNS zone {zone_name}."
+            )
+        return record_name[: -len(zone_name) - 1]
+
+    def add_txt_record(
+        self, domain: str, record_name: str, record_content: str, record_ttl: int
+    ) -> None:
+        """
+        Add a TXT record using the supplied information.
+
+        :param str domain: The domain to use to look up the DNS zone.
+        :param str record_name: The record name (typically beginning with '_acme-challenge.').
+        :param str record_content: The record content (typically the challenge validation).
+        :param int record_ttl: The record TTL (number of seconds that the record may be cached).
+        :raises certbot.errors.PluginError: if an error occurs communicating with the Service API
+        """
+        self.add_txt_records([(domain, record_name, record_content)], record_ttl)
+
+    def add_txt_records(
+        self, records: List[Tuple[str, str, str]], record_ttl: int
+    ) -> Dict[Tuple[int, str, str], int]:
+        """
+        Add several TXT records, using a single request per DNS zone.
+
+        :param list records: The records to add as (domain, record_name, record_content)
+            tuples, with the same meaning as the arguments of `add_txt_record`.
+        :param int record_ttl: The record TTL (number of seconds that the record may be cached).
+        :returns: The IDs of the created RRs, keyed by (zone_id, record_name, record_content),
+            with record names relative to the zone. RRs whose ID could not be determined
+            are left out.
+        :rtype: dict
+        :raises certbot.errors.PluginError: if an error occurs communicating with the Service API
+        """
+        with self._phase("lookup"):
+            rrs_per_zone = self._group_records_by_zone(records)
+
+        def insert(zone_id: int) -> Dict[Tuple[str, str], int]:
+            dns_rrs_endpoint, rrs = rrs_per_zone[zone_id]
+            # Records left behind by an earlier attempt are reused, not created again.
+            existing = self._get_txt_rrs_index(
+                dns_rrs_endpoint, [record_name for record_name, _ in rrs]
+            )
+            rr_ids = {}
+            missing_rrs = []
+            for record_name, record_content in rrs:
+                record = existing.get((record_name, f'"{record_content}"'))
+                if record is None:
+                    missing_rrs.append((record_name, record_content))
+                else:
+                    logger.info(
+                        "TXT record %s already exists with ID: %s",
+                        record_name,
+                        record.id,
+                    )
+                    rr_ids[(record_name, record_content)] = record.id
+
+            if missing_rrs:
+                logger.info(
+                    "Insert %d new TXT record(s) in DNS zone with id %s.",
+                    len(missing_rrs),
+                    zone_id,
+                )
+                response = self._insert_txt_records(zone_id, missing_rrs, record_ttl)
+                rr_ids.update(
+                    self._get_created_rr_ids(response, dns_rrs_endpoint, missing_rrs)
+                )
+            return rr_ids
+
+        with self._phase("write"):
+            rr_ids_per_zone = self._map_concurrently(
+                insert, rrs_per_zone, "Unable to insert TXT records in DNS zone(s)"
+            )
+        return {
+            (zone_id, record_name, record_content): dns_rr_id
+            for zone_id, rr_ids in rr_ids_per_zone.items()
+            for (record_name, record_content), dns_rr_id in rr_ids.items()
+        }
+
+    def _get_created_rr_ids(
+        self,
+        response: Optional[Dict[str, Any]],
+        dns_rrs_endpoint: str,
+        records: List[Tuple[str, str]],
+    ) -> Dict[Tuple[str, str], int]:
+        """
+        Determine the IDs of freshly created TXT records.
+
+        The RRs are taken from the PATCH response if it contains them, otherwise
+        the TXT records of the zone are looked up with a single query.
+
+        :param dict response: The response of the PATCH request that created the records.
+        :param str dns_rrs_endpoint: The endpoint to get DNS RRs for the zone.
+        :param list records: The created (record_name, record_content) pairs.
+        :returns: A map of (record_name, record_content) to RR ID.
+        :rtype: dict
+        """
+        rr_ids = {}
+        returned_rrs = (response or {}).get("_data")
+        if isinstance(returned_rrs, list):
+            wanted = {
+                (name, f'"{content}"'): (name, content) for name, content in records
+            }
+            for item in returned_rrs:
+                if not isinstance(item, dict) or "id" not in item:
+                    continue
+                returned = ResourceRecord.from_json(item)
+                key = (returned.name_prefix, returned.rdata)
+                if key in wanted:
+                    rr_ids[wanted[key]] = returned.id
+
+        unknown_rrs = [record for record in records if record not in rr_ids]
+        if not unknown_rrs:
+            return rr_ids
+        try:
+            existing = self._get_txt_rrs_index(
+                dns_rrs_endpoint, [record_name for record_name, _ in unknown_rrs]
+            )
+        except errors.PluginError as exc:
+            # Not fatal: the records will be looked up again during cleanup.
+            logger.debug("Unable to look up the IDs of the created records: %s", exc)
+            return rr_ids
+        for record_name, record_content in unknown_rrs:
+            record = existing.get((record_name, f'"{record_content}"'))
+            if record is not None:
+                rr_ids[(record_name, record_content)] = record.id
+        return rr_ids
+
+    def _get_filtered_endpoint(self, endpoint: str, filters: Dict[str, Any]) -> str:
+        """Add filters to the `_query` parameter of a collection endpoint."""
+        url = urlsplit(endpoint)
+        params = dict(parse_qsl(url.query))
+        query = json.loads(params.get("_query", "{}"))
+        query.update(filters)
+        params["_query"] = json.dumps(query, separators=(",", ":"))
+        return urlunsplit(url._replace(query=urlencode(params)))
+
+    def _group_records_by_zone(
+        self, records: List[Tuple[str, str, str]]
+    ) -> Dict[int, Tuple[str, List[Tuple[str, str]]]]:
+        """
+        Resolve the DNS zone of every record, looking up each domain only once.
+
+        Distinct domains are looked up in parallel. Record names are made relative
+        to their zone, and duplicate records are collapsed, so that every
+        (record_name, record_content) pair of a zone occurs only once.
+
+        :param list records: (domain, record_name, record_content) tuples.
+        :returns: A map of zone ID to the DNS RRs endpoint of the zone and the
+            (record_name, record_content) pairs, with names relative to the zone.
+        :raises certbot.errors.PluginError: if a DNS zone cannot be found.
+        """
+
+        def find_zone(domain: str) -> Tuple[int, str, str]:
+            try:
+                zone = self._find_managed_zone_id(domain)
+                logger.info("Domain found: DNS zone with id %s", zone[0])
+                return zone
+            except errors.PluginError as exc:
+                logger.error("Error finding DNS zone using the Service API: %s", exc)
+                raise
+
+        zones = self._map_concurrently(
+            find_zone,
+            dict.fromkeys(domain for domain, _, _ in records),
+            "Unable to determine managed DNS zone(s)",
+        )
+
+        rrs_per_zone: Dict[int, Tuple[str, List[Tuple[str, str]]]] = {}
+        for domain, record_name, record_content in records:
+            zone_id, zone_name, dns_rrs_endpoint = zones[domain]
+
+            original_record_name = record_name
+            record_name = self._get_record_name(record_name, zone_name)
+            logger.info(
+                "Using record_name: %s from original: %s",
+                record_name,
+                original_record_name,
+            )
+            rrs = rrs_per_zone.setdefault(zone_id, (dns_rrs_endpoint, []))[1]
+            if (record_name, record_content) not in rrs:
+                rrs.append((record_name, record_content))
+        return rrs_per_zone
+
+    def del_txt_record(
+        self, domain: str, record_name: str, record_content: str
+    ) -> None:
+        """
+        Delete a TXT record using the supplied information.
+
+        :param str domain: The domain to use to look up the managed zone.
+        :param str record_name: The record name (typically beginning with '_acme-challenge.').
+        :param str record_content: The record value normalized with double quotes.
+        :raises certbot.errors.PluginError: if an error occurs communicating with the ISPConfig API
+        """
+        self.del_txt_records([(domain, record_name, record_content)])
+
+    def del_txt_records(
+        self,
+        records: List[Tuple[str, str, str]],
+        known_rr_ids: Optional[Dict[Tuple[int, str, str], int]] = None,
+    ) -> None:
+        """
+        Delete several TXT records, using a single request per DNS zone.
+
+        Records with a known RR ID are deleted directly. For the others, the RRs
+        of the zone are listed only once and all records are matched against
+        that listing in a single pass.
+
+        :param list records: The records to delete as (domain, record_name, record_content)
+            tuples, with the same meaning as the arguments of `del_txt_record`.
+        :param dict known_rr_ids: IDs of RRs as returned by `add_txt_records`.
+        :raises certbot.errors.PluginError: if an error occurs communicating with the Service API
+        """
+        with self._phase("cleanup"):
+            rrs_per_zone = self._group_records_by_zone(records)
+        known_rr_ids = known_rr_ids or {}
+
+        def delete(zone_id: int) -> None:
+            dns_rrs_endpoint, rrs = rrs_per_zone[zone_id]
+            dns_rr_ids = []
+            unknown_rrs = []
+            for record_name, record_content in rrs:
+                dns_rr_id = known_rr_ids.get((zone_id, record_name, record_content))
+                if dns_rr_id is None:
+                    unknown_rrs.append((record_name, record_content))
+                elif dns_rr_id not in dns_rr_ids:
+                    logger.info("Delete TXT record with ID: %s", dns_rr_id)
+                    dns_rr_ids.append(dns_rr_id)
+
+            existing = (
+                self._get_txt_rrs_index(
+                    dns_rrs_endpoint, [record_name for record_name, _ in unknown_rrs]
+                )
+                if unknown_rrs
+                else {}
+            )
+            for record_name, record_content in unknown_rrs:
+                record = existing.get((record_name, f'"{record_content}"'))
+                if record is not None and record.id not in dns_rr_ids:
+                    logger.info("Delete TXT record with ID: %s", record.id)
+                    dns_rr_ids.append(record.id)
+            if dns_rr_ids:
+                self._delete_txt_records(zone_id, dns_rr_ids)
+
+        # All zones are cleaned up, even if some of them fail.
+        with self._phase("cleanup"):
+            self._map_concurrently(
+                delete, rrs_per_zone, "Unable to delete TXT records in DNS zone(s)"
+            )
+
+    def _prepare_rr_data(
+        self, records: List[Tuple[str, str]], record_ttl: int
+    ) -> Dict[str, Any]:
+        rr_data = {
+            "_attributes": {
+                "_log_message": "dns-01 challenge",
+                "_delete": [],
+                "_create": [
+                    {
+                        "name": record_name,
+                        "type": "TXT",
+                        "ttl": record_ttl,
+                        "rdata": f'"{record_content}"',
+                    }
+                    for record_name, record_content in records
+                ],
+            }
+        }
+        return rr_data
+
+    def _insert_txt_records(
+        self, zone_id: int, records: List[Tuple[str, str]], record_ttl: int
+    ) -> Dict[str, Any]:
+        with self.tracer.span(
+            "insert_txt_records",
+            zone_id=zone_id,
+            record_names=",".join(sorted({name for name, _ in records})),
+        ):
+            rr_data = self._prepare_rr_data(records, record_ttl)
+            return self._patch_zone(zone_id, rr_data)
+
+    def _delete_txt_records(self, zone_id: int, dns_rr_ids: List[int]) -> None:
+        with self.tracer.span(
+            "delete_txt_records",
+            zone_id=zone_id,
+            rr_ids=",".join(str(dns_rr_id) for dns_rr_id in dns_rr_ids),
+        ):
+            del_data = {
+                "_attributes": {
+                    "_create": [],
+                    "_delete": [{"id": dns_rr_id} for dns_rr_id in dns_rr_ids],
+                    "_log_message": "dns-01 challenge delete",
+                }
+            }
+            self._patch_zone(zone_id, del_data)
+
+    def _patch_zone(self, zone_id: int, data: Dict[str, Any]) -> Dict[str, Any]:
+        endpoint = f"/data/dns/zone/{zone_id}/"
+        try:
+            if self.coalescer is None:
+                return self._api_request("PATCH", endpoint, data)
+            try:
+                return self.coalescer.patch(
+                    zone_id,
+                    data,
+                    lambda merged: self._api_request("PATCH", endpoint, merged),
+                )
+            except PatchError as exc:
+                if exc.status_code is None:
+                    raise
+                raise _ServiceAPIError(str(exc), exc.status_code) from exc
+        except _ServiceAPIError as exc:
+            if exc.status_code == 404:
+                # The zone is gone or was moved: forget everything known about it.
+                logger.warning("DNS zone with id %s not found", zone_id)
+                self._invalidate_zone(zone_id)
+            raise
+        finally:
+            # Even a failed request may have changed the zone.
+            if self.response_cache is not None:
+                self.response_cache.invalidate(f"zone-{zone_id}")
+
+    def _invalidate_zone(self, zone_id: int) -> None:
+        if self.zone_index is not None:
+            self.zone_index.discard(zone_id)
+        if self.zone_cache is not None:
+            self.zone_cache.invalidate_zone(zone_id)
+        if self.response_cache is not None:
+            self.response_cache.invalidate("zones")
+
+    def get_zone_name(self, domain: str) -> str:
+        """
+        Get the name of the DNS zone of a domain.
+
+        :param str domain: The domain for which to find the managed zone.
+        :returns: The IDNA name of the zone.
+        :rtype: str
+        :raises certbot.errors.PluginError: if the DNS zone cannot be found.
+        """
+        return self._find_managed_zone_id(domain)[1]
+
+    def _find_managed_zone_id(self, domain: str) -> Tuple[int, str, str]:
+        """
+        Find the DNS zone for a given domain.
+
+        If the client has a zone index, the zone is looked up there first and
+        the Service API is only asked for domains missing from the index.
+
+        :param str domain: The domain for which to find the managed zone.
+        :returns: The ID of the managed zone, if found.
+        :rtype: str
+        :raises certbot.errors.PluginError: if the DNS zone cannot be found.
+        """
+
+        logger.info("Looking for the DNS zone of domain: %s.", domain)
+        with self.tracer.span("find_managed_zone_id", domain=domain) as span:
+            zone = self.zone_cache.get(domain) if self.zone_cache is not None else None
+            span["cached"] = zone is not None
+            if zone is None:
+                zone = self._lookup_managed_zone(domain)
+                if self.zone_cache is not None:
+                    self.zone_cache.put(domain, zone)
+            span["zone_id"] = zone[0]
+            return zone
+
+    def _lookup_managed_zone(self, domain: str) -> Tuple[int, str, str]:
+        if self.zone_index is not None:
+            with self._zone_index_lock:
+                if not self.zone_index.loaded:
+                    self._load_zone_index(self.zone_index)
+            zone = self.zone_index.lookup(domain)
+            if zone is not None:
+                return zone
+
+        try:
+            zone_info = self._api_request(
+                "GET",
+                "/data/dns/zone/",
+                params={"_query": json.dumps({"for_fqdn": domain})},
+            )
+            zone = Zone.from_json(zone_info["_data"][0])
+        except IndexError as exc:
+            # An API request for a domain that is not managed either by the user
+            # or by noris returns a successful (status_code 200), but empty response.
+            # e.g. {"data": [], "recordsFiltered": 0}
+            logger.warning("%s: Domain %s not related to a known DNS zone", exc, domain)
+            raise errors.PluginError(
+                f"Unable to determine managed DNS zone for {domain}."
+            )
+
+        if self.zone_index is not None:
+            self.zone_index.add(zone)
+        return zone
+
+    def _load_zone_index(self, zone_index: ZoneIndex) -> None:
+        """
+        Load all DNS zones of the account into the zone index, page by page.
+
+        Errors are not fatal: the index is left empty, so that every domain is
+        looked up individually instead of matching a partially loaded index.
+        """
+        try:
+            zone_index.load(self._iter_zones())
+        except (errors.PluginError, KeyError, IndexError, TypeError) as exc:
+            logger.warning("Unable to load the DNS zones of the account: %s", exc)
+            zone_index.clear()
+            zone_index.loaded = True
+        logger.debug("Loaded DNS zone index")
+
+    def _iter_zones(self) -> Iterator[Zone]:
+        return self._iter_collection("/data/dns/zone/", Zone.from_json)
+
+    def _iter_rrs(self, endpoint: str) -> Iterator[ResourceRecord]:
+        return self._iter_collection(endpoint, ResourceRecord.from_json)
+
+    def _iter_collection(
+        self, endpoint: str, decode: Callable[[Dict[str, Any]], _T]
+    ) -> Iterator[_T]:
+        """
+        Lazily iterate over all items of a collection endpoint, page by page.
+
+        The next page is only requested once all items of the previous page
+        have been consumed. Every page is decoded into models right away, so
+        that at most one page of a listing is held as dicts.
+
+        :param str endpoint: The collection endpoint, optionally with a `_query`.
+        :param callable decode: Creates the model of an item.
+        :returns: An iterator over the decoded items of the collection.
+        """
+        offset = 0
+        while True:
+            page = self._api_request(
+                "GET",
+                endpoint,
+                params={"_limit": str(PAGE_SIZE), "_offset": str(offset)},
+            )
+            items = [decode(item) for item in page["_data"]]
+            total = page.get("recordsFiltered")
+            del page
+            yield from items
+
+            offset += len(items)
+            if not items or len(items) < PAGE_SIZE or (total and offset >= total):
+                return
+
+    def _get_txt_rrs_endpoint(
+        self, endpoint: str, record_name: Optional[str] = None
+    ) -> str:
+        """Narrow down a DNS RRs endpoint to TXT records, optionally of a single name."""
+        filters: Dict[str, Any] = {"dns_rr_type": {"id": TXT_RR_TYPE_ID}}
+        if record_name is not None:
+            filters["name_prefix"] = record_name
+        return self._get_filtered_endpoint(endpoint, filters)
+
+    def _get_txt_rrs_index(
+        self, endpoint: str, record_names: Iterable[str]
+    ) -> Dict[Tuple[str, str], ResourceRecord]:
+        """
+        Get the TXT records of a zone, indexed by name prefix and value.
+
+        The records of up to `MAX_NAME_QUERIES` distinct names are requested
+        with a query per name, so that the other TXT records of the zone are
+        not paged through. For more names, all TXT records are listed once.
+
+        :param str endpoint: The endpoint to get DNS RRs for the specific zone ID.
+        :param record_names: The names of the records of interest.
+        :returns: A map of (name_prefix, rdata) to the TXT record.
+        :rtype: dict
+        """
+        record_names = sorted(set(record_names))
+        names: List[Optional[str]] = (
+            list(record_names) if len(record_names) <= MAX_NAME_QUERIES else [None]
+        )
+        with self.tracer.span("get_txt_rrs_index", record_names=",".join(record_names)):
+            return {
+                (record.name_prefix, record.rdata): record
+                for name in names
+                for record in self._iter_rrs(self._get_txt_rrs_endpoint(endpoint, name))
+                if record.is_txt
+            }
@@ -0,0 +1,532 @@
+"""Local persistent state of the noris network DNS Authenticator."""
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+_ZONE_CACHE_KEYS = {"zone_id", "zone_name", "dns_rrs_endpoint", "updated"}
+_JOURNAL_KEYS = {"zone_id", "dns_rrs_endpoint", "record_name", "record_content"}
+_SAMPLE_KEYS = {"seconds", "outcome"}
+_RESPONSE_KEYS = {"scope", "etag", "last_modified", "content", "stored", "used"}
+
+# Number of propagation samples kept per DNS zone
+DEFAULT_STATS_HISTORY = 20
+
+
+@contextlib.contextmanager
+def locked(path: str) -> Iterator[None]:
+    """
+    Hold an exclusive lock on `path`.lock for the duration of the context.
+
+    The lock is shared between processes. On platforms without `fcntl`
+    no locking takes place. The directory of `path` is created if needed.
+
+    :param str path: The path of the file to protect.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if fcntl is None:  # pragma: no cover
+        yield
+        return
+
+    with open(path + ".lock", "a", encoding="utf-8") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def account_state_path(
+    work_dir: str, kind: str, token: str, suffix: str = ".json"
+) -> str:
+    """
+    Get the path of a state file below the certbot work directory.
+
+    The state depends on the account, so every API token gets its own files.
+
+    :param str work_dir: The certbot work directory.
+    :param str kind: The kind of state, e.g. `zones`.
+    :param str token: The API token.
+    :param str suffix: The suffix of the file, empty for a directory.
+    :rtype: str
+    """
+    token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(work_dir, "dns-noris", f"{kind}-{token_hash}{suffix}")
+
+
+def read_json(path: str) -> Any:
+    """
+    Read a JSON file.
+
+    :param str path: The path of the file.
+    :returns: The decoded content, or None if the file is missing or invalid.
+    """
+    try:
+        with open(path, encoding="utf-8") as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        logger.warning("Ignoring unreadable file %s: %s", path, exc)
+        return None
+
+
+def write_text_atomic(path: str, content: str, mode: int = 0o600) -> None:
+    """
+    Write a text file atomically.
+
+    The content is written to a temporary file in the same directory, which
+    then replaces `path`, so that readers never see a partially written file.
+
+    :param str path: The path of the file.
+    :param str content: The content of the file.
+    :param int mode: The permissions of the file.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+            tmp_file.write(content)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+
+
+def write_json_atomic(path: str, data: Any) -> None:
+    """
+    Write a JSON file atomically.
+
+    :param str path: The path of the file.
+    :param data: The content to encode as JSON.
+    """
+    write_text_atomic(path, json.dumps(data))
+
+
+class ZoneCache:
+    """
+    On-disk cache of the DNS zone of each domain, shared between certbot runs.
+
+    Entries expire after `ttl` seconds. Changes are kept in memory until
+    `save` merges them into the file, under a lock, so that parallel certbot
+    processes do not overwrite each other's entries.
+    """
+
+    def __init__(self, path: str, ttl: int) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._updated: Dict[str, Dict[str, Any]] = {}
+        self._removed: Set[str] = set()
+
+    def get(self, domain: str) -> Optional[Tuple[int, str, str]]:
+        """
+        Get the cached DNS zone of a domain.
+
+        :param str domain: The domain to look up.
+        :returns: (zone_id, zone_name, dns_rrs_endpoint) or None if missing or expired.
+        """
+        entry = self._load().get(domain)
+        if entry is None or entry["updated"] + self.ttl < time.time():
+            return None
+        return entry["zone_id"], entry["zone_name"], entry["dns_rrs_endpoint"]
+
+    def put(self, domain: str, zone: Tuple[int, str, str]) -> None:
+        """
+        Cache the DNS zone of a domain.
+
+        :param str domain: The domain.
+        :param tuple zone: (zone_id, zone_name, dns_rrs_endpoint) tuple.
+        """
+        zone_id, zone_name, dns_rrs_endpoint = zone
+        entry = {
+            "zone_id": zone_id,
+            "zone_name": zone_name,
+            "dns_rrs_endpoint": dns_rrs_endpoint,
+            "updated": time.time(),
+        }
+        self._load()[domain] = entry
+        self._updated[domain] = entry
+        self._removed.discard(domain)
+
+    def invalidate_zone(self, zone_id: int) -> None:
+        """
+        Remove all domains of a DNS zone from the cache, e.g. after the zone was deleted.
+
+        :param int zone_id: The ID of the DNS zone.
+        """
+        entries = self._load()
+        for domain in [d for d, e in entries.items() if e["zone_id"] == zone_id]:
+            logger.debug("Invalidating cached DNS zone of %s", domain)
+            del entries[domain]
+            self._updated.pop(domain, None)
+            self._removed.add(domain)
+        self.save()
+
+    def save(self) -> None:
+        """Merge the changes into the cache file."""
+        if not self._updated and not self._removed:
+            return
+        try:
+            with locked(self.path):
+                entries = self._read()
+                entries.update(self._updated)
+                for domain in self._removed:
+                    entries.pop(domain, None)
+                now = time.time()
+                write_json_atomic(
+                    self.path,
+                    {
+                        "zones": {
+                            domain: entry
+                            for domain, entry in entries.items()
+                            if entry["updated"] + self.ttl >= now
+                        }
+                    },
+                )
+        except OSError as exc:
+            logger.warning("Unable to write DNS zone cache %s: %s", self.path, exc)
+            return
+        self._entries = entries
+        self._updated.clear()
+        self._removed.clear()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            self._entries = self._read()
+        return self._entries
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        data = read_json(self.path)
+        if not isinstance(data, dict) or not isinstance(data.get("zones"), dict):
+            return {}
+        return {
+            domain: entry
+            for domain, entry in data["zones"].items()
+            if isinstance(entry, dict) and _ZONE_CACHE_KEYS <= entry.keys()
+        }
+
+
+class CleanupJournal:
+    """
+    Durable journal of TXT records whose deletion has been deferred.
+
+    Every change is written atomically under a lock, so that entries survive
+    crashes and parallel certbot processes do not lose each other's entries.
+    Entries are only removed once their records have been deleted, so that an
+    interrupted cleanup is replayed by the next run.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def append(self, entries: List[Dict[str, Any]]) -> None:
+        """
+        Add entries to the journal.
+
+        :param list entries: Dicts with the keys `zone_id`, `dns_rrs_endpoint`,
+            `record_name`, `record_content` and `rr_id` (None if unknown).
+        :raises OSError: if the journal cannot be written.
+        """
+        added = time.time()
+        with locked(self.path):
+            journal = self._read()
+            journal.extend(dict(entry, added=added) for entry in entries)
+            write_json_atomic(self.path, {"entries": journal})
+
+    def read(self) -> List[Dict[str, Any]]:
+        """
+        Get all entries of the journal.
+
+        :rtype: list
+        """
+        return self._read()
+
+    def remove(self, entries: List[Dict[str, Any]]) -> None:
+        """
+        Remove entries whose records have been deleted.
+
+        :param list entries: Entries as returned by `read`.
+        """
+        if not entries:
+            return
+        try:
+            with locked(self.path):
+                journal = [entry for entry in self._read() if entry not in entries]
+                write_json_atomic(self.path, {"entries": journal})
+        except OSError as exc:
+            # The records are looked up and deleted again by the next run.
+            logger.warning("Unable to update cleanup journal %s: %s", self.path, exc)
+
+    def _read(self) -> List[Dict[str, Any]]:
+        data = read_json(self.path)
+        if not isinstance(data, dict) or not isinstance(data.get("entries"), list):
+            return []
+        return [
+            entry
+            for entry in data["entries"]
+            if isinstance(entry, dict) and _JOURNAL_KEYS <= entry.keys()
+        ]
+
+
+class PropagationStats:
+    """
+    On-disk history of how long the DNS zones took to propagate.
+
+    Only the latest `history` samples of every zone are kept. New samples are
+    kept in memory until `save` merges them into the file, under a lock, so
+    that parallel certbot processes do not lose each other's samples.
+    """
+
+    def __init__(self, path: str, history: int = DEFAULT_STATS_HISTORY) -> None:
+        self.path = path
+        self.history = history
+        self._zones: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        self._added: Dict[str, List[Dict[str, Any]]] = {}
+
+    def samples(self, zone_name: str) -> List[Dict[str, Any]]:
+        """
+        Get the samples of a DNS zone.
+
+        :param str zone_name: The name of the DNS zone.
+        :returns: Dicts with the `seconds`, the `outcome` and the `time` of the
+            sample, oldest first.
+        :rtype: list
+        """
+        return list(self._load().get(zone_name, []))
+
+    def add(self, zone_name: str, seconds: float, outcome: str) -> None:
+        """
+        Add a sample of a DNS zone.
+
+        :param str zone_name: The name of the DNS zone.
+        :param float seconds: The time waited for or measured.
+        :param str outcome: The outcome, see `certbot_dns_norisnetwork.propagation`.
+        """
+        sample = {"seconds": seconds, "outcome": outcome, "time": time.time()}
+        zone_samples = self._load().setdefault(zone_name, [])
+        zone_samples.append(sample)
+        del zone_samples[: -self.history]
+        self._added.setdefault(zone_name, []).append(sample)
+
+    def save(self) -> None:
+        """Merge the new samples into the stats file."""
+        if not self._added:
+            return
+        try:
+            with locked(self.path):
+                zones = self._read()
+                for zone_name, added in self._added.items():
+                    zone_samples = zones.setdefault(zone_name, [])
+                    zone_samples.extend(added)
+                    del zone_samples[: -self.history]
+                write_json_atomic(self.path, {"zones": zones})
+        except OSError as exc:
+            logger.warning("Unable to write propagation stats %s: %s", self.path, exc)
+            return
+        self._zones = zones
+        self._added.clear()
+
+    def _load(self) -> Dict[str, List[Dict[str, Any]]]:
+        if self._zones is None:
+            self._zones = self._read()
+        return self._zones
+
+    def _read(self) -> Dict[str, List[Dict[str, Any]]]:
+        data = read_json(self.path)
+        if not isinstance(data, dict) or not isinstance(data.get("zones"), dict):
+            return {}
+        return {
+            zone_name: [
+                sample
+                for sample in zone_samples
+                if isinstance(sample, dict) and _SAMPLE_KEYS <= sample.keys()
+            ]
+            for zone_name, zone_samples in data["zones"].items()
+            if isinstance(zone_samples, list)
+        }
+
+
+class ResponseCache:
+    """
+    LRU cache of Service API responses with their validators.
+
+    Entries hold the content of a response with its `ETag` and `Last-Modified`
+    validators, so that the response can be revalidated with a conditional
+    request. The least recently used entries are evicted once the content of
+    all entries exceeds `max_size` bytes. Every entry belongs to a scope, e.g.
+    a DNS zone, whose entries can be invalidated together.
+
+    With a `path`, `save` merges the entries into the file, under a lock, so
+    that they are shared between certbot runs.
+    """
+
+    def __init__(self, max_size: int, path: Optional[str] = None) -> None:
+        self.max_size = max_size
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Optional["OrderedDict[str, Dict[str, Any]]"] = None
+        self._size = 0
+        self._updated: Set[str] = set()
+        # Time of the invalidation of every scope, applied to the file on save
+        self._invalidated: Dict[str, float] = {}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the entry of a request and mark it as recently used.
+
+        The entry is not copied and must not be changed by callers, as only
+        its content counts towards `max_size`.
+
+        :param str key: The request, e.g. its URL.
+        :returns: Dict with the `content`, the `etag` and the `last_modified`
+            validators (None if missing), or None if the request is not cached.
+        """
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(key)
+            if entry is not None:
+                entries.move_to_end(key)
+                entry["used"] = time.time()
+                self._updated.add(key)
+            return entry
+
+    def put(
+        self,
+        key: str,
+        scope: str,
+        content: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+    ) -> Dict[str, Any]:
+        """
+        Cache the response to a request.
+
+        :param str key: The request, e.g. its URL.
+        :param str scope: The scope of the response, e.g. `zone-123`.
+        :param str content: The content of the response.
+        :param str etag: The `ETag` header of the response.
+        :param str last_modified: The `Last-Modified` header of the response.
+        :returns: The new entry.
+        :rtype: dict
+        """
+        now = time.time()
+        entry = {
+            "scope": scope,
+            "etag": etag,
+            "last_modified": last_modified,
+            "content": content,
+            "stored": now,
+            "used": now,
+        }
+        with self._lock:
+            entries = self._load()
+            self._discard(entries, key)
+            if len(content) <= self.max_size:
+                entries[key] = entry
+                self._size += len(content)
+                self._updated.add(key)
+                while self._size > self.max_size:
+                    self._discard(entries, next(iter(entries)))
+        return entry
+
+    def invalidate(self, scope: str) -> None:
+        """
+        Remove all entries of a scope, e.g. after the DNS zone was changed.
+
+        :param str scope: The scope.
+        """
+        with self._lock:
+            entries = self._load()
+            for key in [k for k, e in entries.items() if e["scope"] == scope]:
+                self._discard(entries, key)
+            self._invalidated[scope] = time.time()
+
+    def save(self) -> None:
+        """Merge the changes into the cache file, if the cache has one."""
+        with self._lock:
+            if self.path is None or (not self._updated and not self._invalidated):
+                return
+            try:
+                with locked(self.path):
+                    entries = self._read()
+                    loaded: Dict[str, Dict[str, Any]] = self._entries or {}
+                    for key in self._updated:
+                        entry = loaded.get(key)
+                        if entry is not None and (
+                            key not in entries or entries[key]["used"] <= entry["used"]
+                        ):
+                            entries[key] = entry
+                    for key, entry in list(entries.items()):
+                        if entry["stored"] <= self._invalidated.get(entry["scope"], 0):
+                            del entries[key]
+                    ordered = OrderedDict(
+                        sorted(entries.items(), key=lambda item: item[1]["used"])
+                    )
+                    size = sum(len(entry["content"]) for entry in ordered.values())
+                    while size > self.max_size:
+                        size -= len(ordered.popitem(last=False)[1]["content"])
+                    write_json_atomic(
+                        self.path,
+                        {
+                            "responses": {
+                                key: {k: entry[k] for k in _RESPONSE_KEYS}
+                                for key, entry in ordered.items()
+                            }
+                        },
+                    )
+            except OSError as exc:
+                logger.warning("Unable to write response cache %s: %s", self.path, exc)
+                return
+            self._entries = ordered
+            self._size = size
+            self._updated.clear()
+            self._invalidated.clear()
+
+    def _discard(self, entries: Dict[str, Dict[str, Any]], key: str) -> None:
+        entry = entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry["content"])
+        self._updated.discard(key)
+
+    def _load(self) -> "OrderedDict[str, Dict[str, Any]]":
+        if self._entries is None:
+            self._entries = self._read() if self.path is not None else OrderedDict()
+            self._size = sum(len(e["content"]) for e in self._entries.values())
+        return self._entries
+
+    def _read(self) -> "OrderedDict[str, Dict[str, Any]]":
+        data = read_json(self.path) if self.path is not None else None
+        if not isinstance(data, dict) or not isinstance(data.get("responses"), dict):
+            return OrderedDict()
+        return OrderedDict(
+            sorted(
+                (
+                    (key, entry)
+                    for key, entry in data["responses"].items()
+                    if isinstance(entry, dict) and _RESPONSE_KEYS <= entry.keys()
+                ),
+                key=lambda item: item[1]["used"],
+            )
+        )
@@ -0,0 +1,193 @@
+"""Command line tool deleting TXT records left behind by interrupted certbot runs."""
+# The sweep extends the Service API client and uses its internals.
+# pylint: disable=protected-access
+import argparse
+import logging
+import re
+import sys
+import time
+
+from typing import Dict, List, Optional
+
+from certbot import errors
+from certbot.plugins import dns_common
+
+from certbot_dns_norisnetwork.cleanup import drain_cleanup_journal
+from certbot_dns_norisnetwork.defaults import DEFAULT_CONCURRENCY
+from certbot_dns_norisnetwork.models import ResourceRecord
+from certbot_dns_norisnetwork.serviceapi import _ServiceAPIClient
+from certbot_dns_norisnetwork.storage import CleanupJournal, account_state_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE = 86400
+DEFAULT_WORK_DIR = "/var/lib/letsencrypt"
+
+CHALLENGE_PREFIX = "_acme-challenge"
+# A dns-01 validation is the unpadded base64url encoded SHA-256 digest of the key authorization.
+_VALIDATION_RDATA = re.compile(r'^"[A-Za-z0-9_-]{43}"$')
+
+
+def sweep_stale_challenges(
+    client: _ServiceAPIClient,
+    max_age: float,
+    dry_run: bool = False,
+    include_undated: bool = False,
+) -> Dict[str, List[ResourceRecord]]:
+    """
+    Delete TXT records left behind by interrupted dns-01 challenges.
+
+    The TXT records of all DNS zones of the account are streamed page by page,
+    and the stale challenge records of every zone are deleted with a single
+    request. Zones are processed in parallel.
+
+    :param _ServiceAPIClient client: The client of the account.
+    :param float max_age: Minimum age in seconds of the records to delete.
+    :param bool dry_run: Only find the stale records, without deleting them.
+    :param bool include_undated: Also delete challenge records without timestamp.
+    :returns: The stale records, keyed by zone name.
+    :rtype: dict
+    :raises certbot.errors.PluginError: if an error occurs communicating with the Service API
+    """
+    cutoff = time.time() - max_age
+    zones = {zone[0]: zone for zone in client._iter_zones()}
+
+    def sweep(zone_id: int) -> List[ResourceRecord]:
+        _, zone_name, dns_rrs_endpoint = zones[zone_id]
+        stale = [
+            record
+            for record in client._iter_rrs(
+                client._get_txt_rrs_endpoint(dns_rrs_endpoint)
+            )
+            if is_stale_challenge(record, cutoff, include_undated)
+        ]
+        for record in stale:
+            logger.info(
+                "%s stale TXT record %s.%s with ID: %s",
+                "Found" if dry_run else "Delete",
+                record.name_prefix,
+                zone_name,
+                record.id,
+            )
+        if stale and not dry_run:
+            client._delete_txt_records(zone_id, [record.id for record in stale])
+        return stale
+
+    stale_per_zone = client._map_concurrently(
+        sweep, zones, "Unable to sweep DNS zone(s)"
+    )
+    return {
+        zones[zone_id][1]: stale for zone_id, stale in stale_per_zone.items() if stale
+    }
+
+
+def is_stale_challenge(
+    record: ResourceRecord, cutoff: float, include_undated: bool
+) -> bool:
+    """
+    Check whether an RR is the TXT record of a dns-01 challenge older than the cutoff.
+
+    :param ResourceRecord record: The RR.
+    :param float cutoff: UNIX timestamp before which challenge records are stale.
+    :param bool include_undated: Whether challenge records without timestamp are stale.
+    :rtype: bool
+    """
+    name = record.name_prefix
+    if name != CHALLENGE_PREFIX and not name.startswith(CHALLENGE_PREFIX + "."):
+        return False
+    if not record.is_txt or not _VALIDATION_RDATA.match(record.rdata):
+        return False
+    timestamp = record.timestamp
+    if timestamp is None:
+        return include_undated
+    return timestamp < cutoff
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Sweep stale `_acme-challenge` TXT records from all DNS zones of an account.
+
+    :returns: The exit code.
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(
+        prog="certbot-dns-noris-sweep",
+        description="Delete the _acme-challenge TXT records of dns-01 challenges "
+        "that are older than --max-age from all DNS zones of the account.",
+    )
+    parser.add_argument(
+        "--credentials", required=True, help="ServiceAPI credentials INI file."
+    )
+    parser.add_argument(
+        "--max-age",
+        type=int,
+        default=DEFAULT_MAX_AGE,
+        help=f"Minimum age in seconds of the records to delete (default: {DEFAULT_MAX_AGE}).",
+    )
+    parser.add_argument(
+        "--include-undated",
+        action="store_true",
+        help="Also delete challenge records without a timestamp. Only use this "
+        "while no certbot run is in progress.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Maximum number of DNS zones swept in parallel.",
+    )
+    parser.add_argument(
+        "--work-dir",
+        default=DEFAULT_WORK_DIR,
+        help="The certbot work directory. The records of its cleanup journal "
+        f"(--dns-noris-deferred-cleanup) are deleted first (default: {DEFAULT_WORK_DIR}).",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only list the stale records, without deleting them.",
+    )
+    parser.add_argument("--verbose", "-v", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(levelname)s %(name)s: %(message)s",
+    )
+
+    try:
+        credentials = dns_common.CredentialsConfiguration(
+            args.credentials, lambda name: f"dns_noris_{name}"
+        )
+        token = credentials.conf("token")
+        if not token:
+            raise errors.PluginError(f"Missing dns_noris_token in {args.credentials}.")
+        client = _ServiceAPIClient(token, concurrency=args.concurrency)
+        try:
+            if not args.dry_run:
+                drained = drain_cleanup_journal(
+                    client,
+                    CleanupJournal(account_state_path(args.work_dir, "cleanup", token)),
+                )
+                if drained:
+                    print(f"Deleted {drained} journaled record(s) of deferred cleanups")
+            stale_per_zone = sweep_stale_challenges(
+                client,
+                args.max_age,
+                dry_run=args.dry_run,
+                include_undated=args.include_undated,
+            )
+        finally:
+            client.close()
+    except errors.Error as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+
+    action = "Stale" if args.dry_run else "Deleted"
+    for zone_name, records in sorted(stale_per_zone.items()):
+        for record in records:
+            print(
+                f"{action}: {record.name_prefix}.{zone_name} TXT {record.rdata} "
+                f"(id {record.id})"
+            )
+    return 0
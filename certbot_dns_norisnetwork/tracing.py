@@ -0,0 +1,228 @@
+"""Optional trace of the spans of a certbot run, as Chrome trace or OTLP JSON."""
+import json
+import logging
+import os
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, Optional, TypeVar, Union
+
+logger = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+
+class _NullSpan:
+    """Span of a disabled tracer: records nothing."""
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        pass
+
+
+class NullTracer:
+    """Tracer used when tracing is disabled."""
+
+    _span = _NullSpan()
+
+    def span(  # pylint: disable=unused-argument
+        self, name: str, **attributes: Any
+    ) -> _NullSpan:
+        """Return a span that records nothing."""
+        return self._span
+
+    def wrap(self, func: Callable[..., _T]) -> Callable[..., _T]:
+        """Return the function unchanged."""
+        return func
+
+
+NULL_TRACER = NullTracer()
+
+
+class _Span:
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = os.urandom(8).hex()
+        self.parent_id: Optional[str] = None
+        self.thread_id = threading.get_ident()
+        self.start = 0
+        self.end = 0
+
+    def __enter__(self) -> "_Span":
+        stack = self.tracer.stack()
+        self.parent_id = stack[-1].span_id if stack else None
+        stack.append(self)
+        self.start = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, traceback: Any) -> None:
+        self.end = time.time_ns()
+        if exc is not None:
+            self.attributes["error"] = str(exc)
+        self.tracer.stack().pop()
+        self.tracer.finish(self)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+
+class Tracer:
+    """
+    Thread-safe recorder of nested spans.
+
+    Spans are nested per thread. The trace is written either in the Chrome
+    trace event format (viewable in chrome://tracing or Perfetto) or, for paths
+    ending with `.otlp.json`, as OTLP JSON.
+    """
+
+    def __init__(self) -> None:
+        self.trace_id = os.urandom(16).hex()
+        self._spans: List[_Span] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def span(self, name: str, **attributes: Any) -> _Span:
+        """
+        Create a span to be used as context manager.
+
+        Attributes can be added while the span is open: `span["zone_id"] = 123`.
+
+        :param str name: The name of the span.
+        :param attributes: Tags of the span, e.g. zone ID and record name.
+        """
+        return _Span(self, name, attributes)
+
+    def stack(self) -> List[_Span]:
+        """The open spans of the current thread."""
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def wrap(self, func: Callable[..., _T]) -> Callable[..., _T]:
+        """
+        Make the spans of a function run on another thread children of the current span.
+
+        :param callable func: The function to be run, e.g. by a thread pool.
+        :rtype: callable
+        """
+        stack = self.stack()
+        if not stack:
+            return func
+        parent = stack[-1]
+
+        def wrapped(*args: Any, **kwargs: Any) -> _T:
+            thread_stack = self.stack()
+            thread_stack.append(parent)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                thread_stack.pop()
+
+        return wrapped
+
+    def finish(self, span: _Span) -> None:
+        """Record a closed span."""
+        with self._lock:
+            self._spans.append(span)
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """
+        Export the spans in the Chrome trace event format.
+
+        :rtype: dict
+        """
+        with self._lock:
+            spans = list(self._spans)
+        return {
+            "traceEvents": [
+                {
+                    "name": span.name,
+                    "cat": "certbot-dns-noris",
+                    "ph": "X",
+                    "ts": span.start / 1000,
+                    "dur": (span.end - span.start) / 1000,
+                    "pid": os.getpid(),
+                    "tid": span.thread_id,
+                    "args": _json_safe(span.attributes),
+                }
+                for span in sorted(spans, key=lambda span: span.start)
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """
+        Export the spans as OTLP JSON (an ExportTraceServiceRequest).
+
+        :rtype: dict
+        """
+        with self._lock:
+            spans = list(self._spans)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": "certbot-dns-norisnetwork"},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [
+                                {
+                                    "traceId": self.trace_id,
+                                    "spanId": span.span_id,
+                                    "parentSpanId": span.parent_id or "",
+                                    "name": span.name,
+                                    "kind": 1,
+                                    "startTimeUnixNano": str(span.start),
+                                    "endTimeUnixNano": str(span.end),
+                                    "attributes": [
+                                        {"key": key, "value": {"stringValue": value}}
+                                        for key, value in _json_safe(
+                                            span.attributes
+                                        ).items()
+                                    ],
+                                }
+                                for span in sorted(spans, key=lambda span: span.start)
+                            ],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def write(self, path: str) -> None:
+        """
+        Write the trace to a file.
+
+        :param str path: The path of the file; OTLP JSON if it ends with `.otlp.json`.
+        """
+        # pylint: disable=import-outside-toplevel
+        from certbot_dns_norisnetwork.storage import write_text_atomic
+
+        document = (
+            self.to_otlp() if path.endswith(".otlp.json") else self.to_chrome_trace()
+        )
+        try:
+            write_text_atomic(path, json.dumps(document))
+        except OSError as exc:
+            logger.warning("Unable to write trace to %s: %s", path, exc)
+
+
+AnyTracer = Union[Tracer, NullTracer]
+
+
+def _json_safe(attributes: Dict[str, Any]) -> Dict[str, str]:
+    return {key: str(value) for key, value in attributes.items()}
@@ -24,7 +24,19 @@ dev_requirements = [
     "types-requests",
 ]
 
-extras_require = {"dev": [dev_requirements]}
+propagation_requirements = [
+    "dnspython>=2.0",
+]
+
+speedups_requirements = [
+    "orjson>=3",
+]
+
+extras_require = {
+    "dev": [dev_requirements],
+    "propagation": propagation_requirements,
+    "speedups": speedups_requirements,
+}
 
 version = os.getenv("BUILD_VERSION", "0.1.0")
 
@@ -44,7 +56,11 @@ setup(
     entry_points={
         "certbot.plugins": [
             "dns-noris = certbot_dns_norisnetwork.dns_noris:Authenticator"
-        ]
+        ],
+        "console_scripts": [
+            "certbot-dns-noris-agent = certbot_dns_norisnetwork.agent:main",
+            "certbot-dns-noris-sweep = certbot_dns_norisnetwork.sweep:main",
+        ],
     },
     python_requires=">=3.8",
     classifiers=[
@@ -0,0 +1,211 @@
+# pylint: disable=protected-access
+"""Tests for certbot_dns_norisnetwork.agent."""
+
+import json
+import threading
+import unittest
+
+from unittest import mock
+
+from certbot import achallenges
+from certbot import errors
+from certbot.compat import filesystem
+from certbot.compat import os
+from certbot.plugins import dns_test_common
+from certbot.plugins.dns_test_common import KEY
+from certbot.tests import acme_util
+from certbot.tests import util as test_util
+
+from certbot_dns_norisnetwork.agent import Agent, AgentServer
+from certbot_dns_norisnetwork.agent_client import AgentClient, AgentUnavailableError
+from certbot_dns_norisnetwork.dns_noris import Authenticator
+
+from fake_config import fake_config
+from fake_serviceapi import FakeServiceAPI
+
+FAKE_TOKEN = "faketoken1234"
+
+
+class AgentTest(unittest.TestCase):
+    """Test the dispatching of agent requests"""
+
+    def test_client_per_token(self):
+        """Every token gets its own client, which is reused"""
+        agent = Agent()
+        self.addCleanup(agent.close)
+
+        client = agent.get_client("token1")
+        self.assertIs(client, agent.get_client("token1"))
+        self.assertIsNot(client, agent.get_client("token2"))
+        self.assertIsNotNone(client.zone_index)
+
+    def test_zone_index_refresh(self):
+        """The zone index is reset once it is older than its TTL"""
+        now = [0.0]
+        agent = Agent(zone_index_ttl=60, clock=lambda: now[0])
+        self.addCleanup(agent.close)
+        client = agent.get_client(FAKE_TOKEN)
+        client.zone_index.load([(1, "example.com", "/data/dns/record/")])
+
+        now[0] = 30.0
+        agent.get_client(FAKE_TOKEN)
+        self.assertTrue(client.zone_index.loaded)
+
+        now[0] = 61.0
+        agent.get_client(FAKE_TOKEN)
+        self.assertFalse(client.zone_index.loaded)
+
+    def test_invalid_requests(self):
+        """Invalid requests and Service API errors are reported as errors"""
+        agent = Agent()
+        self.addCleanup(agent.close)
+        client = agent.get_client(FAKE_TOKEN)
+        client.get_zone_name = mock.MagicMock(side_effect=errors.PluginError("gone"))
+
+        self.assertIn("error", agent.handle({"operation": "add_txt_records"}))
+        self.assertIn("error", agent.handle({"operation": "foo", "token": FAKE_TOKEN}))
+        self.assertIn(
+            "error",
+            agent.handle(
+                {
+                    "operation": "del_txt_records",
+                    "token": FAKE_TOKEN,
+                    "records": [["a.b", "_acme-challenge.a.b"]],
+                }
+            ),
+        )
+        self.assertEqual(
+            {"error": "gone"},
+            agent.handle(
+                {"operation": "get_zone_name", "token": FAKE_TOKEN, "domain": "a.b"}
+            ),
+        )
+
+
+class AgentServerTest(test_util.TempDirTestCase):
+    """Test Authenticators sharing an agent in front of a local fake Service API"""
+
+    def setUp(self):
+        super().setUp()
+        self.api = FakeServiceAPI()
+        self.api.start()
+        self.addCleanup(self.api.stop)
+        self.zone_id = self.api.add_zone("example.com")
+
+        base_path = mock.patch(
+            "certbot_dns_norisnetwork.serviceapi.API_BASE_PATH",
+            self.api.base_url + "/v1/api",
+        )
+        base_path.start()
+        self.addCleanup(base_path.stop)
+
+        self.socket_path = os.path.join(self.tempdir, "agent", "agent.sock")
+        self.agent = Agent()
+        self.server = AgentServer(self.socket_path, self.agent)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.agent.close)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+
+        self.credentials = os.path.join(self.tempdir, "file.ini")
+        dns_test_common.write({"noris_token": FAKE_TOKEN}, self.credentials)
+
+    def _authenticator(self, socket_path):
+        config = fake_config(self.credentials, agent_socket=socket_path)
+        return Authenticator(config, "noris")
+
+    def _achall(self, domain):
+        return achallenges.KeyAuthorizationAnnotatedChallenge(
+            challb=acme_util.DNS01, domain=domain, account_key=KEY
+        )
+
+    def test_socket_permissions(self):
+        """Only the owner can connect to the agent"""
+        self.assertTrue(filesystem.check_mode(self.socket_path, 0o600))
+
+    @test_util.patch_display_util()
+    def test_authenticators_share_agent(self, unused_mock_get_utility):
+        """Records are created and deleted by the agent, with a single zone listing"""
+        for domain in ("example.com", "www.example.com"):
+            achalls = [self._achall(domain)]
+            auth = self._authenticator(self.socket_path)
+            auth.perform(achalls)
+            self.assertEqual(1, len(self.api.txt_records(self.zone_id)))
+            self.assertIsNone(auth._client)
+            auth.cleanup(achalls)
+            self.assertEqual([], self.api.txt_records(self.zone_id))
+
+        self.assertEqual(1, self.api.requests[("GET", "/data/dns/zone/")])
+        self.assertEqual(1, self.api.connections)
+
+    @test_util.patch_display_util()
+    def test_metrics_file(self, unused_mock_get_utility):
+        """The propagation wait is measured also when the agent makes the requests"""
+        path = os.path.join(self.tempdir, "noris.json")
+        achalls = [self._achall("example.com")]
+        auth = self._authenticator(self.socket_path)
+        auth.config.noris_metrics_file = path
+
+        auth.perform(achalls)
+        auth.cleanup(achalls)
+
+        with open(path, encoding="utf-8") as metrics_file:
+            metrics = json.load(metrics_file)
+        self.assertEqual(1, metrics["operations"]["propagation_wait"]["count"])
+        self.assertEqual([], metrics["requests"])
+
+    @test_util.patch_display_util()
+    def test_fallback_without_agent(self, unused_mock_get_utility):
+        """Without a reachable agent the Service API is called directly"""
+        achalls = [self._achall("example.com")]
+        auth = self._authenticator(os.path.join(self.tempdir, "missing.sock"))
+
+        auth.perform(achalls)
+        self.assertEqual(1, len(self.api.txt_records(self.zone_id)))
+        self.assertIsNotNone(auth._client)
+        auth.cleanup(achalls)
+        self.assertEqual([], self.api.txt_records(self.zone_id))
+
+    @test_util.patch_display_util()
+    def test_deferred_cleanup_bypasses_agent(self, unused_mock_get_utility):
+        """Deferred cleanups delete the records without the agent"""
+        achalls = [self._achall("example.com")]
+        auth = self._authenticator(self.socket_path)
+        auth.config.noris_deferred_cleanup = True
+        auth.config.work_dir = self.tempdir
+        self.agent.handle = mock.MagicMock(wraps=self.agent.handle)
+
+        auth.perform(achalls)
+        with mock.patch("certbot_dns_norisnetwork.dns_noris.atexit"):
+            auth.cleanup(achalls)
+        auth._wait_for_deferred_cleanup()
+
+        self.assertEqual([], self.api.txt_records(self.zone_id))
+        self.assertEqual(
+            ["add_txt_records"],
+            [call.args[0]["operation"] for call in self.agent.handle.mock_calls],
+        )
+
+    def test_agent_unavailable(self):
+        """Connection failures are reported as AgentUnavailableError"""
+        client = AgentClient(os.path.join(self.tempdir, "missing.sock"), FAKE_TOKEN)
+        with self.assertRaises(AgentUnavailableError):
+            client.get_zone_name("example.com")
+
+    def test_agent_errors(self):
+        """Errors of the agent are raised as PluginError"""
+        client = AgentClient(self.socket_path, FAKE_TOKEN)
+        with self.assertRaises(errors.PluginError) as context:
+            client.get_zone_name("example.org")
+        self.assertNotIsInstance(context.exception, AgentUnavailableError)
+
+    def test_stale_socket(self):
+        """A socket that is still served is not replaced"""
+        with self.assertRaises(errors.Error):
+            AgentServer(self.socket_path, self.agent)
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,117 @@
+# pylint: disable=protected-access
+"""
+Benchmarks of Authenticator.perform/cleanup against a local fake Service API.
+
+Every scenario reports wall time, the number of Service API requests and the
+peak memory, and fails if the number of requests exceeds the call budget.
+
+The defaults keep the suite fast; larger runs can be configured with:
+
+* NORIS_BENCHMARK_ZONE_SIZE: number of unrelated RRs per zone (e.g. 100000)
+* NORIS_BENCHMARK_LATENCY: latency injected per request, in seconds
+"""
+
+import os
+import time
+import tracemalloc
+import unittest
+
+from unittest import mock
+
+from certbot import achallenges
+from certbot.plugins import dns_test_common
+from certbot.plugins.dns_test_common import KEY
+from certbot.tests import acme_util
+from certbot.tests import util as test_util
+
+from certbot_dns_norisnetwork.dns_noris import Authenticator
+
+from fake_config import fake_config
+from fake_serviceapi import FakeServiceAPI
+
+ZONE_SIZE = int(os.environ.get("NORIS_BENCHMARK_ZONE_SIZE", "1000"))
+LATENCY = float(os.environ.get("NORIS_BENCHMARK_LATENCY", "0.001"))
+
+# (number of SANs, number of zones)
+SCENARIOS = [(1, 1), (10, 1), (10, 3), (100, 1), (100, 10)]
+
+
+def call_budget(sans, zones):
+    """
+    Maximum number of Service API requests for a perform/cleanup cycle.
+
+    One zone listing, and per zone one lookup of the existing TXT records, one
+    PATCH for the creation, one lookup of the IDs of the created records and
+    one PATCH for the deletion.
+    """
+    return 1 + 4 * zones
+
+
+class AuthenticatorBenchmarkTest(test_util.TempDirTestCase):
+    """Benchmark perform/cleanup cycles"""
+
+    def setUp(self):
+        super().setUp()
+        self.api = FakeServiceAPI(latency=LATENCY)
+        self.api.start()
+        self.addCleanup(self.api.stop)
+
+        base_path = mock.patch(
+            "certbot_dns_norisnetwork.serviceapi.API_BASE_PATH",
+            self.api.base_url + "/v1/api",
+        )
+        base_path.start()
+        self.addCleanup(base_path.stop)
+
+        self.credentials = os.path.join(self.tempdir, "file.ini")
+        dns_test_common.write({"noris_token": "faketoken1234"}, self.credentials)
+
+    def _authenticator(self):
+        config = fake_config(self.credentials, pool_size=10, concurrency=4)
+        return Authenticator(config, "noris")
+
+    def _achalls(self, sans, zones):
+        zone_names = [f"zone{i}.example" for i in range(zones)]
+        for zone_name in zone_names:
+            self.api.add_zone(zone_name, ZONE_SIZE)
+        return [
+            achallenges.KeyAuthorizationAnnotatedChallenge(
+                challb=acme_util.DNS01,
+                domain=f"san{i}.{zone_names[i % zones]}",
+                account_key=KEY,
+            )
+            for i in range(sans)
+        ]
+
+    @test_util.patch_display_util()
+    def test_perform_cleanup(self, unused_mock_get_utility):
+        """perform/cleanup stay within the call budget"""
+        for sans, zones in SCENARIOS:
+            with self.subTest(sans=sans, zones=zones):
+                self.api.zones.clear()
+                self.api.records.clear()
+                achalls = self._achalls(sans, zones)
+                self.api.reset_counters()
+                auth = self._authenticator()
+
+                tracemalloc.start()
+                start = time.perf_counter()
+                auth.perform(achalls)
+                auth.cleanup(achalls)
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                print(
+                    f"\n{sans:>4} SANs / {zones:>3} zones / {ZONE_SIZE} RRs: "
+                    f"{elapsed * 1000:8.1f} ms, {self.api.request_count:4d} requests "
+                    f"({self.api.request_count / sans:.2f}/challenge), "
+                    f"{self.api.connections} connections, peak {peak / 1024:.0f} KiB"
+                )
+                self.assertLessEqual(self.api.request_count, call_budget(sans, zones))
+                for zone_id in self.api.zones:
+                    self.assertEqual([], self.api.txt_records(zone_id))
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,107 @@
+# pylint: disable=protected-access
+"""Tests for certbot_dns_norisnetwork.cleanup."""
+
+import unittest
+
+from unittest import mock
+
+from certbot_dns_norisnetwork.cleanup import drain_cleanup_journal
+from certbot_dns_norisnetwork.serviceapi import _ServiceAPIClient, _ServiceAPIError
+
+FAKE_TOKEN = "faketoken1234"
+
+
+class DrainCleanupJournalTest(unittest.TestCase):
+    """Test the deletion of the records of a cleanup journal"""
+
+    def setUp(self):
+        self.client = _ServiceAPIClient(FAKE_TOKEN)
+        sleep_patch = mock.patch("certbot_dns_norisnetwork.serviceapi.time.sleep")
+        sleep_patch.start()
+        self.addCleanup(sleep_patch.stop)
+
+    @staticmethod
+    def _journal(*rr_ids):
+        journal = mock.MagicMock()
+        journal.read.return_value = [
+            {
+                "zone_id": 123,
+                "dns_rrs_endpoint": "/data/dns/record/?zone=123",
+                "record_name": "_acme-challenge",
+                "record_content": content,
+                "rr_id": rr_id,
+            }
+            for content, rr_id in zip(("foo", "bar"), rr_ids)
+        ]
+        return journal
+
+    def test_known_ids(self):
+        """Journaled records with known IDs are deleted with a single request"""
+        journal = self._journal(1, 2)
+        self.client._api_request = mock.MagicMock(return_value={})
+
+        self.assertEqual(2, drain_cleanup_journal(self.client, journal))
+
+        self.client._api_request.assert_called_once_with(
+            "PATCH",
+            "/data/dns/zone/123/",
+            {
+                "_attributes": {
+                    "_create": [],
+                    "_delete": [{"id": 1}, {"id": 2}],
+                    "_log_message": "dns-01 challenge delete",
+                }
+            },
+        )
+        journal.remove.assert_called_once_with(journal.read.return_value)
+
+    def test_replay(self):
+        """Records already deleted by an interrupted drain are looked up"""
+        journal = self._journal(1, None)
+
+        def api_response_helper(
+            method, endpoint, data=None, params=None
+        ):  # pylint: disable=unused-argument
+            if method == "GET":
+                return {
+                    "_data": [
+                        {
+                            "id": 2,
+                            "name_prefix": "_acme-challenge",
+                            "dns_rr_type": {"_title": "TXT"},
+                            "rdata": '"bar"',
+                        }
+                    ]
+                }
+            return {}
+
+        self.client._api_request = mock.MagicMock(side_effect=api_response_helper)
+
+        self.assertEqual(2, drain_cleanup_journal(self.client, journal))
+
+        self.assertEqual(2, self.client._api_request.call_count)
+        self.client._api_request.assert_called_with(
+            "PATCH",
+            "/data/dns/zone/123/",
+            {
+                "_attributes": {
+                    "_create": [],
+                    "_delete": [{"id": 2}],
+                    "_log_message": "dns-01 challenge delete",
+                }
+            },
+        )
+
+    def test_failure(self):
+        """Entries are kept if their records cannot be deleted"""
+        journal = self._journal(1, 2)
+        self.client._api_request = mock.MagicMock(
+            side_effect=_ServiceAPIError("unavailable", 503)
+        )
+
+        self.assertEqual(0, drain_cleanup_journal(self.client, journal))
+        journal.remove.assert_called_once_with([])
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover
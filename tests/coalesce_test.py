@@ -0,0 +1,169 @@
+"""Tests for certbot_dns_norisnetwork.coalesce."""
+
+import contextlib
+import fnmatch
+import threading
+import unittest
+
+from unittest import mock
+
+from certbot import errors
+from certbot.compat import filesystem
+from certbot.compat import os
+from certbot.tests import util as test_util
+
+from certbot_dns_norisnetwork.coalesce import (
+    PatchError,
+    ZoneWriteCoalescer,
+    merge_patches,
+)
+from certbot_dns_norisnetwork.storage import write_json_atomic
+
+
+def _patch(*names, delete=()):
+    return {
+        "_attributes": {
+            "_log_message": "dns-01 challenge delete" if delete else "dns-01 challenge",
+            "_delete": [{"id": rr_id} for rr_id in delete],
+            "_create": [{"name": name, "type": "TXT"} for name in names],
+        }
+    }
+
+
+class MergePatchesTest(unittest.TestCase):
+    """Test merging of PATCH request bodies"""
+
+    def test_merge(self):
+        """All entries are kept, log messages are not repeated"""
+        merged = merge_patches([_patch("a"), _patch("b"), _patch(delete=[1])])
+
+        self.assertEqual(
+            "dns-01 challenge, dns-01 challenge delete",
+            merged["_attributes"]["_log_message"],
+        )
+        self.assertEqual(
+            ["a", "b"], [entry["name"] for entry in merged["_attributes"]["_create"]]
+        )
+        self.assertEqual([{"id": 1}], merged["_attributes"]["_delete"])
+
+
+class ZoneWriteCoalescerTest(test_util.TempDirTestCase):
+    """Test coalescing of the PATCH requests of concurrent processes"""
+
+    def test_single_request(self):
+        """A request without concurrent requests is sent as is"""
+        send = mock.MagicMock(return_value={"_data": [{"id": 1}]})
+        coalescer = ZoneWriteCoalescer(self.tempdir, window=0)
+
+        self.assertEqual(
+            {"_data": [{"id": 1}]}, coalescer.patch(123, _patch("a"), send)
+        )
+        send.assert_called_once_with(_patch("a"))
+        self.assertEqual(
+            ["leader.lock"], os.listdir(os.path.join(self.tempdir, "zone-123"))
+        )
+
+    def test_concurrent_requests(self):
+        """Requests spooled within the window are sent together by one leader"""
+        send = mock.MagicMock(return_value={"_data": []})
+        first_sent = threading.Event()
+        results = {}
+
+        def wait_for_follower(seconds):
+            # The leader waits for the window until the other request is spooled.
+            if not first_sent.is_set():
+                first_sent.set()
+                follower.start()
+                while len(fnmatch.filter(os.listdir(zone_dir), "req-*.json")) < 2:
+                    follower.join(0.01)
+
+        def follow():
+            results["follower"] = ZoneWriteCoalescer(self.tempdir).patch(
+                123, _patch("b"), send
+            )
+
+        zone_dir = os.path.join(self.tempdir, "zone-123")
+        follower = threading.Thread(target=follow)
+        leader = ZoneWriteCoalescer(self.tempdir, sleep=wait_for_follower)
+        results["leader"] = leader.patch(123, _patch("a"), send)
+        follower.join()
+
+        self.assertEqual({"leader": {"_data": []}, "follower": {"_data": []}}, results)
+        send.assert_called_once()
+        self.assertEqual(
+            ["a", "b"],
+            sorted(
+                entry["name"]
+                for entry in send.call_args[0][0]["_attributes"]["_create"]
+            ),
+        )
+
+    def test_split_after_conflict(self):
+        """If the merged request is rejected, every request is sent on its own"""
+        zone_dir = os.path.join(self.tempdir, "zone-123")
+        filesystem.makedirs(zone_dir)
+        # spooled by a process waiting for its result
+        write_json_atomic(os.path.join(zone_dir, "req-other.json"), _patch("bad"))
+
+        def send(data):
+            names = [entry["name"] for entry in data["_attributes"]["_create"]]
+            if "bad" in names:
+                raise PatchError("Conflict", 409)
+            return {"_data": names}
+
+        coalescer = ZoneWriteCoalescer(self.tempdir, window=0)
+        self.assertEqual({"_data": ["a"]}, coalescer.patch(123, _patch("a"), send))
+
+        with self.assertRaises(PatchError) as context:
+            coalescer._unpack(coalescer._take_result(zone_dir, "other"))
+        self.assertEqual(409, context.exception.status_code)
+
+    def test_errors(self):
+        """Errors of the merged request are returned to every process"""
+        send = mock.MagicMock(side_effect=errors.PluginError("timeout"))
+        coalescer = ZoneWriteCoalescer(self.tempdir, window=0)
+
+        with self.assertRaises(PatchError) as context:
+            coalescer.patch(123, _patch("a"), send)
+        self.assertIsNone(context.exception.status_code)
+
+    def test_claimed_by_exited_leader(self):
+        """A request claimed by a leader that exited is not sent again"""
+        coalescer = ZoneWriteCoalescer(self.tempdir, window=0, sleep=lambda _: None)
+        attempts = []
+
+        @contextlib.contextmanager
+        def try_lock(zone_dir):
+            attempts.append(zone_dir)
+            if len(attempts) > 1:
+                yield True
+                return
+            # Another process claims the request and exits without a result.
+            for name in os.listdir(zone_dir):
+                if name.startswith("req-"):
+                    filesystem.replace(
+                        os.path.join(zone_dir, name),
+                        os.path.join(zone_dir, "claimed-" + name[len("req-") :]),
+                    )
+            yield False
+
+        send = mock.MagicMock()
+        with mock.patch.object(coalescer, "_try_lock", try_lock):
+            with self.assertRaises(errors.PluginError):
+                coalescer.patch(123, _patch("a"), send)
+        send.assert_not_called()
+
+    def test_no_result(self):
+        """A leader that did not write the result of its own request fails"""
+        coalescer = ZoneWriteCoalescer(self.tempdir, window=0)
+        send = mock.MagicMock()
+
+        with mock.patch.object(coalescer, "_lead"):
+            with self.assertRaises(errors.PluginError) as context:
+                coalescer.patch(123, _patch("a"), send)
+        self.assertNotIsInstance(context.exception, PatchError)
+        send.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,91 @@
+"""Tests for certbot_dns_norisnetwork.delegation."""
+
+import unittest
+
+from unittest import mock
+
+from certbot import errors
+
+from certbot_dns_norisnetwork.delegation import ChallengeDelegation, parse_aliases
+
+
+class ParseAliasesTest(unittest.TestCase):
+    """Test parsing of the challenge aliases"""
+
+    def test_single_alias(self):
+        """A single alias applies to all domains"""
+        self.assertEqual({"": "acme.example.net"}, parse_aliases("ACME.example.net."))
+        self.assertEqual({}, parse_aliases(None))
+
+    def test_domain_aliases(self):
+        """Aliases are keyed by domain"""
+        self.assertEqual(
+            {"example.com": "acme.example.net", "example.org": "acme.example.org"},
+            parse_aliases(
+                "example.com:acme.example.net, *.example.org:acme.example.org"
+            ),
+        )
+
+    def test_invalid(self):
+        """Entries without alias are rejected"""
+        self.assertRaises(errors.PluginError, parse_aliases, "example.com:")
+
+
+class ChallengeDelegationTest(unittest.TestCase):
+    """Test the mapping of validation names to the names of the TXT records"""
+
+    def test_alias(self):
+        """The alias of the closest configured domain is used"""
+        delegation = ChallengeDelegation(
+            {"example.com": "acme.example.net", "": "acme.example.org"}
+        )
+
+        self.assertEqual(
+            "_acme-challenge.acme.example.net",
+            delegation.get_target(
+                "*.www.example.com", "_acme-challenge.www.example.com"
+            ),
+        )
+        self.assertEqual(
+            "_acme-challenge.acme.example.org",
+            delegation.get_target("example.de", "_acme-challenge.example.de"),
+        )
+
+    def test_not_delegated(self):
+        """Without alias and resolver the validation name is used"""
+        delegation = ChallengeDelegation({"example.com": "acme.example.net"})
+        self.assertEqual(
+            "_acme-challenge.example.org",
+            delegation.get_target("example.org", "_acme-challenge.example.org"),
+        )
+
+    def test_cname_chain(self):
+        """CNAMEs are followed to the last target"""
+        resolver = mock.MagicMock()
+        resolver.get_cname.side_effect = {
+            "_acme-challenge.example.com": "example-com.acme.example.net",
+            "example-com.acme.example.net": "example-com.acme.example.org",
+        }.get
+        delegation = ChallengeDelegation({}, resolver)
+
+        self.assertEqual(
+            "example-com.acme.example.org",
+            delegation.get_target("example.com", "_acme-challenge.example.com"),
+        )
+
+    def test_cname_loop(self):
+        """CNAME loops are not followed forever"""
+        resolver = mock.MagicMock()
+        resolver.get_cname.side_effect = lambda name: name
+        delegation = ChallengeDelegation({}, resolver)
+
+        self.assertRaises(
+            errors.PluginError,
+            delegation.get_target,
+            "example.com",
+            "_acme-challenge.example.com",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover
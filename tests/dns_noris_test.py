@@ -1,19 +1,27 @@
 # pylint: disable=protected-access
 """Tests for certbot_dns_norisnetwork.dns_noris."""
 
+import json
+import threading
 import unittest
 
 from unittest import mock
 
-import requests
-
+from certbot import achallenges
 from certbot import errors
 from certbot.compat import os
 from certbot.plugins import dns_test_common
-from certbot.plugins.dns_test_common import DOMAIN
+from certbot.plugins.dns_test_common import DOMAIN, KEY
+from certbot.tests import acme_util
 from certbot.tests import util as test_util
 
-from certbot_dns_norisnetwork.dns_noris import Authenticator, _ServiceAPIClient
+from certbot_dns_norisnetwork.dns_noris import Authenticator
+from certbot_dns_norisnetwork.metrics import DELETE
+from certbot_dns_norisnetwork.storage import PropagationStats, account_state_path
+from certbot_dns_norisnetwork.tracing import Tracer
+
+from fake_config import fake_config
+from fake_serviceapi import FakeServiceAPI
 
 FAKE_TOKEN = "faketoken1234"
 
@@ -29,13 +37,12 @@ class AuthenticatorTest(
         path = os.path.join(self.tempdir, "file.ini")
         dns_test_common.write({"noris_token": FAKE_TOKEN}, path)
 
-        self.config = mock.MagicMock(
-            noris_credentials=path, noris_propagation_seconds=0
-        )  # don't wait during tests
+        self.config = fake_config(path)
 
         self.auth = Authenticator(self.config, "noris")
 
         self.mock_client = mock.MagicMock()
+        self.mock_client.add_txt_records.return_value = {}
         self.auth._get_serviceapi_client = mock.MagicMock(return_value=self.mock_client)
 
     @test_util.patch_display_util()
@@ -44,8 +51,28 @@ class AuthenticatorTest(
         self.auth.perform([self.achall])
 
         expected = [
-            mock.call.add_txt_record(
-                DOMAIN, "_acme-challenge." + DOMAIN, mock.ANY, mock.ANY
+            mock.call.add_txt_records(
+                [(DOMAIN, "_acme-challenge." + DOMAIN, mock.ANY)], mock.ANY
+            )
+        ]
+        self.assertEqual(expected, self.mock_client.mock_calls)
+
+    @test_util.patch_display_util()
+    def test_perform_multiple_challenges(self, unused_mock_get_utility):
+        """Test that .perform() hands all challenges to the client at once"""
+        other_achall = achallenges.KeyAuthorizationAnnotatedChallenge(
+            challb=acme_util.DNS01, domain="www." + DOMAIN, account_key=KEY
+        )
+        responses = self.auth.perform([self.achall, other_achall])
+
+        self.assertEqual(2, len(responses))
+        expected = [
+            mock.call.add_txt_records(
+                [
+                    (DOMAIN, "_acme-challenge." + DOMAIN, mock.ANY),
+                    ("www." + DOMAIN, "_acme-challenge.www." + DOMAIN, mock.ANY),
+                ],
+                mock.ANY,
             )
         ]
         self.assertEqual(expected, self.mock_client.mock_calls)
@@ -56,237 +83,494 @@ class AuthenticatorTest(
         self.auth.cleanup([self.achall])
 
         expected = [
-            mock.call.del_txt_record(DOMAIN, "_acme-challenge." + DOMAIN, mock.ANY)
+            mock.call.del_txt_records(
+                [(DOMAIN, "_acme-challenge." + DOMAIN, mock.ANY)], {}
+            )
         ]
         self.assertEqual(expected, self.mock_client.mock_calls)
 
+    @test_util.patch_display_util()
+    def test_challenge_cname(self, unused_mock_get_utility):
+        """Delegated records are created and deleted at the target of their CNAME"""
+        self.config.noris_challenge_cname = True
+        self.auth.cname_resolver = mock.MagicMock()
+        self.auth.cname_resolver.get_cname.side_effect = {
+            "_acme-challenge." + DOMAIN: "example-com.acme.example.net"
+        }.get
+        other_achall = achallenges.KeyAuthorizationAnnotatedChallenge(
+            challb=acme_util.DNS01, domain="www." + DOMAIN, account_key=KEY
+        )
+
+        self.auth.perform([self.achall, other_achall])
+        self.auth.cleanup([self.achall, other_achall])
+
+        target = "example-com.acme.example.net"
+        records = [
+            (target, target, mock.ANY),
+            ("www." + DOMAIN, "_acme-challenge.www." + DOMAIN, mock.ANY),
+        ]
+        self.assertEqual(
+            [
+                mock.call.add_txt_records(records, mock.ANY),
+                mock.call.del_txt_records(records, {}),
+            ],
+            self.mock_client.mock_calls,
+        )
+        # The targets of perform() are reused by the cleanup.
+        self.assertEqual(3, self.auth.cname_resolver.get_cname.call_count)
 
-class ServiceAPIClientTest(unittest.TestCase):
-    """Test ServiceAPI Client"""
+    @test_util.patch_display_util()
+    def test_trace_file(self, unused_mock_get_utility):
+        """A trace of perform and cleanup is written after cleanup"""
+        path = os.path.join(self.tempdir, "trace.json")
+        self.config.noris_trace_file = path
 
-    record_prefix = "_acme-challenge"
-    record_name = record_prefix + "." + DOMAIN
-    record_content = "bar"
-    record_ttl = 60
+        self.auth.perform([self.achall])
+        self.auth.cleanup([self.achall])
+
+        with open(path, encoding="utf-8") as trace_file:
+            events = json.load(trace_file)["traceEvents"]
+        self.assertEqual(
+            ["perform", "propagation_wait", "cleanup"],
+            [event["name"] for event in events],
+        )
+
+
+class AuthenticatorClientLifecycleTest(test_util.TempDirTestCase):
+    """Test that a single pooled ServiceAPI client is used for a whole run"""
 
     def setUp(self):
-        self.client = _ServiceAPIClient(FAKE_TOKEN)
-        self.client._get_url = mock.MagicMock(
-            return_value="fake.service.noris.net/api/endpoint/"
+        super().setUp()
+
+        path = os.path.join(self.tempdir, "file.ini")
+        dns_test_common.write({"noris_token": FAKE_TOKEN}, path)
+
+        self.config = fake_config(path)
+        self.auth = Authenticator(self.config, "noris")
+        self.auth._setup_credentials()
+
+    def test_client_is_reused(self):
+        """The same client is returned until it is closed"""
+        client = self.auth._get_serviceapi_client()
+        self.assertIs(client, self.auth._get_serviceapi_client())
+
+    def test_zone_cache(self):
+        """A positive TTL enables the on-disk zone cache below the work dir"""
+        self.config.noris_zone_cache_ttl = 3600
+        self.config.work_dir = self.tempdir
+        client = self.auth._get_serviceapi_client()
+
+        self.assertEqual(3600, client.zone_cache.ttl)
+        self.assertTrue(client.zone_cache.path.startswith(self.tempdir))
+        self.assertNotIn(FAKE_TOKEN, client.zone_cache.path)
+
+    def test_coalesce_dir(self):
+        """A coalesce directory enables coalescing below a per-account spool"""
+        self.config.noris_coalesce_dir = self.tempdir
+        self.config.noris_coalesce_window = 0.5
+        client = self.auth._get_serviceapi_client()
+
+        self.assertEqual(0.5, client.coalescer.window)
+        self.assertTrue(client.coalescer.path.startswith(self.tempdir))
+        self.assertNotIn(FAKE_TOKEN, client.coalescer.path)
+
+    def test_deadline(self):
+        """A deadline limits the requests of the run, hedging is passed on"""
+        self.assertIsNone(self.auth._get_serviceapi_client().deadline)
+        self.auth._close_serviceapi_client()
+
+        self.config.noris_deadline = 60
+        self.config.noris_hedge_delay = 0.5
+        client = self.auth._get_serviceapi_client()
+
+        self.assertEqual(60, client.deadline.seconds)
+        self.assertEqual(0.5, client.hedge_delay)
+
+    def test_response_cache(self):
+        """The response cache is kept below the work directory"""
+        self.assertIsNone(self.auth._get_serviceapi_client().response_cache)
+        self.auth._close_serviceapi_client()
+
+        self.config.noris_response_cache_size = 8
+        client = self.auth._get_serviceapi_client()
+
+        self.assertEqual(8 * 2**20, client.response_cache.max_size)
+        self.assertEqual(
+            account_state_path(self.config.work_dir, "responses", FAKE_TOKEN),
+            client.response_cache.path,
+        )
+
+    @test_util.patch_display_util()
+    def test_propagation_check(self, unused_mock_get_utility):
+        """With propagation checks enabled the nameservers are polled instead of sleeping"""
+        self.config.noris_propagation_check = True
+        self.config.noris_propagation_timeout = 30
+        client = self.auth._get_serviceapi_client()
+        client.get_zone_name = mock.MagicMock(return_value=DOMAIN)
+        self.auth.txt_resolver = mock.MagicMock()
+        self.auth.txt_resolver.get_nameservers.return_value = ["192.0.2.1"]
+        self.auth.txt_resolver.get_txt_values.return_value = {"foo"}
+
+        with mock.patch("certbot_dns_norisnetwork.dns_noris.time.sleep") as mock_sleep:
+            self.auth._wait_for_propagation(
+                [(DOMAIN, "_acme-challenge." + DOMAIN, "foo")]
+            )
+
+        mock_sleep.assert_not_called()
+        self.auth.txt_resolver.get_txt_values.assert_called_once_with(
+            "192.0.2.1", "_acme-challenge." + DOMAIN
+        )
+
+    @test_util.patch_display_util()
+    def test_propagation_check_failure_falls_back_to_sleep(
+        self, unused_mock_get_utility
+    ):
+        """If the nameservers cannot be determined the fixed delay is used"""
+        self.config.noris_propagation_check = True
+        self.config.noris_propagation_seconds = 5
+        client = self.auth._get_serviceapi_client()
+        client.get_zone_name = mock.MagicMock(return_value=DOMAIN)
+        self.auth.txt_resolver = mock.MagicMock()
+        self.auth.txt_resolver.get_nameservers.side_effect = errors.PluginError("NX")
+
+        with mock.patch("certbot_dns_norisnetwork.dns_noris.time.sleep") as mock_sleep:
+            self.auth._wait_for_propagation(
+                [(DOMAIN, "_acme-challenge." + DOMAIN, "foo")]
+            )
+
+        mock_sleep.assert_called_once_with(5)
+
+    @test_util.patch_display_util()
+    def test_adaptive_propagation(self, unused_mock_get_utility):
+        """The wait of a zone is learned from the validation outcome of earlier runs"""
+        self.config.noris_adaptive_propagation = True
+        self.config.noris_propagation_seconds = 30
+        self.config.noris_propagation_min_seconds = 10
+        self.config.noris_propagation_max_seconds = 300
+        self.config.work_dir = self.tempdir
+        records = [(DOMAIN, "_acme-challenge." + DOMAIN, "foo")]
+        self.auth.txt_resolver = mock.MagicMock()
+        self.auth.txt_resolver.get_nameservers.return_value = ["192.0.2.1"]
+        self.auth.txt_resolver.get_txt_values.return_value = set()
+
+        with mock.patch("certbot_dns_norisnetwork.dns_noris.time.sleep") as mock_sleep:
+            self.auth._get_serviceapi_client().get_zone_name = mock.MagicMock(
+                return_value=DOMAIN
+            )
+            self.auth._wait_for_propagation(records)
+            try:
+                raise errors.AuthorizationError("Some challenges have failed.")
+            except errors.AuthorizationError:
+                self.auth.cleanup([])
+
+            self.auth._get_serviceapi_client().get_zone_name = mock.MagicMock(
+                return_value=DOMAIN
+            )
+            self.auth._wait_for_propagation(records)
+            self.auth.cleanup([])
+
+        self.assertEqual([mock.call(30), mock.call(60)], mock_sleep.mock_calls)
+        stats = PropagationStats(
+            account_state_path(self.tempdir, "propagation", FAKE_TOKEN)
+        )
+        self.assertEqual(
+            [(30, "invalid"), (60, "valid")],
+            [(s["seconds"], s["outcome"]) for s in stats.samples(DOMAIN)],
         )
 
-    def test_add_txt_record(self):
-        """Test add_txt_record method"""
-
-        def api_response_helper_not_existing_rr(
-            method, endpoint, data=None, params=None
-        ):  # pylint: disable=unused-argument
-            if method == "GET":
-                if params:
-                    # called by function _find_managed_zone_id
-                    zone_info = {
-                        "_data": [
-                            {
-                                "id": 123,
-                                "name_idna": DOMAIN,
-                                "name": DOMAIN,
-                                "ttl": 86400,
-                                "_title": DOMAIN,
-                                "_target": "dns_zone",
-                                "_links": [
-                                    {
-                                        "href": "/data/dns/record/?_query=%7B%22zone%22:%7B%22id%22:123%7D%7D",  # pylint: disable=line-too-long
-                                        "rel": "record",
-                                    }
-                                ],
-                            }
-                        ],
-                        "recordsFiltered": 1,
-                    }
-                    return zone_info
-            elif method == "PATCH":
-                # called by function _insert_txt_record or _del_txt_record
-                pass
-            return None
-
-        self.client._api_request = mock.MagicMock(
-            side_effect=api_response_helper_not_existing_rr
+    @test_util.patch_display_util()
+    def test_adaptive_propagation_failed_zone(self, unused_mock_get_utility):
+        """A failed validation only counts against the zones not serving their records"""
+        self.config.noris_adaptive_propagation = True
+        self.config.noris_propagation_seconds = 30
+        self.config.noris_propagation_min_seconds = 10
+        self.config.noris_propagation_max_seconds = 300
+        self.config.work_dir = self.tempdir
+        records = [
+            (DOMAIN, "_acme-challenge." + DOMAIN, "foo"),
+            ("example.org", "_acme-challenge.example.org", "bar"),
+        ]
+        self.auth._get_serviceapi_client().get_zone_name = lambda domain: domain
+        self.auth.txt_resolver = mock.MagicMock()
+        self.auth.txt_resolver.get_nameservers.return_value = ["192.0.2.1"]
+        self.auth.txt_resolver.get_txt_values.side_effect = lambda _, name: (
+            {"foo"} if name == "_acme-challenge." + DOMAIN else set()
         )
-        self.client.add_txt_record(
-            DOMAIN, self.record_name, self.record_content, self.record_ttl
+
+        with mock.patch("certbot_dns_norisnetwork.dns_noris.time.sleep"):
+            self.auth._wait_for_propagation(records)
+        try:
+            raise errors.AuthorizationError("Some challenges have failed.")
+        except errors.AuthorizationError:
+            self.auth.cleanup([])
+
+        stats = PropagationStats(
+            account_state_path(self.tempdir, "propagation", FAKE_TOKEN)
         )
-        self.assertEqual(2, len(self.client._api_request.mock_calls))
-        self.client._api_request.assert_any_call(
-            "GET", "/data/dns/zone/", params={"_query": '{"for_fqdn": "example.com"}'}
+        self.assertEqual(
+            [(30, "valid")],
+            [(s["seconds"], s["outcome"]) for s in stats.samples(DOMAIN)],
         )
-        self.client._api_request.assert_any_call(
-            "PATCH",
-            "/data/dns/zone/123/",
-            {
-                "_attributes": {
-                    "_log_message": "dns-01 challenge",
-                    "_delete": [],
-                    "_create": [
-                        {
-                            "name": "_acme-challenge",
-                            "type": "TXT",
-                            "ttl": 60,
-                            "rdata": '"bar"',
-                        }
-                    ],
-                }
-            },
+        self.assertEqual(
+            [(30, "invalid")],
+            [(s["seconds"], s["outcome"]) for s in stats.samples("example.org")],
         )
 
-    def test_add_txt_record_fail_to_authenticate(self):
-        """Test add_txt_record method when you get an HTTPUnauthorized error"""
-
-        requests.request = mock.MagicMock()
-        requests.request.return_value.status_code = 401
-        self.assertRaises(
-            errors.PluginError,
-            self.client.add_txt_record,
-            DOMAIN,
-            self.record_name,
-            self.record_content,
-            self.record_ttl,
+    def test_rate_limit_from_credentials(self):
+        """The rate limit is read from the credentials INI file"""
+        path = os.path.join(self.tempdir, "rate.ini")
+        dns_test_common.write(
+            {"noris_token": FAKE_TOKEN, "noris_rate_limit": "2.5"}, path
         )
+        self.config.noris_credentials = path
+        self.auth._setup_credentials()
 
-    def test_add_txt_record_fail_to_find_domain(self):
-        """
-        Test add_txt_record method.
-        Mock the_api_request with the response returned when a DNS zone cannot be found:
-        i.e. it's not managed by nnIS
-        """
-        self.client._api_request = mock.MagicMock(
-            return_value={"_data": [], "recordsFiltered": 0}
+        self.assertEqual(2.5, self.auth._get_serviceapi_client().rate_limiter.rate)
+
+    def test_negative_rate_limit(self):
+        """A negative rate limit in the credentials INI file is rejected"""
+        path = os.path.join(self.tempdir, "rate.ini")
+        for rate_limit in ("-1", "nan"):
+            dns_test_common.write(
+                {"noris_token": FAKE_TOKEN, "noris_rate_limit": rate_limit}, path
+            )
+            self.config.noris_credentials = path
+            self.auth._setup_credentials()
+
+            self.assertRaises(errors.PluginError, self.auth._get_serviceapi_client)
+
+    def test_missing_token(self):
+        """A client is only created with a token"""
+        self.auth.credentials = mock.MagicMock(**{"conf.return_value": None})
+
+        self.assertRaises(errors.PluginError, self.auth._get_serviceapi_client)
+
+    def test_metrics_file(self):
+        """Metrics of the run are written after cleanup"""
+        path = os.path.join(self.tempdir, "noris.prom")
+        self.config.noris_metrics_file = path
+        client = self.auth._get_serviceapi_client()
+        client.session.request = mock.MagicMock()
+        client.session.request.return_value.status_code = 200
+        client.session.request.return_value.content = b'{"_data": []}'
+
+        client._api_request("GET", "/data/dns/record/?_query=%7B%7D")
+        self.auth.cleanup([])
+
+        with open(path, encoding="utf-8") as metrics_file:
+            content = metrics_file.read()
+        self.assertIn(
+            'noris_dns_api_requests_total{operation="list_rrs",method="GET",'
+            'endpoint="/data/dns/record/",status="200"} 1',
+            content,
         )
-        self.assertRaises(
-            errors.PluginError,
-            self.client.add_txt_record,
-            DOMAIN,
-            self.record_name,
-            self.record_content,
-            self.record_ttl,
+        self.assertIn(
+            'noris_dns_api_response_bytes_total{operation="list_rrs"} 13', content
         )
 
-    def test_del_txt_record(self):
-        """Test del_txt_record method"""
-
-        def api_response_helper_existing_acme_rr(
-            method,
-            endpoint,
-            data=None,
-            params=None,
-        ):  # pylint: disable=unused-argument
-            if method == "GET":
-                if params:
-                    # called by function _find_managed_zone_id
-                    zone_info = {
-                        "_data": [
-                            {
-                                "id": 123,
-                                "name_idna": DOMAIN,
-                                "name": DOMAIN,
-                                "ttl": 86400,
-                                "_title": DOMAIN,
-                                "_target": "dns_zone",
-                                "_links": [
-                                    {
-                                        "href": "/data/dns/record/?_query=%7B%22zone%22:%7B%22id%22:123%7D%7D",  # pylint: disable=line-too-long
-                                        "rel": "record",
-                                    }
-                                ],
-                            }
-                        ],
-                        "recordsFiltered": 1,
-                    }
-                    return zone_info
-                if "/data/dns/record/" in endpoint:
-                    # called by function get_existing_txt_rrs
-                    # returns an existing record
-                    record = {
-                        "_data": [
-                            {
-                                "id": 247,
-                                "name_prefix": "_acme-challenge",
-                                "zone": {
-                                    "id": 123,
-                                    "_target": "dns_zone",
-                                    "_title": DOMAIN,
-                                },
-                                "dns_rr_type": {
-                                    "id": 16,
-                                    "_target": "dns_rr_type",
-                                    "_title": "TXT",
-                                },
-                                "ttl": 60,
-                                "mx_preference": None,
-                                "rdata": f'"{self.record_content}"',
-                                "effective_rdata": self.record_content,
-                                "_title": f'_acme_challenge TXT "{self.record_content}"',
-                                "_target": "dns_rr",
-                            },
-                        ],
-                        "recordsFiltered": 1,
-                    }
-                    return record
-            elif method == "PATCH":
-                # called by function _insert_txt_record or _del_txt_record
-                pass
-            return None
-
-        self.client._api_request = mock.MagicMock(
-            side_effect=api_response_helper_existing_acme_rr
+    def test_client_is_closed_after_cleanup(self):
+        """Cleanup closes the pooled session"""
+        client = self.auth._get_serviceapi_client()
+        client.session = mock.MagicMock()
+        self.auth.cleanup([])
+
+        client.session.close.assert_called_once_with()
+        self.assertIsNot(client, self.auth._get_serviceapi_client())
+
+    def test_deferred_cleanup(self):
+        """Records are journaled and deleted by a background thread"""
+        self.config.noris_deferred_cleanup = True
+        self.config.work_dir = self.tempdir
+        achall = achallenges.KeyAuthorizationAnnotatedChallenge(
+            challb=acme_util.DNS01, domain=DOMAIN, account_key=KEY
         )
-        self.client.del_txt_record(DOMAIN, self.record_name, self.record_content)
-        self.assertEqual(3, len(self.client._api_request.mock_calls))
-        self.client._api_request.assert_any_call(
-            "GET", "/data/dns/zone/", params={"_query": '{"for_fqdn": "example.com"}'}
+        client = self.auth._get_serviceapi_client()
+        client.session = mock.MagicMock()
+
+        with mock.patch(
+            "certbot_dns_norisnetwork.cleanup.journal_txt_records"
+        ) as mock_journal, mock.patch(
+            "certbot_dns_norisnetwork.cleanup.drain_cleanup_journal"
+        ) as mock_drain, mock.patch(
+            "certbot_dns_norisnetwork.dns_noris.atexit"
+        ) as mock_atexit:
+            self.auth._attempt_cleanup = True
+            self.auth.cleanup([achall])
+            mock_atexit.register.assert_called_once_with(
+                self.auth._wait_for_deferred_cleanup
+            )
+            self.auth._wait_for_deferred_cleanup()
+
+        journal = mock_journal.call_args[0][1]
+        self.assertTrue(journal.path.startswith(self.tempdir))
+        mock_drain.assert_called_once_with(client, journal)
+        client.session.close.assert_called_once_with()
+
+    def test_deferred_cleanup_without_journal(self):
+        """Records are deleted right away if the journal cannot be written"""
+        self.config.noris_deferred_cleanup = True
+        self.config.work_dir = self.tempdir
+        achall = achallenges.KeyAuthorizationAnnotatedChallenge(
+            challb=acme_util.DNS01, domain=DOMAIN, account_key=KEY
         )
-        self.client._api_request.assert_any_call(
-            "GET", "/data/dns/record/?_query=%7B%22zone%22:%7B%22id%22:123%7D%7D"
+        client = self.auth._get_serviceapi_client()
+        client.del_txt_records = mock.MagicMock()
+
+        with mock.patch(
+            "certbot_dns_norisnetwork.cleanup.journal_txt_records",
+            side_effect=OSError("read-only"),
+        ):
+            self.auth._attempt_cleanup = True
+            self.auth.cleanup([achall])
+
+        client.del_txt_records.assert_called_once_with(
+            [(DOMAIN, "_acme-challenge." + DOMAIN, mock.ANY)], {}
         )
-        self.client._api_request.assert_any_call(
-            "PATCH",
-            "/data/dns/zone/123/",
-            {
-                "_attributes": {
-                    "_log_message": "dns-01 challenge delete",
-                    "_delete": [{"id": 247}],
-                    "_create": [],
-                }
-            },
+        self.assertEqual([], self.auth._cleanup_threads)
+
+    def test_deferred_cleanup_metrics(self):
+        """The metrics and the trace are written again after the deferred cleanups"""
+        path = os.path.join(self.tempdir, "noris.json")
+        trace_path = os.path.join(self.tempdir, "trace.json")
+        self.config.noris_metrics_file = path
+        self.config.noris_trace_file = trace_path
+        self.auth._tracer = Tracer()
+        self.config.noris_deferred_cleanup = True
+        self.config.work_dir = self.tempdir
+        achall = achallenges.KeyAuthorizationAnnotatedChallenge(
+            challb=acme_util.DNS01, domain=DOMAIN, account_key=KEY
         )
+        released = threading.Event()
+        self.addCleanup(released.set)
+
+        def drain(client, journal):  # pylint: disable=unused-argument
+            released.wait(10)
+            client.metrics.observe(DELETE, 0.5)
+
+        for name, kwargs in (
+            ("journal_txt_records", {}),
+            ("drain_cleanup_journal", {"side_effect": drain}),
+        ):
+            patcher = mock.patch(
+                f"certbot_dns_norisnetwork.cleanup.{name}", autospec=True, **kwargs
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        with mock.patch("certbot_dns_norisnetwork.dns_noris.atexit") as mock_atexit:
+            self.auth._attempt_cleanup = True
+            self.auth.cleanup([achall])
+            self.auth.cleanup([achall])
+            mock_atexit.register.assert_called_once_with(
+                self.auth._wait_for_deferred_cleanup
+            )
+        with open(path, encoding="utf-8") as metrics_file:
+            self.assertNotIn(DELETE, json.load(metrics_file)["operations"])
+        self.assertNotIn("deferred_cleanup", self._span_names(trace_path))
+
+        released.set()
+        self.auth._wait_for_deferred_cleanup()
+
+        self.assertEqual([], self.auth._cleanup_threads)
+        with open(path, encoding="utf-8") as metrics_file:
+            operations = json.load(metrics_file)["operations"]
+        self.assertEqual(1, operations[DELETE]["count"])
+        self.assertIn("deferred_cleanup", self._span_names(trace_path))
+
+    @staticmethod
+    def _span_names(path):
+        with open(path, encoding="utf-8") as trace_file:
+            return [event["name"] for event in json.load(trace_file)["traceEvents"]]
 
-    def test_del_txt_record_fail_to_authenticate(self):
-        """Test del_txt_record method when you get an HTTPUnauthorized error"""
-        requests.request = mock.MagicMock()
-        requests.request.return_value.status_code = 401
-        type(requests.request).status_code = mock.PropertyMock(return_value=401)
-        self.assertRaises(
-            errors.PluginError,
-            self.client.del_txt_record,
-            DOMAIN,
-            self.record_name,
-            self.record_content,
+
+class AuthenticatorServiceAPITest(test_util.TempDirTestCase):
+    """Test whole runs of the Authenticator against a local fake Service API"""
+
+    def setUp(self):
+        super().setUp()
+        self.api = FakeServiceAPI()
+        self.api.start()
+        self.addCleanup(self.api.stop)
+        self.zone_id = self.api.add_zone(DOMAIN)
+
+        base_path = mock.patch(
+            "certbot_dns_norisnetwork.serviceapi.API_BASE_PATH",
+            self.api.base_url + "/v1/api",
+        )
+        base_path.start()
+        self.addCleanup(base_path.stop)
+
+        path = os.path.join(self.tempdir, "file.ini")
+        dns_test_common.write({"noris_token": FAKE_TOKEN}, path)
+        self.config = fake_config(path)
+        # A work dir of a first run, without the state directory of the plugin
+        self.config.work_dir = os.path.join(self.tempdir, "work")
+        self.achall = achallenges.KeyAuthorizationAnnotatedChallenge(
+            challb=acme_util.DNS01, domain=DOMAIN, account_key=KEY
+        )
+
+    @test_util.patch_display_util()
+    def test_zone_cache_first_run(self, unused_mock_get_utility):
+        """The zone cache is written on the first run"""
+        self.config.noris_zone_cache_ttl = 3600
+        auth = Authenticator(self.config, "noris")
+
+        auth.perform([self.achall])
+        auth.cleanup([self.achall])
+
+        path = account_state_path(self.config.work_dir, "zones", FAKE_TOKEN)
+        with open(path, encoding="utf-8") as cache_file:
+            zones = json.load(cache_file)["zones"]
+        self.assertEqual(self.zone_id, zones[DOMAIN]["zone_id"])
+        self.assertEqual([], self.api.txt_records(self.zone_id))
+
+    @test_util.patch_display_util()
+    def test_adaptive_propagation_failed_zone(self, unused_mock_get_utility):
+        """Only zones whose records are not served before cleanup are charged"""
+        self.config.noris_adaptive_propagation = True
+        self.config.noris_propagation_seconds = 30
+        other_zone_id = self.api.add_zone("example.org")
+        achalls = [
+            self.achall,
+            achallenges.KeyAuthorizationAnnotatedChallenge(
+                challb=acme_util.DNS01, domain="example.org", account_key=KEY
+            ),
+        ]
+        auth = Authenticator(self.config, "noris")
+        # The nameservers of example.org do not serve the records yet.
+        auth.txt_resolver = mock.MagicMock()
+        auth.txt_resolver.get_nameservers.side_effect = lambda zone_name: [zone_name]
+        auth.txt_resolver.get_txt_values.side_effect = lambda nameserver, name: (
+            {
+                rr["rdata"].strip('"')
+                for rr in self.api.txt_records(self.zone_id)
+                if f"{rr['name_prefix']}.{DOMAIN}" == name
+            }
+            if nameserver == DOMAIN
+            else set()
         )
 
-    def test_del_txt_record_fail_to_find_domain(self):
-        """
-        Test del_txt_record method.
-        Mock the_api_request with the response returned when a DNS zone cannot be found.
-        """
-        self.client._api_request = mock.MagicMock(
-            return_value={"_data": [], "recordsFiltered": 0}
+        with mock.patch("certbot_dns_norisnetwork.dns_noris.time.sleep"):
+            auth.perform(achalls)
+        try:
+            raise errors.AuthorizationError("Some challenges have failed.")
+        except errors.AuthorizationError:
+            auth.cleanup(achalls)
+
+        stats = PropagationStats(
+            account_state_path(self.config.work_dir, "propagation", FAKE_TOKEN)
         )
-        self.assertRaises(
-            errors.PluginError,
-            self.client.del_txt_record,
-            DOMAIN,
-            self.record_name,
-            self.record_content,
+        self.assertEqual(
+            {DOMAIN: [(30, "valid")], "example.org": [(30, "invalid")]},
+            {
+                zone_name: [
+                    (s["seconds"], s["outcome"]) for s in stats.samples(zone_name)
+                ]
+                for zone_name in (DOMAIN, "example.org")
+            },
         )
+        self.assertEqual([], self.api.txt_records(self.zone_id))
+        self.assertEqual([], self.api.txt_records(other_zone_id))
 
 
 if __name__ == "__main__":
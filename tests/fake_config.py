@@ -0,0 +1,48 @@
+"""Configuration of the Authenticator in the tests."""
+
+from unittest import mock
+
+from certbot_dns_norisnetwork.defaults import (
+    DEFAULT_CLEANUP_TIMEOUT,
+    DEFAULT_COALESCE_WINDOW,
+    DEFAULT_PROPAGATION_MAX_SECONDS,
+    DEFAULT_PROPAGATION_MIN_SECONDS,
+    DEFAULT_PROPAGATION_TIMEOUT,
+)
+
+# Options of the Authenticator as the tests use them by default
+DEFAULT_OPTIONS = {
+    "propagation_seconds": 0,  # don't wait during tests
+    "pool_size": 4,
+    "concurrency": 1,
+    "zone_cache_ttl": 0,
+    "propagation_check": False,
+    "propagation_timeout": DEFAULT_PROPAGATION_TIMEOUT,
+    "adaptive_propagation": False,
+    "propagation_min_seconds": DEFAULT_PROPAGATION_MIN_SECONDS,
+    "propagation_max_seconds": DEFAULT_PROPAGATION_MAX_SECONDS,
+    "metrics_file": None,
+    "trace_file": None,
+    "agent_socket": None,
+    "coalesce_dir": None,
+    "coalesce_window": DEFAULT_COALESCE_WINDOW,
+    "deferred_cleanup": False,
+    "cleanup_timeout": DEFAULT_CLEANUP_TIMEOUT,
+    "deadline": 0,
+    "hedge_delay": 0,
+    "response_cache_size": 0,
+    "challenge_alias": None,
+    "challenge_cname": False,
+}
+
+
+def fake_config(credentials, **options):
+    """
+    Create a certbot configuration for the Authenticator.
+
+    :param str credentials: Path of the credentials INI file.
+    :param options: Options overriding the defaults, without the `noris_` prefix.
+    :rtype: mock.MagicMock
+    """
+    values = dict(DEFAULT_OPTIONS, credentials=credentials, **options)
+    return mock.MagicMock(**{f"noris_{name}": value for name, value in values.items()})
@@ -0,0 +1,232 @@
+"""Local stand-in for the DNS endpoints of the noris network Service API."""
+
+import collections
+import itertools
+import json
+import threading
+import time
+
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, urlsplit
+
+TXT_RR_TYPE = {"id": 16, "_target": "dns_rr_type", "_title": "TXT"}
+A_RR_TYPE = {"id": 1, "_target": "dns_rr_type", "_title": "A"}
+
+
+class FakeServiceAPI:
+    """
+    In-memory Service API serving `/data/dns/zone/` and the RR collections of the zones.
+
+    Every request is delayed by `latency` seconds and counted by method and
+    endpoint template, e.g. ("GET", "/data/dns/record/").
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.zones = {}
+        self.records = {}
+        self.requests = collections.Counter()
+        self.connections = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """Base URL to use instead of the real Service API"""
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def request_count(self):
+        """Total number of requests received"""
+        return sum(self.requests.values())
+
+    def add_zone(self, name, size=0):
+        """Add a zone with `size` unrelated A records"""
+        zone_id = next(self._ids)
+        query = quote(json.dumps({"zone": {"id": zone_id}}, separators=(",", ":")))
+        self.zones[zone_id] = {
+            "id": zone_id,
+            "name": name,
+            "name_idna": name,
+            "ttl": 86400,
+            "_title": name,
+            "_target": "dns_zone",
+            "_links": [{"href": f"/data/dns/record/?_query={query}", "rel": "record"}],
+        }
+        self.records[zone_id] = {}
+        for i in range(size):
+            self._add_record(zone_id, f"host{i}", A_RR_TYPE, f"192.0.2.{i % 256}")
+        return zone_id
+
+    def add_txt_record(self, zone_id, name_prefix, rdata, modified=None):
+        """Add a TXT record, last changed at the UNIX timestamp `modified`"""
+        return self._add_record(
+            zone_id, name_prefix, TXT_RR_TYPE, rdata, modified=modified
+        )
+
+    def txt_records(self, zone_id):
+        """The TXT records of a zone"""
+        return [
+            rr
+            for rr in self.records[zone_id].values()
+            if rr["dns_rr_type"]["_title"] == "TXT"
+        ]
+
+    def reset_counters(self):
+        """Forget the requests received so far"""
+        self.requests.clear()
+        self.connections = 0
+
+    def start(self):
+        """Start serving on a random local port"""
+        api = self
+
+        class Handler(_Handler):
+            """Request handler bound to this API"""
+
+            fake_api = api
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving"""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _add_record(
+        self, zone_id, name_prefix, rr_type, rdata, ttl=3600, modified=None
+    ):
+        rr_id = next(self._ids)
+        modified = datetime.fromtimestamp(
+            time.time() if modified is None else modified, timezone.utc
+        )
+        self.records[zone_id][rr_id] = {
+            "id": rr_id,
+            "name_prefix": name_prefix,
+            "zone": {"id": zone_id, "_target": "dns_zone"},
+            "dns_rr_type": rr_type,
+            "ttl": ttl,
+            "rdata": rdata,
+            "modified": modified.isoformat(),
+            "_target": "dns_rr",
+        }
+        return rr_id
+
+    def handle(self, method, path, query, body):
+        """Dispatch a request, returning (status, JSON document)"""
+        with self._lock:
+            if path == "/data/dns/zone/" and method == "GET":
+                self.requests[(method, path)] += 1
+                return self._get_zones(query)
+            if path == "/data/dns/record/" and method == "GET":
+                self.requests[(method, path)] += 1
+                return self._get_records(query)
+            if path.startswith("/data/dns/zone/") and method == "PATCH":
+                self.requests[(method, "/data/dns/zone/{id}/")] += 1
+                return self._patch_zone(int(path.split("/")[4]), body)
+            self.requests[(method, path)] += 1
+            return 404, {"detail": "Not found"}
+
+    def _get_zones(self, query):
+        filters = json.loads(query.get("_query", "{}"))
+        zones = list(self.zones.values())
+        if "for_fqdn" in filters:
+            fqdn = filters["for_fqdn"]
+            zones = [
+                max(
+                    (
+                        z
+                        for z in zones
+                        if fqdn == z["name"] or fqdn.endswith("." + z["name"])
+                    ),
+                    key=lambda z: len(z["name"]),
+                    default=None,
+                )
+            ]
+            zones = [z for z in zones if z is not None]
+        return 200, self._page(zones, query)
+
+    def _get_records(self, query):
+        filters = json.loads(query.get("_query", "{}"))
+        records = self.records.get(filters.get("zone", {}).get("id"), {}).values()
+        if "dns_rr_type" in filters:
+            records = [
+                rr
+                for rr in records
+                if rr["dns_rr_type"]["id"] == filters["dns_rr_type"]["id"]
+            ]
+        if "name_prefix" in filters:
+            records = [
+                rr for rr in records if rr["name_prefix"] == filters["name_prefix"]
+            ]
+        return 200, self._page(list(records), query)
+
+    def _patch_zone(self, zone_id, body):
+        if zone_id not in self.zones:
+            return 404, {"detail": "Not found"}
+        attributes = body["_attributes"]
+        for rr in attributes.get("_create", []):
+            self._add_record(
+                zone_id, rr["name"], TXT_RR_TYPE, rr["rdata"], rr.get("ttl", 3600)
+            )
+        for rr in attributes.get("_delete", []):
+            self.records[zone_id].pop(rr["id"], None)
+        return 200, self.zones[zone_id]
+
+    @staticmethod
+    def _page(items, query):
+        offset = int(query.get("_offset", 0))
+        limit = int(query.get("_limit", len(items) or 1))
+        return {"_data": items[offset : offset + limit], "recordsFiltered": len(items)}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # send headers and body in one segment, to avoid delayed ACKs on keep-alive
+    disable_nagle_algorithm = True
+    wbufsize = -1
+    fake_api = None
+
+    def setup(self):
+        super().setup()
+        self.fake_api.connections += 1
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handle GET requests"""
+        self._dispatch()
+
+    def do_PATCH(self):  # pylint: disable=invalid-name
+        """Handle PATCH requests"""
+        self._dispatch()
+
+    def _dispatch(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        url = urlsplit(self.path)
+        path = url.path
+        if path.startswith("/v1/api"):
+            path = path[len("/v1/api") :]
+
+        if self.fake_api.latency:
+            time.sleep(self.fake_api.latency)
+        status, document = self.fake_api.handle(
+            self.command, path, dict(parse_qsl(url.query)), body
+        )
+
+        payload = json.dumps(document).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
@@ -0,0 +1,88 @@
+"""
+Import time of the plugin module.
+
+Certbot imports every installed plugin on each invocation, so the plugin
+module must not load the Service API client or the optional subsystems.
+The test fails if any of them is imported with the plugin module or if the
+import takes longer than its budget:
+
+* NORIS_IMPORT_BUDGET_US: budget of the plugin import, in microseconds
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+BUDGET_US = int(os.environ.get("NORIS_IMPORT_BUDGET_US", "5000"))
+
+# Modules only needed once the Authenticator is used
+LAZY_MODULES = [
+    "certbot_dns_norisnetwork.agent_client",
+    "certbot_dns_norisnetwork.cleanup",
+    "certbot_dns_norisnetwork.coalesce",
+    "certbot_dns_norisnetwork.delegation",
+    "certbot_dns_norisnetwork.limits",
+    "certbot_dns_norisnetwork.metrics",
+    "certbot_dns_norisnetwork.models",
+    "certbot_dns_norisnetwork.propagation",
+    "certbot_dns_norisnetwork.serviceapi",
+    "certbot_dns_norisnetwork.storage",
+    "orjson",
+]
+
+_SCRIPT = f"""
+import sys
+import certbot.plugins.dns_common
+import certbot_dns_norisnetwork.dns_noris
+print(" ".join(name for name in {LAZY_MODULES!r} if name in sys.modules))
+"""
+
+
+def _import_plugin(pycache_prefix):
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-X",
+            f"pycache_prefix={pycache_prefix}",
+            "-c",
+            _SCRIPT,
+        ],
+        capture_output=True,
+        check=True,
+        env=env,
+        text=True,
+    )
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if fields[1].strip().isdigit():
+            cumulative[fields[2].strip()] = int(fields[1])
+    return result.stdout.split(), cumulative
+
+
+class ImportTimeTest(unittest.TestCase):
+    """Test the cost of importing the plugin module"""
+
+    def test_import_time(self):
+        """The plugin module loads only what plugin discovery needs"""
+        with tempfile.TemporaryDirectory() as pycache_prefix:
+            # The first run compiles the modules, as pip does on installation.
+            _import_plugin(pycache_prefix)
+            loaded, cumulative = _import_plugin(pycache_prefix)
+
+        import_us = cumulative["certbot_dns_norisnetwork.dns_noris"]
+        print(f"\nimport certbot_dns_norisnetwork.dns_noris: {import_us} us")
+        self.assertEqual([], loaded)
+        self.assertLessEqual(import_us, BUDGET_US)
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,57 @@
+"""Tests for certbot_dns_norisnetwork.limits."""
+
+import unittest
+
+from certbot import errors
+
+from certbot_dns_norisnetwork.limits import DeadlineBudget, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+    """Test the client-side rate limiter"""
+
+    def test_rate(self):
+        """Requests beyond the burst are spaced out to the configured rate"""
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        bucket = TokenBucket(2, capacity=2, clock=lambda: now[0], sleep=sleep)
+        for _ in range(6):
+            bucket.acquire()
+
+        self.assertAlmostEqual(2.0, now[0])
+
+
+class DeadlineBudgetTest(unittest.TestCase):
+    """Test the deadline budget of the Service API requests of a run"""
+
+    def setUp(self):
+        self.now = [0.0]
+        self.budget = DeadlineBudget(90, clock=lambda: self.now[0])
+
+    def test_phases(self):
+        """Every phase gets its share, time left over is passed on"""
+        with self.budget.phase("lookup"):
+            self.assertEqual(30, self.budget.remaining())
+            self.now[0] += 10
+        # The propagation wait is not counted.
+        self.now[0] += 600
+        with self.budget.phase("write"):
+            self.assertEqual(40, self.budget.remaining())
+            with self.budget.phase("lookup"):
+                self.assertEqual((10, 40), self.budget.timeout(10, 120))
+            self.now[0] += 20
+        with self.budget.phase("cleanup"):
+            self.assertEqual(60, self.budget.remaining())
+
+    def test_exceeded(self):
+        """No request is sent once the time of the phase is used up"""
+        with self.budget.phase("lookup"):
+            self.now[0] += 30
+            self.assertRaises(errors.PluginError, self.budget.timeout, 10, 120)
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,118 @@
+"""Tests for certbot_dns_norisnetwork.metrics."""
+
+import json
+import unittest
+
+from certbot.compat import os
+from certbot.tests import util as test_util
+
+from certbot_dns_norisnetwork.metrics import (
+    Metrics,
+    classify_request,
+    endpoint_template,
+)
+
+
+class ClassifyRequestTest(unittest.TestCase):
+    """Test the mapping of requests to operations"""
+
+    def test_endpoint_template(self):
+        """IDs and query strings are removed from endpoints"""
+        self.assertEqual(
+            "/data/dns/zone/{id}/", endpoint_template("/data/dns/zone/123/")
+        )
+        self.assertEqual(
+            "/data/dns/record/", endpoint_template("/data/dns/record/?_query=%7B%7D")
+        )
+
+    def test_classify_request(self):
+        """Requests are attributed to the plugin operations"""
+        self.assertEqual(
+            "zone_lookup", classify_request("GET", "/data/dns/zone/", None)
+        )
+        self.assertEqual("list_rrs", classify_request("GET", "/data/dns/record/", None))
+        self.assertEqual(
+            "insert",
+            classify_request(
+                "PATCH", "/data/dns/zone/{id}/", {"_attributes": {"_create": [{}]}}
+            ),
+        )
+        self.assertEqual(
+            "delete",
+            classify_request(
+                "PATCH",
+                "/data/dns/zone/{id}/",
+                {"_attributes": {"_create": [], "_delete": [{}]}},
+            ),
+        )
+
+
+class MetricsTest(test_util.TempDirTestCase):
+    """Test the aggregation and export of metrics"""
+
+    def setUp(self):
+        super().setUp()
+        self.metrics = Metrics()
+        self.metrics.observe_request("GET", "/data/dns/zone/", 200, 0.2, 100)
+        self.metrics.observe_request("GET", "/data/dns/zone/", 503, 3.0, 10)
+        self.metrics.observe_request(
+            "PATCH",
+            "/data/dns/zone/1/",
+            200,
+            0.4,
+            50,
+            {"_attributes": {"_create": [{}]}},
+        )
+        self.metrics.observe("propagation_wait", 12.5)
+
+    def test_to_json(self):
+        """Histograms, byte counters and request counters are aggregated"""
+        document = self.metrics.to_json()
+
+        zone_lookup = document["operations"]["zone_lookup"]
+        self.assertEqual(2, zone_lookup["count"])
+        self.assertAlmostEqual(3.2, zone_lookup["sum"])
+        self.assertEqual(1, zone_lookup["buckets"]["0.25"])
+        self.assertEqual(2, zone_lookup["buckets"]["5.0"])
+        self.assertEqual(110, zone_lookup["bytes"])
+        self.assertEqual(1, document["operations"]["propagation_wait"]["count"])
+        self.assertIn(
+            {
+                "operation": "insert",
+                "method": "PATCH",
+                "endpoint": "/data/dns/zone/{id}/",
+                "status": "200",
+                "count": 1,
+            },
+            document["requests"],
+        )
+
+    def test_to_prometheus(self):
+        """The Prometheus export contains cumulative buckets and counters"""
+        content = self.metrics.to_prometheus()
+
+        self.assertIn(
+            'noris_dns_operation_duration_seconds_bucket{operation="zone_lookup",le="2.5"} 1',
+            content,
+        )
+        self.assertIn(
+            'noris_dns_operation_duration_seconds_bucket{operation="zone_lookup",le="+Inf"} 2',
+            content,
+        )
+        self.assertIn(
+            'noris_dns_api_requests_total{operation="zone_lookup",method="GET",'
+            'endpoint="/data/dns/zone/",status="503"} 1',
+            content,
+        )
+
+    def test_write_json(self):
+        """Paths ending in .json are written as JSON"""
+        path = os.path.join(self.tempdir, "metrics.json")
+        self.metrics.write(path)
+
+        with open(path, encoding="utf-8") as metrics_file:
+            self.assertIn("insert", json.load(metrics_file)["operations"])
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover
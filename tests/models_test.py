@@ -0,0 +1,120 @@
+"""Tests for certbot_dns_norisnetwork.models."""
+
+import unittest
+
+from unittest import mock
+
+from certbot_dns_norisnetwork import models
+from certbot_dns_norisnetwork.models import ResourceRecord, Zone, ZoneIndex
+
+RR = {
+    "id": 7,
+    "name_prefix": "_acme-challenge",
+    "dns_rr_type": {"_title": "TXT", "_links": [{"href": "/data/dns/rr_type/16/"}]},
+    "rdata": '"abc"',
+    "ttl": 300,
+    "modified": "2024-01-01T00:00:00Z",
+    "_links": [{"href": "/data/dns/record/7/"}],
+}
+
+
+class LoadsTest(unittest.TestCase):
+    """Test decoding of Service API responses"""
+
+    def test_loads(self):
+        """Documents are decoded with and without orjson"""
+        for orjson in (models.orjson, None):
+            with self.subTest(orjson=orjson), mock.patch.object(
+                models, "orjson", orjson
+            ):
+                self.assertEqual({"_data": [1]}, models.loads(b'{"_data": [1]}'))
+                with self.assertRaises(ValueError):
+                    models.loads(b"<html>")
+
+
+class ZoneTest(unittest.TestCase):
+    """Test the DNS zone model"""
+
+    def test_from_json(self):
+        """Only the fields used by the plugin are kept"""
+        zone = Zone.from_json(
+            {
+                "id": 123,
+                "name": "exämple.com",
+                "name_idna": "xn--exmple-cua.com",
+                "_links": [{"href": "/data/dns/record/?zone=123"}],
+            }
+        )
+
+        self.assertEqual(
+            (123, "xn--exmple-cua.com", "/data/dns/record/?zone=123"), zone
+        )
+        self.assertEqual("xn--exmple-cua.com", zone.name)
+
+
+class ZoneIndexTest(unittest.TestCase):
+    """Test the in-memory DNS zone index"""
+
+    def setUp(self):
+        self.index = ZoneIndex()
+        self.index.load(
+            [
+                (1, "example.com", "/data/dns/record/?zone=1"),
+                (2, "sub.example.com", "/data/dns/record/?zone=2"),
+            ]
+        )
+
+    def test_lookup_longest_suffix(self):
+        """The most specific zone wins"""
+        self.assertEqual(1, self.index.lookup("www.example.com")[0])
+        self.assertEqual(1, self.index.lookup("Example.COM.")[0])
+        self.assertEqual(2, self.index.lookup("a.sub.example.com")[0])
+
+    def test_lookup_label_boundary(self):
+        """Zones only match on label boundaries"""
+        self.assertIsNone(self.index.lookup("notexample.com"))
+        self.assertIsNone(self.index.lookup("example.org"))
+
+
+class ResourceRecordTest(unittest.TestCase):
+    """Test the DNS RR model"""
+
+    def test_from_json(self):
+        """Only the fields used by the plugin are kept"""
+        record = ResourceRecord.from_json(RR)
+
+        self.assertEqual(
+            ResourceRecord(7, "_acme-challenge", "TXT", '"abc"', RR["modified"]),
+            record,
+        )
+        self.assertTrue(record.is_txt)
+        self.assertFalse(hasattr(record, "__dict__"))
+
+    def test_from_json_missing_fields(self):
+        """Missing optional fields do not fail decoding"""
+        record = ResourceRecord.from_json({"id": 1})
+
+        self.assertEqual("", record.name_prefix)
+        self.assertEqual("", record.rdata)
+        self.assertFalse(record.is_txt)
+        self.assertIsNone(record.timestamp)
+
+    def test_timestamp(self):
+        """Timestamps are parsed from ISO 8601 or UNIX time"""
+        cases = [
+            ("2024-01-01T00:00:00Z", 1704067200.0),
+            ("2024-01-01T01:00:00+01:00", 1704067200.0),
+            ("2024-01-01T00:00:00", 1704067200.0),
+            (1704067200, 1704067200.0),
+            ("yesterday", None),
+            (True, None),
+            (None, None),
+        ]
+        for changed, expected in cases:
+            with self.subTest(changed=changed):
+                record = ResourceRecord(1, "", "TXT", "", changed)
+                self.assertEqual(expected, record.timestamp)
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,215 @@
+"""Tests for certbot_dns_norisnetwork.propagation."""
+
+import socket
+import threading
+import unittest
+
+from unittest import mock
+
+from certbot import errors
+
+from certbot_dns_norisnetwork.propagation import (
+    INVALID,
+    PROPAGATED,
+    VALID,
+    DNSPythonResolver,
+    PropagationChecker,
+    adaptive_wait,
+)
+
+try:
+    import dns.message
+    import dns.rrset
+except ImportError:  # pragma: no cover
+    dns = None
+
+
+class FakeClock:
+    """Clock advanced by the sleep function"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self):
+        """Current time"""
+        return self.now
+
+    def sleep(self, seconds):
+        """Advance time"""
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class PropagationCheckerTest(unittest.TestCase):
+    """Test PropagationChecker"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.resolver = mock.MagicMock()
+        self.resolver.get_nameservers.return_value = ["192.0.2.1", "192.0.2.2"]
+        self.checker = PropagationChecker(
+            self.resolver,
+            timeout=60,
+            sleep=self.clock.sleep,
+            clock=self.clock.time,
+        )
+
+    def test_wait_until_all_nameservers_answer(self):
+        """Polling stops as soon as every nameserver serves every value"""
+        answers = {
+            "192.0.2.1": [set(), {"foo", "bar"}],
+            "192.0.2.2": [{"foo"}, {"foo"}, {"foo", "bar"}],
+        }
+        self.resolver.get_txt_values.side_effect = lambda ns, name: answers[ns].pop(0)
+
+        self.assertTrue(
+            self.checker.wait(
+                [
+                    ("example.com", "_acme-challenge.example.com", "foo"),
+                    ("example.com", "_acme-challenge.example.com", "bar"),
+                ]
+            )
+        )
+        self.assertEqual([1.0, 2.0], self.clock.sleeps)
+        self.assertEqual({"example.com": 3.0}, self.checker.elapsed)
+        self.resolver.get_nameservers.assert_called_once_with("example.com")
+
+    def test_elapsed_per_zone(self):
+        """The propagation time of every zone is kept"""
+        self.resolver.get_nameservers.return_value = ["192.0.2.1"]
+        answers = {
+            "_acme-challenge.example.com": [{"foo"}],
+            "_acme-challenge.example.org": [set(), set(), {"bar"}],
+        }
+        self.resolver.get_txt_values.side_effect = lambda ns, name: answers[name].pop(0)
+
+        self.assertTrue(
+            self.checker.wait(
+                [
+                    ("example.com", "_acme-challenge.example.com", "foo"),
+                    ("example.org", "_acme-challenge.example.org", "bar"),
+                ]
+            )
+        )
+        self.assertEqual({"example.com": 0.0, "example.org": 3.0}, self.checker.elapsed)
+
+    def test_wait_timeout(self):
+        """The backoff is capped and the wait is bounded by the timeout"""
+        self.resolver.get_txt_values.return_value = set()
+
+        self.assertFalse(
+            self.checker.wait([("example.com", "_acme-challenge.example.com", "foo")])
+        )
+        self.assertEqual([1.0, 2.0, 4.0, 8.0, 16.0, 16.0, 13.0], self.clock.sleeps)
+
+    def test_query_errors_are_retried(self):
+        """Failing queries count as not yet propagated"""
+        self.resolver.get_nameservers.return_value = ["192.0.2.1"]
+        self.resolver.get_txt_values.side_effect = [OSError("timeout"), {"foo"}]
+
+        self.assertTrue(
+            self.checker.wait([("example.com", "_acme-challenge.example.com", "foo")])
+        )
+
+    def test_no_nameservers(self):
+        """A zone without nameservers is an error"""
+        self.resolver.get_nameservers.return_value = []
+
+        self.assertRaises(
+            errors.PluginError,
+            self.checker.wait,
+            [("example.com", "_acme-challenge.example.com", "foo")],
+        )
+
+
+class AdaptiveWaitTest(unittest.TestCase):
+    """Test the wait learned from the propagation samples of a zone"""
+
+    @staticmethod
+    def _wait(*samples):
+        return adaptive_wait(
+            [{"seconds": seconds, "outcome": outcome} for seconds, outcome in samples],
+            default=60,
+            minimum=10,
+            maximum=300,
+        )
+
+    def test_without_samples(self):
+        """Zones without samples get the default wait"""
+        self.assertEqual(60, self._wait())
+
+    def test_measured(self):
+        """Measured propagation times get a margin and are clamped"""
+        self.assertEqual(10, self._wait((1.2, PROPAGATED)))
+        self.assertEqual(18, self._wait((12.3, PROPAGATED)))
+        self.assertEqual(300, self._wait((400, PROPAGATED)))
+
+    def test_percentile(self):
+        """A single outlier among many samples is ignored"""
+        samples = [(115, PROPAGATED)] + [(15, PROPAGATED)] * 19
+        self.assertEqual(20, self._wait(*samples))
+        self.assertEqual(120, self._wait(*samples[:6]))
+
+    def test_failure(self):
+        """After a failed validation the wait is increased"""
+        self.assertEqual(40, self._wait((20, VALID), (20, INVALID)))
+        self.assertEqual(40, self._wait((20, INVALID), (40, VALID)))
+
+    def test_probe(self):
+        """A wait validated several times in a row is shortened"""
+        self.assertEqual(60, self._wait((60, VALID), (60, VALID)))
+        self.assertEqual(48, self._wait((60, VALID), (60, VALID), (60, VALID)))
+        self.assertEqual(48, self._wait(*[(60, VALID)] * 3, (48, VALID)))
+        self.assertEqual(10, self._wait(*[(11, VALID)] * 3))
+
+    def test_probe_after_failure(self):
+        """A wait that failed before is not tried again"""
+        samples = [(20, VALID)] * 3 + [(16, INVALID)] + [(32, VALID)] * 3
+        self.assertEqual(26, self._wait(*samples))
+        samples += [(26, VALID)] * 3 + [(21, VALID)] * 3
+        self.assertEqual(17, self._wait(*samples))
+        self.assertEqual(17, self._wait(*samples, *[(17, VALID)] * 3))
+
+
+@unittest.skipIf(dns is None, "dnspython is not installed")
+class DNSPythonResolverTest(unittest.TestCase):
+    """Test DNSPythonResolver against a local stand-in DNS server"""
+
+    def setUp(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.sock.close()
+        self.thread.join()
+
+    def _serve(self):
+        try:
+            wire, addr = self.sock.recvfrom(4096)
+        except OSError:
+            return
+        query = dns.message.from_wire(wire)
+        response = dns.message.make_response(query)
+        response.answer.append(
+            dns.rrset.from_text(
+                query.question[0].name, 30, "IN", "TXT", '"foo"', '"bar" "baz"'
+            )
+        )
+        self.sock.sendto(response.to_wire(), addr)
+
+    def test_get_txt_values(self):
+        """TXT values are read from the answer section"""
+        resolver = DNSPythonResolver(port=self.port, timeout=2)
+
+        self.assertEqual(
+            {"foo", "barbaz"},
+            resolver.get_txt_values("127.0.0.1", "_acme-challenge.example.com"),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,1040 @@
+# pylint: disable=protected-access
+"""Tests for certbot_dns_norisnetwork.serviceapi."""
+
+import json
+import threading
+import unittest
+
+from unittest import mock
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import requests
+
+from certbot import errors
+from certbot.plugins.dns_test_common import DOMAIN
+
+from certbot_dns_norisnetwork.coalesce import PatchError
+from certbot_dns_norisnetwork.limits import DeadlineBudget
+from certbot_dns_norisnetwork.models import ZoneIndex
+from certbot_dns_norisnetwork.serviceapi import _ServiceAPIClient, _ServiceAPIError
+from certbot_dns_norisnetwork.storage import ResponseCache
+from certbot_dns_norisnetwork.tracing import Tracer
+
+FAKE_TOKEN = "faketoken1234"
+
+
+class ServiceAPIClientTest(unittest.TestCase):
+    """Test ServiceAPI Client"""
+
+    record_prefix = "_acme-challenge"
+    record_name = record_prefix + "." + DOMAIN
+    record_content = "bar"
+    record_ttl = 60
+
+    def setUp(self):
+        self.client = _ServiceAPIClient(FAKE_TOKEN)
+        sleep_patch = mock.patch("certbot_dns_norisnetwork.serviceapi.time.sleep")
+        self.mock_sleep = sleep_patch.start()
+        self.addCleanup(sleep_patch.stop)
+        self.client._get_url = mock.MagicMock(
+            return_value="fake.service.noris.net/api/endpoint/"
+        )
+
+    def test_add_txt_record(self):
+        """Test add_txt_record method"""
+
+        def api_response_helper_not_existing_rr(
+            method, endpoint, data=None, params=None
+        ):  # pylint: disable=unused-argument
+            if method == "GET":
+                if endpoint == "/data/dns/zone/":
+                    # called by function _find_managed_zone_id
+                    zone_info = {
+                        "_data": [
+                            {
+                                "id": 123,
+                                "name_idna": DOMAIN,
+                                "name": DOMAIN,
+                                "ttl": 86400,
+                                "_title": DOMAIN,
+                                "_target": "dns_zone",
+                                "_links": [
+                                    {
+                                        "href": "/data/dns/record/?_query=%7B%22zone%22:%7B%22id%22:123%7D%7D",  # pylint: disable=line-too-long
+                                        "rel": "record",
+                                    }
+                                ],
+                            }
+                        ],
+                        "recordsFiltered": 1,
+                    }
+                    return zone_info
+                if "/data/dns/record/" in endpoint:
+                    # called by function _get_txt_rrs_index, before the creation
+                    # and to look up the ID of the created record
+                    return {"_data": [], "recordsFiltered": 0}
+            elif method == "PATCH":
+                # called by function _insert_txt_record or _del_txt_record
+                pass
+            return None
+
+        self.client._api_request = mock.MagicMock(
+            side_effect=api_response_helper_not_existing_rr
+        )
+        self.client.add_txt_record(
+            DOMAIN, self.record_name, self.record_content, self.record_ttl
+        )
+        self.assertEqual(4, len(self.client._api_request.mock_calls))
+        self.client._api_request.assert_any_call(
+            "GET", "/data/dns/zone/", params={"_query": '{"for_fqdn": "example.com"}'}
+        )
+        self.client._api_request.assert_any_call(
+            "GET",
+            "/data/dns/record/?"
+            + urlencode(
+                {
+                    "_query": '{"zone":{"id":123},"dns_rr_type":{"id":16},'
+                    '"name_prefix":"_acme-challenge"}'
+                }
+            ),
+            params={"_limit": "500", "_offset": "0"},
+        )
+        self.client._api_request.assert_any_call(
+            "PATCH",
+            "/data/dns/zone/123/",
+            {
+                "_attributes": {
+                    "_log_message": "dns-01 challenge",
+                    "_delete": [],
+                    "_create": [
+                        {
+                            "name": "_acme-challenge",
+                            "type": "TXT",
+                            "ttl": 60,
+                            "rdata": '"bar"',
+                        }
+                    ],
+                }
+            },
+        )
+
+    def test_add_txt_records_trace(self):
+        """Spans of concurrent zone updates are tagged and nested below the caller"""
+        tracer = Tracer()
+        self.client.tracer = tracer
+        self.client.concurrency = 4
+
+        def api_response_helper(
+            method, endpoint, data=None, params=None
+        ):  # pylint: disable=unused-argument
+            if endpoint == "/data/dns/zone/":
+                domain = json.loads(params["_query"])["for_fqdn"]
+                zone_id = 456 if domain == "example.org" else 123
+                return {
+                    "_data": [
+                        {
+                            "id": zone_id,
+                            "name_idna": domain,
+                            "_links": [{"href": f"/data/dns/record/?zone={zone_id}"}],
+                        }
+                    ]
+                }
+            return {"_data": []}
+
+        self.client._api_request = mock.MagicMock(side_effect=api_response_helper)
+        with tracer.span("run"):
+            self.client.add_txt_records(
+                [
+                    (DOMAIN, self.record_name, "foo"),
+                    ("example.org", "_acme-challenge.example.org", "bar"),
+                ],
+                self.record_ttl,
+            )
+
+        spans = {
+            span["spanId"]: span
+            for span in tracer.to_otlp()["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        }
+        run_id = next(
+            span_id for span_id, span in spans.items() if span["name"] == "run"
+        )
+        tags = {
+            (span["name"], attribute["value"]["stringValue"])
+            for span in spans.values()
+            for attribute in span["attributes"]
+            if attribute["key"] in ("zone_id", "record_names")
+        }
+        self.assertTrue(
+            {
+                ("find_managed_zone_id", "123"),
+                ("find_managed_zone_id", "456"),
+                ("insert_txt_records", "123"),
+                ("insert_txt_records", "456"),
+                ("get_txt_rrs_index", self.record_prefix),
+            }
+            <= tags
+        )
+        for span in spans.values():
+            if span["name"] != "run":
+                self.assertEqual(run_id, span["parentSpanId"])
+
+    def test_get_record_name(self):
+        """Only the zone name at the end of the record name is removed"""
+        self.assertEqual(
+            "_acme-challenge",
+            self.client._get_record_name("_acme-challenge.Example.COM.", DOMAIN),
+        )
+        self.assertEqual(
+            "_acme-challenge.example.com.mirror",
+            self.client._get_record_name(
+                "_acme-challenge.example.com.mirror.example.com", DOMAIN
+            ),
+        )
+        self.assertEqual(
+            "_acme-challenge.www",
+            self.client._get_record_name(
+                "_acme-challenge.www.myexample.com", "myexample.com"
+            ),
+        )
+        with self.assertRaises(errors.PluginError):
+            self.client._get_record_name("_acme-challenge.notexample.com", DOMAIN)
+
+    def test_add_txt_records_plan(self):
+        """Duplicate records are collapsed and existing records are not created again"""
+        self.client._find_managed_zone_id = mock.MagicMock(
+            return_value=(123, DOMAIN, "/data/dns/record/?zone=123")
+        )
+
+        def api_response_helper(
+            method, endpoint, data=None, params=None
+        ):  # pylint: disable=unused-argument
+            if method == "GET":
+                # left behind by an earlier attempt
+                return {
+                    "_data": [
+                        {
+                            "id": 1,
+                            "name_prefix": "_acme-challenge",
+                            "dns_rr_type": {"_title": "TXT"},
+                            "rdata": '"foo"',
+                        }
+                    ]
+                }
+            return {
+                "_data": [{"id": 2, "name_prefix": "_acme-challenge", "rdata": '"bar"'}]
+            }
+
+        self.client._api_request = mock.MagicMock(side_effect=api_response_helper)
+
+        created_rrs = self.client.add_txt_records(
+            [
+                (DOMAIN, "_acme-challenge." + DOMAIN, "foo"),
+                ("*." + DOMAIN, "_acme-challenge." + DOMAIN, "bar"),
+                ("*." + DOMAIN, "_acme-challenge." + DOMAIN, "bar"),
+            ],
+            self.record_ttl,
+        )
+
+        self.assertEqual(
+            {(123, "_acme-challenge", "foo"): 1, (123, "_acme-challenge", "bar"): 2},
+            created_rrs,
+        )
+        self.assertEqual(2, self.client._api_request.call_count)
+        self.client._api_request.assert_called_with(
+            "PATCH",
+            "/data/dns/zone/123/",
+            {
+                "_attributes": {
+                    "_log_message": "dns-01 challenge",
+                    "_delete": [],
+                    "_create": [
+                        {
+                            "name": "_acme-challenge",
+                            "type": "TXT",
+                            "ttl": 60,
+                            "rdata": '"bar"',
+                        }
+                    ],
+                }
+            },
+        )
+
+    def test_add_txt_records_one_patch_per_zone(self):
+        """Test that add_txt_records sends a single PATCH for every DNS zone"""
+
+        def zone_for(domain):
+            zone_id, zone_name = (
+                (456, "example.org") if "example.org" in domain else (123, DOMAIN)
+            )
+            return zone_id, zone_name, f"/data/dns/record/?zone={zone_id}"
+
+        patched = set()
+
+        def api_response_helper(
+            method, endpoint, data=None, params=None
+        ):  # pylint: disable=unused-argument
+            if method == "PATCH":
+                patched.add(endpoint)
+            if method == "PATCH" and endpoint == "/data/dns/zone/123/":
+                # the created RRs are part of the response
+                return {
+                    "_data": [
+                        {"id": 1, "name_prefix": "_acme-challenge", "rdata": '"foo"'},
+                        {
+                            "id": 2,
+                            "name_prefix": "_acme-challenge.www",
+                            "rdata": '"bar"',
+                        },
+                    ]
+                }
+            if method == "GET" and "/data/dns/zone/456/" in patched:
+                # lookup of the RR created in zone 456
+                return {
+                    "_data": [
+                        {
+                            "id": 3,
+                            "name_prefix": "_acme-challenge",
+                            "dns_rr_type": {"_title": "TXT"},
+                            "rdata": '"baz"',
+                        }
+                    ]
+                }
+            if method == "GET":
+                # no records left behind by earlier attempts
+                return {"_data": []}
+            return {}
+
+        self.client._find_managed_zone_id = mock.MagicMock(side_effect=zone_for)
+        self.client._api_request = mock.MagicMock(side_effect=api_response_helper)
+
+        created_rrs = self.client.add_txt_records(
+            [
+                (DOMAIN, "_acme-challenge." + DOMAIN, "foo"),
+                ("www." + DOMAIN, "_acme-challenge.www." + DOMAIN, "bar"),
+                ("example.org", "_acme-challenge.example.org", "baz"),
+            ],
+            self.record_ttl,
+        )
+
+        self.assertEqual(
+            {
+                (123, "_acme-challenge", "foo"): 1,
+                (123, "_acme-challenge.www", "bar"): 2,
+                (456, "_acme-challenge", "baz"): 3,
+            },
+            created_rrs,
+        )
+        # a lookup of the existing records per name, and one of the RR created in 456
+        self.assertEqual(6, len(self.client._api_request.mock_calls))
+        self.client._api_request.assert_any_call(
+            "PATCH",
+            "/data/dns/zone/123/",
+            {
+                "_attributes": {
+                    "_log_message": "dns-01 challenge",
+                    "_delete": [],
+                    "_create": [
+                        {
+                            "name": "_acme-challenge",
+                            "type": "TXT",
+                            "ttl": 60,
+                            "rdata": '"foo"',
+                        },
+                        {
+                            "name": "_acme-challenge.www",
+                            "type": "TXT",
+                            "ttl": 60,
+                            "rdata": '"bar"',
+                        },
+                    ],
+                }
+            },
+        )
+        self.client._api_request.assert_any_call(
+            "PATCH",
+            "/data/dns/zone/456/",
+            {
+                "_attributes": {
+                    "_log_message": "dns-01 challenge",
+                    "_delete": [],
+                    "_create": [
+                        {
+                            "name": "_acme-challenge",
+                            "type": "TXT",
+                            "ttl": 60,
+                            "rdata": '"baz"',
+                        },
+                    ],
+                }
+            },
+        )
+
+    def test_find_managed_zone_id_with_zone_index(self):
+        """Test that zones are loaded once and looked up locally"""
+        zone_index = ZoneIndex()
+        self.client.zone_index = zone_index
+
+        def api_response_helper(
+            method, endpoint, data=None, params=None
+        ):  # pylint: disable=unused-argument
+            if "for_fqdn" in params.get("_query", ""):
+                return {
+                    "_data": [
+                        {
+                            "id": 456,
+                            "name_idna": "example.org",
+                            "_links": [{"href": "/data/dns/record/?zone=456"}],
+                        }
+                    ],
+                    "recordsFiltered": 1,
+                }
+            zones = [
+                {
+                    "id": 100 + i,
+                    "name_idna": f"zone{i}.example.com",
+                    "_links": [{"href": f"/data/dns/record/?zone={100 + i}"}],
+                }
+                for i in range(int(params["_offset"]), 3)
+            ][: int(params["_limit"])]
+            return {"_data": zones, "recordsFiltered": 3}
+
+        self.client._api_request = mock.MagicMock(side_effect=api_response_helper)
+        with mock.patch("certbot_dns_norisnetwork.serviceapi.PAGE_SIZE", 2):
+            self.assertEqual(
+                100, self.client._find_managed_zone_id("zone0.example.com")[0]
+            )
+            self.assertEqual(
+                102, self.client._find_managed_zone_id("a.zone2.example.com")[0]
+            )
+            self.assertEqual(456, self.client._find_managed_zone_id("example.org")[0])
+            self.assertEqual(
+                456, self.client._find_managed_zone_id("www.example.org")[0]
+            )
+
+        # two pages of zones and a single for_fqdn fallback
+        self.assertEqual(3, len(self.client._api_request.mock_calls))
+
+    def test_find_managed_zone_id_zone_index_failure(self):
+        """Test the fallback to for_fqdn lookups when the zones cannot be listed"""
+        self.client.zone_index = ZoneIndex()
+        self.client._api_request = mock.MagicMock(
+            side_effect=[
+                errors.PluginError("HTTP Error"),
+                {
+                    "_data": [
+                        {
+                            "id": 123,
+                            "name_idna": DOMAIN,
+                            "_links": [{"href": "/data/dns/record/?zone=123"}],
+                        }
+                    ]
+                },
+            ]
+        )
+
+        self.assertEqual(123, self.client._find_managed_zone_id(DOMAIN)[0])
+        self.client._api_request.assert_called_with(
+            "GET", "/data/dns/zone/", params={"_query": '{"for_fqdn": "example.com"}'}
+        )
+
+    def test_find_managed_zone_id_with_zone_cache(self):
+        """Test that cached zones are used without asking the Service API"""
+        self.client.zone_cache = mock.MagicMock()
+        self.client.zone_cache.get.return_value = (123, DOMAIN, "/records/")
+        self.client._api_request = mock.MagicMock()
+
+        self.assertEqual(
+            (123, DOMAIN, "/records/"), self.client._find_managed_zone_id(DOMAIN)
+        )
+        self.client._api_request.assert_not_called()
+
+    def test_patch_zone_not_found_invalidates_zone(self):
+        """Test that a 404 on PATCH removes the zone from the caches"""
+        self.client.zone_cache = mock.MagicMock()
+        self.client.zone_index = ZoneIndex()
+        self.client.zone_index.add((123, DOMAIN, "/records/"))
+        self.client.session.request = mock.MagicMock()
+        self.client.session.request.return_value.status_code = 404
+
+        self.assertRaises(
+            errors.PluginError,
+            self.client._insert_txt_records,
+            123,
+            [("_acme-challenge", "foo")],
+            self.record_ttl,
+        )
+        self.client.zone_cache.invalidate_zone.assert_called_once_with(123)
+        self.assertIsNone(self.client.zone_index.lookup(DOMAIN))
+
+    def test_patch_zone_coalesced(self):
+        """Test that PATCH requests are sent through the coalescer, keeping error codes"""
+        self.client.zone_cache = mock.MagicMock()
+        self.client.coalescer = mock.MagicMock()
+        self.client.coalescer.patch.side_effect = lambda zone_id, data, send: send(data)
+        self.client._api_request = mock.MagicMock(return_value={"_data": []})
+
+        self.client._insert_txt_records(
+            123, [("_acme-challenge", "foo")], self.record_ttl
+        )
+        self.client._api_request.assert_called_once_with(
+            "PATCH",
+            "/data/dns/zone/123/",
+            self.client._prepare_rr_data([("_acme-challenge", "foo")], self.record_ttl),
+        )
+
+        self.client.coalescer.patch.side_effect = PatchError("Not found", 404)
+        with self.assertRaises(_ServiceAPIError) as context:
+            self.client._delete_txt_records(123, [1])
+        self.assertEqual(404, context.exception.status_code)
+        self.client.zone_cache.invalidate_zone.assert_called_once_with(123)
+
+    def test_add_txt_records_concurrently(self):
+        """Test that zones are updated in parallel with aggregated errors"""
+        self.client.concurrency = 4
+        barrier = threading.Barrier(3, timeout=5)
+
+        def zone_for(domain):
+            zone_id = int(domain.split(".")[0][4:])
+            return zone_id, domain, f"/data/dns/record/?zone={zone_id}"
+
+        def api_response_helper(
+            method, endpoint, data=None, params=None
+        ):  # pylint: disable=unused-argument
+            if method == "PATCH":
+                # all three PATCH requests must be in flight at the same time
+                barrier.wait()
+                if endpoint != "/data/dns/zone/1/":
+                    raise errors.PluginError(f"HTTP Error at {endpoint}")
+            return {"_data": []}
+
+        self.client._find_managed_zone_id = mock.MagicMock(side_effect=zone_for)
+        self.client._api_request = mock.MagicMock(side_effect=api_response_helper)
+
+        with self.assertRaises(errors.PluginError) as context:
+            self.client.add_txt_records(
+                [
+                    (
+                        f"zone{i}.example.com",
+                        f"_acme-challenge.zone{i}.example.com",
+                        "x",
+                    )
+                    for i in range(1, 4)
+                ],
+                self.record_ttl,
+            )
+        self.assertIn("/data/dns/zone/2/", str(context.exception))
+        self.assertIn("/data/dns/zone/3/", str(context.exception))
+        self.assertNotIn("/data/dns/zone/1/", str(context.exception))
+
+    def test_get_txt_rrs_index_per_name(self):
+        """Test that the TXT records of a few distinct names are requested name by name"""
+        self.client._api_request = mock.MagicMock(
+            side_effect=lambda method, endpoint, params=None: {
+                "_data": [
+                    {
+                        "id": len(endpoint),
+                        "name_prefix": json.loads(
+                            parse_qs(urlsplit(endpoint).query)["_query"][0]
+                        )["name_prefix"],
+                        "dns_rr_type": {"_title": "TXT"},
+                        "rdata": '"foo"',
+                    }
+                ]
+            }
+        )
+
+        index = self.client._get_txt_rrs_index(
+            "/data/dns/record/?zone=123",
+            ["_acme-challenge.www", "_acme-challenge", "_acme-challenge.www"],
+        )
+
+        self.assertEqual(
+            [("_acme-challenge", '"foo"'), ("_acme-challenge.www", '"foo"')],
+            sorted(index),
+        )
+        self.assertEqual(
+            [
+                "/data/dns/record/?"
+                + urlencode(
+                    {
+                        "zone": "123",
+                        "_query": json.dumps(
+                            {"dns_rr_type": {"id": 16}, "name_prefix": name},
+                            separators=(",", ":"),
+                        ),
+                    }
+                )
+                for name in ("_acme-challenge", "_acme-challenge.www")
+            ],
+            [call.args[1] for call in self.client._api_request.mock_calls],
+        )
+
+    def test_add_txt_record_fail_to_authenticate(self):
+        """Test add_txt_record method when you get an HTTPUnauthorized error"""
+
+        self.client.session.request = mock.MagicMock()
+        self.client.session.request.return_value.status_code = 401
+        self.assertRaises(
+            errors.PluginError,
+            self.client.add_txt_record,
+            DOMAIN,
+            self.record_name,
+            self.record_content,
+            self.record_ttl,
+        )
+
+    def test_api_request_uses_session(self):
+        """Test that requests go through the pooled session with split timeouts"""
+        self.client.session.request = mock.MagicMock()
+        self.client.session.request.return_value.status_code = 200
+        self.client.session.request.return_value.content = b'{"_data": []}'
+
+        self.assertEqual({"_data": []}, self.client._api_request("GET", "/endpoint/"))
+        self.client.session.request.assert_called_once_with(
+            "GET",
+            "fake.service.noris.net/api/endpoint/",
+            json=None,
+            params=None,
+            timeout=(10, 120),
+            headers=None,
+        )
+
+    def test_api_request_connection_error(self):
+        """Test that connection errors are reported as PluginError"""
+        self.client.session.request = mock.MagicMock(
+            side_effect=requests.exceptions.ConnectionError("refused")
+        )
+        self.assertRaises(errors.PluginError, self.client._api_request, "GET", "/")
+
+    def test_api_request_retries_transient_errors(self):
+        """Test that GET requests are retried on 503 honoring Retry-After"""
+        unavailable = mock.MagicMock(status_code=503, headers={"Retry-After": "7"})
+        success = mock.MagicMock(status_code=200)
+        success.content = b'{"_data": []}'
+        self.client.session.request = mock.MagicMock(
+            side_effect=[
+                requests.exceptions.ConnectionError("reset"),
+                unavailable,
+                success,
+            ]
+        )
+
+        self.assertEqual({"_data": []}, self.client._api_request("GET", "/endpoint/"))
+        self.assertEqual(3, self.client.session.request.call_count)
+        self.assertEqual(7, self.mock_sleep.mock_calls[1].args[0])
+
+    def test_api_request_retries_are_bounded(self):
+        """Test that retries stop after the configured number of attempts"""
+        self.client.retries = 2
+        self.client.session.request = mock.MagicMock()
+        self.client.session.request.return_value.status_code = 502
+
+        self.assertRaises(errors.PluginError, self.client._api_request, "GET", "/")
+        self.assertEqual(3, self.client.session.request.call_count)
+
+    def test_api_request_patch_not_retried_on_server_error(self):
+        """Test that a PATCH is only repeated if it was surely not processed"""
+        self.client.session.request = mock.MagicMock()
+        self.client.session.request.return_value.status_code = 504
+        self.assertRaises(
+            errors.PluginError, self.client._api_request, "PATCH", "/", {}
+        )
+        self.assertEqual(1, self.client.session.request.call_count)
+
+        rate_limited = mock.MagicMock(status_code=429, headers={})
+        success = mock.MagicMock(status_code=200)
+        success.content = b"{}"
+        self.client.session.request = mock.MagicMock(
+            side_effect=[rate_limited, success]
+        )
+        self.assertEqual({}, self.client._api_request("PATCH", "/", {}))
+
+    def test_api_request_deadline(self):
+        """Test that the timeouts and retries are limited by the deadline"""
+        self.client.deadline = DeadlineBudget(5)
+        self.client.session.request = mock.MagicMock()
+        self.client.session.request.return_value.status_code = 503
+        self.client.session.request.return_value.headers = {"Retry-After": "7"}
+
+        with self.client.deadline.phase("lookup"):
+            self.assertRaises(errors.PluginError, self.client._api_request, "GET", "/")
+        self.client.session.request.assert_called_once()
+        connect, read = self.client.session.request.call_args.kwargs["timeout"]
+        self.assertLessEqual(connect, 5 / 3)
+        self.assertLessEqual(read, 5 / 3)
+        self.mock_sleep.assert_not_called()
+
+    def test_api_request_hedged(self):
+        """Test that a slow GET request is sent again and the first response used"""
+        self.client.hedge_delay = 0.01
+        self.addCleanup(self.client.close)
+        hedge_answered = threading.Event()
+        fast = mock.MagicMock(status_code=200)
+        fast.content = b'{"_data": "fast"}'
+        slow = mock.MagicMock(status_code=200)
+        slow.content = b'{"_data": "slow"}'
+
+        def request(*args, **kwargs):  # pylint: disable=unused-argument
+            if self.client.session.request.call_count == 1:
+                hedge_answered.wait(10)
+                return slow
+            hedge_answered.set()
+            return fast
+
+        self.client.session.request = mock.MagicMock(side_effect=request)
+        self.assertEqual({"_data": "fast"}, self.client._api_request("GET", "/"))
+        self.assertEqual(2, self.client.session.request.call_count)
+
+        self.client.session.request = mock.MagicMock(return_value=fast)
+        self.client._api_request("PATCH", "/", {})
+        self.client.session.request.assert_called_once()
+
+    def test_api_request_hedged_losers(self):
+        """Test that requests losing the race do not hold up later requests"""
+        self.client.hedge_delay = 0.01
+        released = threading.Event()
+        self.addCleanup(released.set)
+        fast = mock.MagicMock(status_code=200)
+        fast.content = b'{"_data": "fast"}'
+        slow = mock.MagicMock(status_code=200)
+        slow.content = b'{"_data": "slow"}'
+
+        def request(*args, **kwargs):  # pylint: disable=unused-argument
+            # Every first request hangs until the end of the test.
+            if self.client.session.request.call_count % 2:
+                released.wait(10)
+                return slow
+            return fast
+
+        self.client.session.request = mock.MagicMock(side_effect=request)
+        for _ in range(4):
+            self.assertEqual({"_data": "fast"}, self.client._api_request("GET", "/"))
+        self.assertEqual(8, self.client.session.request.call_count)
+
+    def test_api_request_conditional(self):
+        """Test that cached GET responses are revalidated and dropped after changes"""
+        self.client.response_cache = ResponseCache(2**20)
+        self.client._get_url = lambda endpoint: "https://service-api" + endpoint
+        endpoint = '/data/dns/record/?_query={"zone":{"id":123}}'
+        found = mock.MagicMock(status_code=200, headers={"ETag": '"v1"'})
+        found.content = b'{"_data": [1]}'
+        not_modified = mock.MagicMock(status_code=304, headers={})
+        self.client.session.request = mock.MagicMock(
+            side_effect=[found, not_modified, found, found]
+        )
+
+        first = self.client._api_request("GET", endpoint)
+        self.assertEqual(first, self.client._api_request("GET", endpoint))
+        self.client._patch_zone(123, {})
+        self.assertEqual(first, self.client._api_request("GET", endpoint))
+
+        headers = [c.kwargs["headers"] for c in self.client.session.request.mock_calls]
+        self.assertEqual([None, {"If-None-Match": '"v1"'}, None, None], headers)
+
+    def test_cache_key(self):
+        """Test that the parameters of a request are added to the query of its URL"""
+        url = "https://service-api/data/dns/record/?_query=%7B%7D"
+        self.assertEqual(url, self.client._get_cache_key(url, None))
+        self.assertEqual(
+            url + "&_limit=500&_offset=0",
+            self.client._get_cache_key(url, {"_offset": "0", "_limit": "500"}),
+        )
+        self.assertEqual(
+            "https://service-api/data/dns/zone/?_limit=500",
+            self.client._get_cache_key(
+                "https://service-api/data/dns/zone/", {"_limit": "500"}
+            ),
+        )
+
+    def test_api_request_rate_limit(self):
+        """Test that every request takes a token from the rate limiter"""
+        self.client.rate_limiter = mock.MagicMock()
+        self.client.session.request = mock.MagicMock()
+        self.client.session.request.return_value.status_code = 200
+        self.client.session.request.return_value.content = b"{}"
+
+        self.client._api_request("GET", "/")
+        self.client._api_request("GET", "/")
+        self.assertEqual(2, len(self.client.rate_limiter.acquire.mock_calls))
+
+    def test_add_txt_record_fail_to_find_domain(self):
+        """
+        Test add_txt_record method.
+        Mock the_api_request with the response returned when a DNS zone cannot be found:
+        i.e. it's not managed by nnIS
+        """
+        self.client._api_request = mock.MagicMock(
+            return_value={"_data": [], "recordsFiltered": 0}
+        )
+        self.assertRaises(
+            errors.PluginError,
+            self.client.add_txt_record,
+            DOMAIN,
+            self.record_name,
+            self.record_content,
+            self.record_ttl,
+        )
+
+    def test_del_txt_record(self):
+        """Test del_txt_record method"""
+
+        def api_response_helper_existing_acme_rr(
+            method,
+            endpoint,
+            data=None,
+            params=None,
+        ):  # pylint: disable=unused-argument
+            if method == "GET":
+                if endpoint == "/data/dns/zone/":
+                    # called by function _find_managed_zone_id
+                    zone_info = {
+                        "_data": [
+                            {
+                                "id": 123,
+                                "name_idna": DOMAIN,
+                                "name": DOMAIN,
+                                "ttl": 86400,
+                                "_title": DOMAIN,
+                                "_target": "dns_zone",
+                                "_links": [
+                                    {
+                                        "href": "/data/dns/record/?_query=%7B%22zone%22:%7B%22id%22:123%7D%7D",  # pylint: disable=line-too-long
+                                        "rel": "record",
+                                    }
+                                ],
+                            }
+                        ],
+                        "recordsFiltered": 1,
+                    }
+                    return zone_info
+                if "/data/dns/record/" in endpoint:
+                    # called by function _get_txt_rrs_index
+                    # returns an existing record
+                    record = {
+                        "_data": [
+                            {
+                                "id": 247,
+                                "name_prefix": "_acme-challenge",
+                                "zone": {
+                                    "id": 123,
+                                    "_target": "dns_zone",
+                                    "_title": DOMAIN,
+                                },
+                                "dns_rr_type": {
+                                    "id": 16,
+                                    "_target": "dns_rr_type",
+                                    "_title": "TXT",
+                                },
+                                "ttl": 60,
+                                "mx_preference": None,
+                                "rdata": f'"{self.record_content}"',
+                                "effective_rdata": self.record_content,
+                                "_title": f'_acme_challenge TXT "{self.record_content}"',
+                                "_target": "dns_rr",
+                            },
+                        ],
+                        "recordsFiltered": 1,
+                    }
+                    return record
+            elif method == "PATCH":
+                # called by function _insert_txt_record or _del_txt_record
+                pass
+            return None
+
+        self.client._api_request = mock.MagicMock(
+            side_effect=api_response_helper_existing_acme_rr
+        )
+        self.client.del_txt_record(DOMAIN, self.record_name, self.record_content)
+        self.assertEqual(3, len(self.client._api_request.mock_calls))
+        self.client._api_request.assert_any_call(
+            "GET", "/data/dns/zone/", params={"_query": '{"for_fqdn": "example.com"}'}
+        )
+        self.client._api_request.assert_any_call(
+            "GET",
+            "/data/dns/record/?"
+            + urlencode(
+                {
+                    "_query": '{"zone":{"id":123},"dns_rr_type":{"id":16},'
+                    '"name_prefix":"_acme-challenge"}'
+                }
+            ),
+            params={"_limit": "500", "_offset": "0"},
+        )
+        self.client._api_request.assert_any_call(
+            "PATCH",
+            "/data/dns/zone/123/",
+            {
+                "_attributes": {
+                    "_log_message": "dns-01 challenge delete",
+                    "_delete": [{"id": 247}],
+                    "_create": [],
+                }
+            },
+        )
+
+    def test_del_txt_records_one_listing_and_patch_per_zone(self):
+        """Test that del_txt_records lists and patches every DNS zone once"""
+        self.client._find_managed_zone_id = mock.MagicMock(
+            return_value=(123, DOMAIN, "/data/dns/record/?zone=123")
+        )
+
+        def api_response_helper(
+            method, endpoint, data=None, params=None
+        ):  # pylint: disable=unused-argument
+            if method == "GET":
+                return {
+                    "_data": [
+                        {
+                            "id": 1,
+                            "name_prefix": "_acme-challenge",
+                            "dns_rr_type": {"_title": "TXT"},
+                            "rdata": '"foo"',
+                        },
+                        {
+                            "id": 2,
+                            "name_prefix": "_acme-challenge.www",
+                            "dns_rr_type": {"_title": "TXT"},
+                            "rdata": '"bar"',
+                        },
+                        {
+                            "id": 3,
+                            "name_prefix": "_acme-challenge.www",
+                            "dns_rr_type": {"_title": "CNAME"},
+                            "rdata": '"bar"',
+                        },
+                    ]
+                }
+            return None
+
+        self.client._api_request = mock.MagicMock(side_effect=api_response_helper)
+        self.client.del_txt_records(
+            [
+                (DOMAIN, "_acme-challenge." + DOMAIN, "foo"),
+                ("www." + DOMAIN, "_acme-challenge.www." + DOMAIN, "bar"),
+                ("mail." + DOMAIN, "_acme-challenge.mail." + DOMAIN, "missing"),
+            ]
+        )
+
+        self.assertEqual(2, len(self.client._api_request.mock_calls))
+        self.client._api_request.assert_any_call(
+            "GET",
+            "/data/dns/record/?"
+            + urlencode({"zone": "123", "_query": '{"dns_rr_type":{"id":16}}'}),
+            params={"_limit": "500", "_offset": "0"},
+        )
+        self.client._api_request.assert_any_call(
+            "PATCH",
+            "/data/dns/zone/123/",
+            {
+                "_attributes": {
+                    "_log_message": "dns-01 challenge delete",
+                    "_delete": [{"id": 1}, {"id": 2}],
+                    "_create": [],
+                }
+            },
+        )
+
+    def test_del_txt_records_with_known_ids(self):
+        """Test that del_txt_records skips the RR listing for known RR IDs"""
+        self.client._find_managed_zone_id = mock.MagicMock(
+            return_value=(123, DOMAIN, "/data/dns/record/?zone=123")
+        )
+        self.client._api_request = mock.MagicMock()
+
+        self.client.del_txt_records(
+            [(DOMAIN, "_acme-challenge." + DOMAIN, "foo")],
+            {(123, "_acme-challenge", "foo"): 42},
+        )
+
+        self.assertEqual(1, len(self.client._api_request.mock_calls))
+        self.client._api_request.assert_called_once_with(
+            "PATCH",
+            "/data/dns/zone/123/",
+            {
+                "_attributes": {
+                    "_log_message": "dns-01 challenge delete",
+                    "_delete": [{"id": 42}],
+                    "_create": [],
+                }
+            },
+        )
+
+    def test_del_txt_records_continues_after_zone_error(self):
+        """Test that a failing zone does not prevent the cleanup of other zones"""
+
+        def zone_for(domain):
+            zone_id = 456 if "example.org" in domain else 123
+            return zone_id, domain, f"/data/dns/record/?zone={zone_id}"
+
+        def api_response_helper(
+            method, endpoint, data=None, params=None
+        ):  # pylint: disable=unused-argument
+            if "zone=123" in endpoint:
+                raise errors.PluginError("HTTP Error")
+            if method == "GET":
+                return {
+                    "_data": [
+                        {
+                            "id": 7,
+                            "name_prefix": "_acme-challenge",
+                            "dns_rr_type": {"_title": "TXT"},
+                            "rdata": '"baz"',
+                        }
+                    ]
+                }
+            return None
+
+        self.client._find_managed_zone_id = mock.MagicMock(side_effect=zone_for)
+        self.client._api_request = mock.MagicMock(side_effect=api_response_helper)
+
+        self.assertRaises(
+            errors.PluginError,
+            self.client.del_txt_records,
+            [
+                (DOMAIN, "_acme-challenge." + DOMAIN, "foo"),
+                ("example.org", "_acme-challenge.example.org", "baz"),
+            ],
+        )
+        self.client._api_request.assert_any_call(
+            "PATCH",
+            "/data/dns/zone/456/",
+            {
+                "_attributes": {
+                    "_log_message": "dns-01 challenge delete",
+                    "_delete": [{"id": 7}],
+                    "_create": [],
+                }
+            },
+        )
+
+    def test_del_txt_record_fail_to_authenticate(self):
+        """Test del_txt_record method when you get an HTTPUnauthorized error"""
+        self.client.session.request = mock.MagicMock()
+        self.client.session.request.return_value.status_code = 401
+        self.assertRaises(
+            errors.PluginError,
+            self.client.del_txt_record,
+            DOMAIN,
+            self.record_name,
+            self.record_content,
+        )
+
+    def test_del_txt_record_fail_to_find_domain(self):
+        """
+        Test del_txt_record method.
+        Mock the_api_request with the response returned when a DNS zone cannot be found.
+        """
+        self.client._api_request = mock.MagicMock(
+            return_value={"_data": [], "recordsFiltered": 0}
+        )
+        self.assertRaises(
+            errors.PluginError,
+            self.client.del_txt_record,
+            DOMAIN,
+            self.record_name,
+            self.record_content,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,218 @@
+"""Tests for certbot_dns_norisnetwork.storage."""
+
+import json
+import unittest
+
+from unittest import mock
+
+from certbot.compat import os
+from certbot.tests import util as test_util
+
+from certbot_dns_norisnetwork.storage import (
+    CleanupJournal,
+    PropagationStats,
+    ResponseCache,
+    ZoneCache,
+    account_state_path,
+    read_json,
+    write_json_atomic,
+)
+
+ZONE = (123, "example.com", "/data/dns/record/?zone=123")
+
+
+class JSONFileTest(test_util.TempDirTestCase):
+    """Test JSON file helpers"""
+
+    def test_write_and_read(self):
+        """Written content can be read back, without leftover temporary files"""
+        path = os.path.join(self.tempdir, "sub", "data.json")
+        write_json_atomic(path, {"a": 1})
+
+        self.assertEqual({"a": 1}, read_json(path))
+        self.assertEqual(["data.json"], os.listdir(os.path.dirname(path)))
+
+    def test_read_invalid(self):
+        """Missing and corrupt files read as None"""
+        path = os.path.join(self.tempdir, "data.json")
+        self.assertIsNone(read_json(path))
+
+        with open(path, "w", encoding="utf-8") as json_file:
+            json_file.write("{not json")
+        self.assertIsNone(read_json(path))
+
+
+class ZoneCacheTest(test_util.TempDirTestCase):
+    """Test the on-disk DNS zone cache"""
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.tempdir, "zones.json")
+
+    def test_put_and_get_across_instances(self):
+        """Saved entries are visible to other processes"""
+        cache = ZoneCache(self.path, 3600)
+        cache.put("example.com", ZONE)
+        cache.save()
+
+        self.assertEqual(ZONE, ZoneCache(self.path, 3600).get("example.com"))
+        self.assertIsNone(ZoneCache(self.path, 3600).get("example.org"))
+
+    def test_expired_entries(self):
+        """Entries older than the TTL are ignored"""
+        cache = ZoneCache(self.path, 60)
+        with mock.patch("certbot_dns_norisnetwork.storage.time.time") as mock_time:
+            mock_time.return_value = 1000
+            cache.put("example.com", ZONE)
+            mock_time.return_value = 1061
+            self.assertIsNone(cache.get("example.com"))
+
+    def test_save_merges_concurrent_changes(self):
+        """Saving does not drop entries written by another process"""
+        first = ZoneCache(self.path, 3600)
+        second = ZoneCache(self.path, 3600)
+        first.get("example.com")
+        second.put("example.org", (456, "example.org", "/records/"))
+        second.save()
+        first.put("example.com", ZONE)
+        first.save()
+
+        with open(self.path, encoding="utf-8") as cache_file:
+            self.assertEqual(
+                {"example.com", "example.org"}, set(json.load(cache_file)["zones"])
+            )
+
+    def test_invalidate_zone(self):
+        """All domains of an invalidated zone are removed from the file"""
+        cache = ZoneCache(self.path, 3600)
+        cache.put("example.com", ZONE)
+        cache.put("www.example.com", ZONE)
+        cache.put("example.org", (456, "example.org", "/records/"))
+        cache.save()
+
+        cache.invalidate_zone(123)
+
+        other = ZoneCache(self.path, 3600)
+        self.assertIsNone(other.get("example.com"))
+        self.assertIsNone(other.get("www.example.com"))
+        self.assertIsNotNone(other.get("example.org"))
+
+
+class CleanupJournalTest(test_util.TempDirTestCase):
+    """Test the journal of deferred deletions"""
+
+    def setUp(self):
+        super().setUp()
+        self.path = account_state_path(self.tempdir, "cleanup", "faketoken1234")
+
+    @staticmethod
+    def _entry(record_content, rr_id=None):
+        return {
+            "zone_id": ZONE[0],
+            "dns_rrs_endpoint": ZONE[2],
+            "record_name": "_acme-challenge",
+            "record_content": record_content,
+            "rr_id": rr_id,
+        }
+
+    def test_append_and_remove(self):
+        """Entries are kept until they are removed, also across instances"""
+        CleanupJournal(self.path).append([self._entry("foo", 1)])
+        CleanupJournal(self.path).append([self._entry("bar")])
+
+        journal = CleanupJournal(self.path)
+        entries = journal.read()
+        self.assertEqual(["foo", "bar"], [entry["record_content"] for entry in entries])
+
+        # appended while the first entry was being deleted
+        CleanupJournal(self.path).append([self._entry("baz")])
+        journal.remove(entries[:1])
+
+        self.assertEqual(
+            ["bar", "baz"],
+            [entry["record_content"] for entry in CleanupJournal(self.path).read()],
+        )
+
+    def test_invalid_journal(self):
+        """Unreadable journals and incomplete entries are ignored"""
+        write_json_atomic(self.path, {"entries": [{"zone_id": 1}, "foo"]})
+        self.assertEqual([], CleanupJournal(self.path).read())
+
+
+class PropagationStatsTest(test_util.TempDirTestCase):
+    """Test the propagation history of DNS zones"""
+
+    def setUp(self):
+        super().setUp()
+        self.path = account_state_path(self.tempdir, "propagation", "faketoken1234")
+
+    def test_add_and_save(self):
+        """Samples of parallel runs are merged and bounded per zone"""
+        first = PropagationStats(self.path, history=3)
+        second = PropagationStats(self.path, history=3)
+        first.add("example.com", 10, "valid")
+        second.add("example.com", 20, "invalid")
+        second.add("example.org", 5.5, "propagated")
+        self.assertEqual([], PropagationStats(self.path).samples("example.com"))
+
+        first.save()
+        second.save()
+        second.add("example.com", 40, "valid")
+        second.add("example.com", 40, "valid")
+        second.save()
+
+        stats = PropagationStats(self.path, history=3)
+        self.assertEqual(
+            [20, 40, 40], [s["seconds"] for s in stats.samples("example.com")]
+        )
+        self.assertEqual(
+            ["propagated"], [s["outcome"] for s in stats.samples("example.org")]
+        )
+
+    def test_invalid_stats(self):
+        """Unreadable stats and incomplete samples are ignored"""
+        write_json_atomic(self.path, {"zones": {"example.com": [{"seconds": 1}, 2]}})
+        self.assertEqual([], PropagationStats(self.path).samples("example.com"))
+
+
+class ResponseCacheTest(test_util.TempDirTestCase):
+    """Test the cache of Service API responses"""
+
+    def setUp(self):
+        super().setUp()
+        self.path = account_state_path(self.tempdir, "responses", "faketoken1234")
+
+    def test_lru_eviction(self):
+        """The least recently used entries are evicted beyond the size"""
+        cache = ResponseCache(10)
+        cache.put("a", "zones", "aaaa", '"1"', None)
+        cache.put("b", "zones", "bbbb", '"2"', None)
+        self.assertEqual('"1"', cache.get("a")["etag"])
+        cache.put("c", "zones", "cccc", None, "Mon, 06 Oct 2025 10:00:00 GMT")
+        cache.put("d", "zones", "d" * 11, '"4"', None)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual("aaaa", cache.get("a")["content"])
+        self.assertEqual("cccc", cache.get("c")["content"])
+
+    def test_save_and_invalidate(self):
+        """Entries are shared through the file, invalidated scopes removed"""
+        first = ResponseCache(100, self.path)
+        first.put("zones", "zones", '{"_data": []}', '"1"', None)
+        first.put("records", "zone-123", '{"_data": []}', '"2"', None)
+        first.save()
+
+        second = ResponseCache(100, self.path)
+        self.assertEqual('"2"', second.get("records")["etag"])
+        second.invalidate("zone-123")
+        self.assertIsNone(second.get("records"))
+        second.save()
+
+        third = ResponseCache(100, self.path)
+        self.assertIsNone(third.get("records"))
+        self.assertEqual('"1"', third.get("zones")["etag"])
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover
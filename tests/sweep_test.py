@@ -0,0 +1,114 @@
+"""Tests for certbot_dns_norisnetwork.sweep."""
+
+import io
+import time
+import unittest
+
+from contextlib import redirect_stdout
+from unittest import mock
+
+from certbot.compat import os
+from certbot.plugins import dns_test_common
+from certbot.tests import util as test_util
+
+from certbot_dns_norisnetwork import sweep
+from certbot_dns_norisnetwork.serviceapi import _ServiceAPIClient
+from certbot_dns_norisnetwork.models import ResourceRecord
+
+from fake_serviceapi import FakeServiceAPI
+
+VALIDATION = '"' + "a" * 43 + '"'
+DAY = 86400
+
+
+class SweepStaleChallengesTest(test_util.TempDirTestCase):
+    """Test the sweeping of stale challenge records against a local fake Service API"""
+
+    def setUp(self):
+        super().setUp()
+        self.api = FakeServiceAPI()
+        self.api.start()
+        self.addCleanup(self.api.stop)
+
+        base_path = mock.patch(
+            "certbot_dns_norisnetwork.serviceapi.API_BASE_PATH",
+            self.api.base_url + "/v1/api",
+        )
+        base_path.start()
+        self.addCleanup(base_path.stop)
+
+        old = time.time() - 2 * DAY
+        self.zones = {}
+        for name in ("example.com", "example.org"):
+            zone_id = self.api.add_zone(name, 3)
+            self.zones[zone_id] = {
+                "stale": {
+                    self.api.add_txt_record(
+                        zone_id, "_acme-challenge", VALIDATION, old
+                    ),
+                    self.api.add_txt_record(
+                        zone_id, "_acme-challenge.www", VALIDATION, old
+                    ),
+                },
+                "kept": {
+                    # too recent
+                    self.api.add_txt_record(zone_id, "_acme-challenge", VALIDATION),
+                    # not a dns-01 validation
+                    self.api.add_txt_record(zone_id, "_acme-challenge", '"foo"', old),
+                    # not a challenge record
+                    self.api.add_txt_record(zone_id, "www", VALIDATION, old),
+                },
+            }
+        self.api.reset_counters()
+
+        self.client = _ServiceAPIClient("faketoken1234", concurrency=2)
+        self.addCleanup(self.client.close)
+
+    def _remaining_ids(self, zone_id):
+        return {rr["id"] for rr in self.api.txt_records(zone_id)}
+
+    def test_sweep(self):
+        """Stale challenge records are deleted with one request per zone"""
+        stale = sweep.sweep_stale_challenges(self.client, DAY)
+
+        self.assertEqual({"example.com", "example.org"}, set(stale))
+        for zone_id, records in self.zones.items():
+            self.assertEqual(records["kept"], self._remaining_ids(zone_id))
+        self.assertEqual(2, self.api.requests[("PATCH", "/data/dns/zone/{id}/")])
+
+    def test_dry_run(self):
+        """A dry run finds the stale records without deleting them"""
+        stale = sweep.sweep_stale_challenges(self.client, DAY, dry_run=True)
+
+        for zone_id, records in self.zones.items():
+            zone_name = self.api.zones[zone_id]["name"]
+            self.assertEqual(records["stale"], {rr.id for rr in stale[zone_name]})
+            self.assertEqual(
+                records["stale"] | records["kept"], self._remaining_ids(zone_id)
+            )
+        self.assertEqual(0, self.api.requests[("PATCH", "/data/dns/zone/{id}/")])
+
+    def test_undated_records(self):
+        """Records without timestamp are only deleted on request"""
+        record = ResourceRecord(1, "_acme-challenge", "TXT", VALIDATION)
+        cutoff = time.time()
+        self.assertFalse(sweep.is_stale_challenge(record, cutoff, False))
+        self.assertTrue(sweep.is_stale_challenge(record, cutoff, True))
+
+    def test_main(self):
+        """The command line tool lists the deleted records"""
+        credentials = os.path.join(self.tempdir, "file.ini")
+        dns_test_common.write({"dns_noris_token": "faketoken1234"}, credentials)
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            exit_code = sweep.main(["--credentials", credentials, "--max-age", "3600"])
+
+        self.assertEqual(0, exit_code)
+        self.assertEqual(4, output.getvalue().count("Deleted: _acme-challenge"))
+        for zone_id, records in self.zones.items():
+            self.assertEqual(records["kept"], self._remaining_ids(zone_id))
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover
@@ -0,0 +1,104 @@
+"""Tests for certbot_dns_norisnetwork.tracing."""
+
+import json
+import threading
+import unittest
+
+from certbot.compat import os
+from certbot.tests import util as test_util
+
+from certbot_dns_norisnetwork.tracing import NULL_TRACER, Tracer
+
+
+class NullTracerTest(unittest.TestCase):
+    """Test the tracer used when tracing is disabled"""
+
+    def test_span(self):
+        """Spans can be opened and tagged without recording anything"""
+        with NULL_TRACER.span("perform", domain="example.com") as span:
+            span["zone_id"] = 123
+        self.assertIs(span, NULL_TRACER.span("cleanup"))
+
+    def test_wrap(self):
+        """Functions are not wrapped"""
+        self.assertIs(len, NULL_TRACER.wrap(len))
+
+
+class TracerTest(test_util.TempDirTestCase):
+    """Test the recording and export of spans"""
+
+    def setUp(self):
+        super().setUp()
+        self.tracer = Tracer()
+        with self.tracer.span("perform", challenges=2):
+            with self.tracer.span("find_managed_zone_id", domain="example.com") as span:
+                span["zone_id"] = 123
+            try:
+                with self.tracer.span("insert_txt_records", zone_id=123):
+                    raise ValueError("boom")
+            except ValueError:
+                pass
+
+    def test_chrome_trace(self):
+        """Spans are exported as complete events, tagged with their attributes"""
+        events = self.tracer.to_chrome_trace()["traceEvents"]
+
+        self.assertEqual(
+            ["perform", "find_managed_zone_id", "insert_txt_records"],
+            [event["name"] for event in events],
+        )
+        self.assertEqual({"domain": "example.com", "zone_id": "123"}, events[1]["args"])
+        self.assertEqual("boom", events[2]["args"]["error"])
+        for event in events[1:]:
+            self.assertEqual("X", event["ph"])
+            self.assertGreaterEqual(event["ts"], events[0]["ts"])
+            self.assertLessEqual(
+                event["ts"] + event["dur"], events[0]["ts"] + events[0]["dur"]
+            )
+
+    def test_otlp(self):
+        """Spans are exported as OTLP JSON with their parent span"""
+        spans = self.tracer.to_otlp()["resourceSpans"][0]["scopeSpans"][0]["spans"]
+
+        self.assertEqual("", spans[0]["parentSpanId"])
+        for span in spans[1:]:
+            self.assertEqual(spans[0]["spanId"], span["parentSpanId"])
+            self.assertEqual(self.tracer.trace_id, span["traceId"])
+        self.assertIn(
+            {"key": "zone_id", "value": {"stringValue": "123"}},
+            spans[1]["attributes"],
+        )
+
+    def test_wrap(self):
+        """Spans opened on other threads are children of the wrapping span"""
+        tracer = Tracer()
+
+        def work():
+            with tracer.span("delete_txt_records"):
+                pass
+
+        with tracer.span("cleanup"):
+            thread = threading.Thread(target=tracer.wrap(work))
+            thread.start()
+            thread.join()
+
+        spans = tracer.to_otlp()["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        self.assertEqual(["cleanup", "delete_txt_records"], [s["name"] for s in spans])
+        self.assertEqual(spans[0]["spanId"], spans[1]["parentSpanId"])
+
+    def test_write(self):
+        """The format of the trace file depends on its extension"""
+        chrome_path = os.path.join(self.tempdir, "trace.json")
+        otlp_path = os.path.join(self.tempdir, "trace.otlp.json")
+
+        self.tracer.write(chrome_path)
+        self.tracer.write(otlp_path)
+
+        with open(chrome_path, encoding="utf-8") as trace_file:
+            self.assertIn("traceEvents", json.load(trace_file))
+        with open(otlp_path, encoding="utf-8") as trace_file:
+            self.assertIn("resourceSpans", json.load(trace_file))
+
+
+if __name__ == "__main__":
+    unittest.main()  # pragma: no cover